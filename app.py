@@ -1,9 +1,15 @@
 import customtkinter as ctk
 from datetime import datetime, date, timedelta
 import db.db_funcs as db
+import db.views as views
+from db.row_store import mask_and
+from db.search_index import SearchIndex
+from db.snapshot import CatalogSnapshot, restore_private_columns, snapshot_stamp, sync_rows
 from tkinter import messagebox, ttk
 import threading
+import time
 import sys
+import os
 
 # Настройка темы
 ctk.set_appearance_mode("dark")
@@ -18,8 +24,7 @@ class LibraryApp(ctk.CTk):
         self.geometry("900x400")
         self.minsize(700, 750)
 
-        # Создаем сессию для работы с БД
-        self.session = db.get_session()
+        # Сессии БД создаются на каждую операцию (db.session_scope)
         self.current_user = None  # Текущий авторизованный пользователь
         self.is_running = True  # Флаг для отслеживания состояния приложения
 
@@ -131,6 +136,7 @@ class LibraryApp(ctk.CTk):
         """
         ctk.CTkLabel(info_frame, text=info_text, justify="left").pack(anchor="w", pady=10)
 
+    @db.instrumented()
     def load_statistics(self):
         """Загрузка статистики в отдельном потоке"""
         try:
@@ -139,10 +145,8 @@ class LibraryApp(ctk.CTk):
                 return
 
             # Получаем статистику
-            readers_count = db.get_readers_count(self.session)
-            books_count = db.get_books_count(self.session)
-            active_loans = len(db.get_active_loans(self.session))
-            unpaid_fines = len(db.get_unpaid_fines(self.session))
+            with db.session_scope() as session:
+                readers_count, books_count, active_loans, unpaid_fines = views.statistics_counts(session)
 
             # Проверяем again, что приложение еще работает
             if self.is_running:
@@ -223,7 +227,8 @@ class LibraryApp(ctk.CTk):
     def _authenticate_thread(self, email, password):
         """Поток для аутентификации"""
         try:
-            result = db.authenticate_librarian(self.session, email, password)
+            with db.session_scope() as session:
+                result = db.authenticate_librarian(session, email, password)
             if self.is_running:
                 self.after(0, self._handle_auth_result, result)
         except Exception as e:
@@ -254,6 +259,9 @@ class LibraryApp(ctk.CTk):
             # Очищаем поля авторизации
             self.auth_email.delete(0, "end")
             self.auth_password.delete(0, "end")
+        elif isinstance(user, db.LoginRefused):
+            messagebox.showwarning("Вход временно недоступен", "Слишком много попыток входа, повторите позже")
+            self.login_btn.configure(text="Войти", state="normal")
         else:
             messagebox.showerror("Ошибка", "Неверный email или пароль")
             self.login_btn.configure(text="Войти", state="normal")
@@ -284,10 +292,6 @@ class LibraryApp(ctk.CTk):
         # Устанавливаем флаг, что приложение закрывается
         self.is_running = False
 
-        # Закрываем сессию БД
-        if self.session:
-            db.close_session(self.session)
-
         # Закрываем текущее окно
         self.destroy()
 
@@ -311,20 +315,61 @@ class LibraryApp(ctk.CTk):
     def on_closing(self):
         """Обработчик закрытия окна"""
         self.is_running = False
-        if hasattr(self, 'session'):
-            db.close_session(self.session)
         self.destroy()
 
 
 class FullLibraryApp(ctk.CTk):
     """Полная версия приложения с вкладками"""
 
+    # Поля, по которым ищет строка поиска каждой вкладки
+    SEARCH_FIELDS = {
+        'books': ('title', 'author', 'isbn', 'genre'),
+        'copies': ('book_title', 'inventory_number'),
+        'readers': ('name', 'email', 'phone'),
+        'loans': ('reader_name', 'book_title', 'inventory_number'),
+        'fines': ('reader_name', 'book_title', 'amount', 'loan_id'),
+        'librarians': ('name', 'email', 'position'),
+    }
+
+    # Сортируемые колонки таблиц вкладок: колонка Treeview -> порядок сортировки в db_funcs.SORT_ORDERS
+    SORT_COLUMNS = {
+        'books': {'ID': 'id', 'Title': 'title', 'Author': 'author'},
+        'copies': {'ID': 'id', 'InvNumber': 'inventory_number'},
+        'readers': {'ID': 'id', 'Name': 'name', 'RegDate': 'registration_date'},
+        'loans': {'ID': 'id', 'IssueDate': 'loan_date', 'DueDate': 'return_date'},
+        'fines': {'ID': 'id', 'Amount': 'amount', 'IssuedDate': 'issued_date'},
+        'librarians': {'ID': 'id', 'Name': 'name', 'HireDate': 'hire_date'},
+    }
+
+    # Вкладки строятся (и загружают данные) при первом открытии: вкладка -> метод построения
+    TAB_SETUP = {
+        "Читатели": 'setup_readers_tab',
+        "Книги": 'setup_books_tab',
+        "Выдачи": 'setup_loans_tab',
+        "Штрафы": 'setup_fines_tab',
+        "Библиотекари": 'setup_librarians_tab',
+    }
+
+    # Строки самой используемой вкладки загружаются в фоне сразу после входа
+    PREFETCH = ('loans', views.loan_rows)
+    # Фоновая загрузка старше этого (секунды) не используется - вкладка загрузит строки заново
+    PREFETCH_MAX_AGE = 60
+
+    # Вкладки каталога, строки которых сохраняются в локальный снимок для быстрого запуска
+    SNAPSHOT_VIEWS = {'books': views.book_rows, 'copies': views.copy_rows}
+
     def __init__(self, user):
         super().__init__()
 
         self.current_user = user
-        self.session = db.get_session()
         self.is_running = True
+        self.search_indexes = {}
+        self.sort_states = {}
+        self.sort_headings = {}
+        self.built_tabs = set()
+        self.prefetched = {}
+        self.catalog_snapshot = CatalogSnapshot()
+        self.snapshot_tables = set()
 
         self.title(f"📚 Библиотечная система - {user.name}")
         self.geometry("1200x500")
@@ -337,7 +382,7 @@ class FullLibraryApp(ctk.CTk):
 
     def setup_ui(self):
         # Создаем вкладки
-        self.tabview = ctk.CTkTabview(self)
+        self.tabview = ctk.CTkTabview(self, command=self.on_tab_change)
         self.tabview.pack(fill="both", expand=True, padx=20, pady=20)
 
         # Добавляем вкладки
@@ -368,12 +413,44 @@ class FullLibraryApp(ctk.CTk):
                       fg_color="#F72585",
                       hover_color="#B5179E").pack(side="right")
 
+        self.prefetch_tab_data(*self.PREFETCH)
+
+    def on_tab_change(self):
+        """Построение вкладки при первом открытии"""
+        self.ensure_tab(self.tabview.get())
+
+    def ensure_tab(self, name):
+        if name in self.built_tabs or name not in self.TAB_SETUP:
+            return
+        self.built_tabs.add(name)
+        getattr(self, self.TAB_SETUP[name])()
+
+    def prefetch_tab_data(self, table, fetch):
+        """Загрузка строк вкладки в фоновом потоке, пока вкладка еще не открыта"""
+        def worker():
+            fetched_at = time.monotonic()
+            try:
+                with db.session_scope() as session:
+                    result = fetch(session)
+            except Exception:
+                # Вкладка загрузит данные сама при открытии
+                return
+            if self.is_running:
+                self.after(0, self.store_prefetched, table, (fetched_at, result))
+
+        threading.Thread(target=worker, daemon=True).start()
 
-        self.setup_readers_tab()
-        self.setup_books_tab()
-        self.setup_loans_tab()
-        self.setup_fines_tab()
-        self.setup_librarians_tab()
+    def store_prefetched(self, table, result):
+        # Вкладку уже открыли и загрузили без ожидания фоновой загрузки
+        if not hasattr(self, f'all_{table}'):
+            self.prefetched[table] = result
+
+    def take_prefetched(self, table):
+        """Строки фоновой загрузки вкладки, если они не старше PREFETCH_MAX_AGE, иначе None"""
+        fetched_at, result = self.prefetched.pop(table, (None, None))
+        if fetched_at is None or time.monotonic() - fetched_at > self.PREFETCH_MAX_AGE:
+            return None
+        return result
 
     def setup_books_tab(self):
         """Настройка вкладки Книги с двумя режимами"""
@@ -538,6 +615,7 @@ class FullLibraryApp(ctk.CTk):
         for col_id, heading, width in columns_config:
             self.loans_tree.heading(col_id, text=heading)
             self.loans_tree.column(col_id, width=width)
+        self.bind_sort_headings('loans', self.loans_tree, columns_config)
 
         # Полоса прокрутки
         scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.loans_tree.yview)
@@ -689,6 +767,7 @@ class FullLibraryApp(ctk.CTk):
         for col_id, heading, width in columns_config:
             self.fines_tree.heading(col_id, text=heading)
             self.fines_tree.column(col_id, width=width)
+        self.bind_sort_headings('fines', self.fines_tree, columns_config)
 
         # Полоса прокрутки
         scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.fines_tree.yview)
@@ -846,6 +925,7 @@ class FullLibraryApp(ctk.CTk):
         for col_id, heading, width in columns_config:
             self.librarians_tree.heading(col_id, text=heading)
             self.librarians_tree.column(col_id, width=width)
+        self.bind_sort_headings('librarians', self.librarians_tree, columns_config)
 
         # Полоса прокрутки
         scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.librarians_tree.yview)
@@ -958,6 +1038,7 @@ class FullLibraryApp(ctk.CTk):
         for col_id, heading, width in columns_config:
             self.books_tree.heading(col_id, text=heading)
             self.books_tree.column(col_id, width=width)
+        self.bind_sort_headings('books', self.books_tree, columns_config)
 
         scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.books_tree.yview)
         self.books_tree.configure(yscrollcommand=scrollbar.set)
@@ -1065,6 +1146,7 @@ class FullLibraryApp(ctk.CTk):
         for col_id, heading, width in columns_config:
             self.copies_tree.heading(col_id, text=heading)
             self.copies_tree.column(col_id, width=width)
+        self.bind_sort_headings('copies', self.copies_tree, columns_config)
 
         scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.copies_tree.yview)
         self.copies_tree.configure(yscrollcommand=scrollbar.set)
@@ -1088,35 +1170,18 @@ class FullLibraryApp(ctk.CTk):
             self.copies_frame.pack(fill="both", expand=True)
             self.load_book_copies()
 
+    @db.instrumented()
     def load_books(self):
         """Загрузка списка книг с информацией об экземплярах"""
         try:
-            books = db.get_all_books(self.session)
-            self.all_books = []
-
-            for book in books:
-                # Получаем информацию об экземплярах
-                copies = db.get_copies_by_book(self.session, book.id)
-                total_copies = len(copies)
-                available_copies = len(
-                    [c for c in copies if c.available == True])  # Используем поле available вместо status
-
-                # Получаем жанры книги
-                genres = book.genres
-                genre_names = [genre.name for genre in genres] if genres else []
-                genre_display = ", ".join(genre_names) if genre_names else "Не указан"
-
-                self.all_books.append({
-                    'id': book.id,
-                    'title': book.title,
-                    'author': book.author,
-                    'isbn': book.isbn,
-                    'year': book.publish_year,
-                    'genre': genre_display,  # Теперь это строка с названиями жанров
-                    'total_copies': total_copies,
-                    'available_copies': available_copies
-                })
-
+            if not hasattr(self, 'all_books') and self.show_snapshot('books'):
+                return
+            with db.session_scope() as session:
+                stamp = snapshot_stamp(session, 'books')
+                self.all_books = views.book_rows(session)
+                self.all_books = self.sorted_rows(session, 'books', self.all_books)
+            self.save_snapshot('books', self.all_books, stamp)
+            self.update_search_index('books', self.all_books)
             self.apply_books_filter(self.books_filter.get())
 
         except Exception as e:
@@ -1127,16 +1192,17 @@ class FullLibraryApp(ctk.CTk):
         if not hasattr(self, 'all_books'):
             return
 
+        books = self.all_books
         filtered_books = []
 
         if choice == "Все книги":
-            filtered_books = self.all_books
+            filtered_books = books
         elif choice == "Есть в наличии":
-            filtered_books = [b for b in self.all_books if b['available_copies'] > 0]
+            filtered_books = books.where(books.mask('available_copies', '>', 0))
         elif choice == "Нет в наличии":
-            filtered_books = [b for b in self.all_books if b['available_copies'] == 0]
+            filtered_books = books.where(books.mask('available_copies', '==', 0))
         elif choice == "Мало экземпляров (1-2)":
-            filtered_books = [b for b in self.all_books if 1 <= b['available_copies'] <= 2]
+            filtered_books = books.where(books.mask('available_copies', 'in', {1, 2}))
 
         self.display_books(filtered_books)
 
@@ -1147,13 +1213,7 @@ class FullLibraryApp(ctk.CTk):
             self.apply_books_filter(self.books_filter.get())
             return
 
-        filtered_books = []
-        for book in self.all_books:
-            if (search_term in book['title'].lower() or
-                    search_term in book['author'].lower() or
-                    (book['isbn'] and search_term in book['isbn'].lower()) or
-                    (book['genre'] and search_term in book['genre'].lower())):
-                filtered_books.append(book)
+        filtered_books = self.search_indexes['books'].filter(search_term)
 
         self.display_books(filtered_books)
 
@@ -1176,48 +1236,18 @@ class FullLibraryApp(ctk.CTk):
 
         self.books_count_label.configure(text=f"Всего: {len(books)}")
 
+    @db.instrumented()
     def load_book_copies(self):
         """Загрузка списка экземпляров книг"""
         try:
-            copies = db.get_all_book_copies(self.session)
-            self.all_copies = []
-
-            for copy in copies:
-                book = db.get_book_by_id(self.session, copy.book_id)
-                reader_name = "-"
-                due_date = "-"
-
-                # Если книга выдана, получаем информацию о читателе
-                if not copy.available:  # Используем поле available
-                    loan = db.get_active_loan_by_copy(self.session, copy.id)
-                    if loan:
-                        reader = db.get_reader_by_id(self.session, loan.reader_id)
-                        reader_name = reader.name if reader else "-"
-                        due_date = loan.return_date.strftime("%d.%m.%Y") if loan.return_date else "-"
-
-                # Определяем статус текстом
-                if copy.available:
-                    status_text = "В наличии"
-                else:
-                    # Проверяем просрочку
-                    loan = db.get_active_loan_by_copy(self.session, copy.id)
-                    if loan and loan.return_date and loan.return_date < date.today():
-                        status_text = "Просрочена"
-                    else:
-                        status_text = "На руках"
-
-                self.all_copies.append({
-                    'id': copy.id,
-                    'inventory_number': copy.inventory_number,
-                    'book_title': book.title if book else "Неизвестно",
-                    'author': book.author if book else "Неизвестно",
-                    'status': status_text,
-                    'due_date': due_date,
-                    'reader': reader_name,
-                    'condition': copy.condition,
-                    'copy_obj': copy
-                })
-
+            if not hasattr(self, 'all_copies') and self.show_snapshot('copies'):
+                return
+            with db.session_scope() as session:
+                stamp = snapshot_stamp(session, 'copies')
+                self.all_copies = views.copy_rows(session)
+                self.all_copies = self.sorted_rows(session, 'copies', self.all_copies)
+            self.save_snapshot('copies', self.all_copies, stamp)
+            self.update_search_index('copies', self.all_copies)
             self.apply_copies_filter(self.copies_filter.get())
 
         except Exception as e:
@@ -1239,18 +1269,19 @@ class FullLibraryApp(ctk.CTk):
         if not hasattr(self, 'all_copies'):
             return
 
+        copies = self.all_copies
         filtered_copies = []
 
         if choice == "Все экземпляры":
-            filtered_copies = self.all_copies
+            filtered_copies = copies
         elif choice == "В наличии":
-            filtered_copies = [c for c in self.all_copies if c['copy_obj'].status == 'available']
+            filtered_copies = copies.where(copies.mask('copy_status', '==', 'available'))
         elif choice == "На руках":
-            filtered_copies = [c for c in self.all_copies if c['copy_obj'].status == 'borrowed']
+            filtered_copies = copies.where(copies.mask('copy_status', '==', 'borrowed'))
         elif choice == "Просрочены":
-            filtered_copies = [c for c in self.all_copies if c['copy_obj'].status == 'overdue']
+            filtered_copies = copies.where(copies.mask('copy_status', '==', 'overdue'))
         elif choice == "Списаны":
-            filtered_copies = [c for c in self.all_copies if c['copy_obj'].status == 'written_off']
+            filtered_copies = copies.where(copies.mask('copy_status', '==', 'written_off'))
 
         self.display_copies(filtered_copies)
 
@@ -1261,11 +1292,7 @@ class FullLibraryApp(ctk.CTk):
             self.apply_copies_filter(self.copies_filter.get())
             return
 
-        filtered_copies = []
-        for copy in self.all_copies:
-            if (search_term in copy['book_title'].lower() or
-                    search_term in copy['inventory_number'].lower()):
-                filtered_copies.append(copy)
+        filtered_copies = self.search_indexes['copies'].filter(search_term)
 
         self.display_copies(filtered_copies)
 
@@ -1344,7 +1371,8 @@ class FullLibraryApp(ctk.CTk):
         genres_scrollable.pack(fill="x", pady=5)
 
         # Получаем список жанров из базы данных
-        genres = db.get_all_genres(self.session)
+        with db.session_scope() as session:
+            genres = db.get_all_genres(session)
         genre_vars = {}
 
         # Создаем чекбоксы для каждого жанра
@@ -1379,18 +1407,20 @@ class FullLibraryApp(ctk.CTk):
                     'description': entries['description'].get("1.0", "end-1c").strip() or None
                 }
 
-                result = db.create_book(self.session, **book_data)
-                if result:
-                    # Добавляем выбранные жанры к книге
-                    selected_genre_vars = entries['genres']
+                with db.session_scope() as session:
+                    result = db.create_book(session, **book_data)
                     added_genres_count = 0
+                    if result:
+                        # Добавляем выбранные жанры к книге
+                        selected_genre_vars = entries['genres']
 
-                    for genre_id, var in selected_genre_vars.items():
-                        if var.get():
-                            success = db.add_genre_to_book(self.session, result.id, genre_id)
-                            if success:
-                                added_genres_count += 1
+                        for genre_id, var in selected_genre_vars.items():
+                            if var.get():
+                                success = db.add_genre_to_book(session, result.id, genre_id)
+                                if success:
+                                    added_genres_count += 1
 
+                if result:
                     success_message = f"Книга '{title}' успешно добавлена!"
                     if added_genres_count > 0:
                         success_message += f"\nДобавлено жанров: {added_genres_count}"
@@ -1446,7 +1476,8 @@ class FullLibraryApp(ctk.CTk):
         ctk.CTkLabel(form_scrollable, text="Книга:*").pack(anchor="w", pady=(10, 0))
 
         # Получаем список книг для выбора
-        books = db.get_all_books(self.session)
+        with db.session_scope() as session:
+            books = db.get_all_books(session)
         book_options = [f"{book.title} ({book.author})" for book in books]
         book_ids = [book.id for book in books]
 
@@ -1491,7 +1522,8 @@ class FullLibraryApp(ctk.CTk):
                     messagebox.showwarning("Ошибка", "Введите инвентарный номер")
                     return
 
-                result = db.create_book_copy(self.session, book_id, inventory_number, condition, location)
+                with db.session_scope() as session:
+                    result = db.create_book_copy(session, book_id, inventory_number, condition, location)
                 if result:
                     messagebox.showinfo("Успех", "Экземпляр успешно добавлен!")
                     dialog.destroy()
@@ -1524,7 +1556,10 @@ class FullLibraryApp(ctk.CTk):
 
         # Получаем ID выбранной книги
         book_id = self.books_tree.item(selected[0])['values'][0]
-        book = db.get_book_by_id(self.session, book_id)
+        with db.session_scope() as session:
+            book = db.get_book_by_id(session, book_id)
+            # Жанры загружаются, пока сессия открыта
+            current_genre_ids = [genre.id for genre in book.genres] if book else []
 
         if not book:
             messagebox.showerror("Ошибка", "Книга не найдена")
@@ -1594,12 +1629,10 @@ class FullLibraryApp(ctk.CTk):
         genres_scrollable.pack(fill="x", pady=5)
 
         # Получаем список всех жанров из базы данных
-        all_genres = db.get_all_genres(self.session)
+        with db.session_scope() as session:
+            all_genres = db.get_all_genres(session)
         genre_vars = {}  # Словарь для хранения переменных чекбоксов
 
-        # Получаем текущие жанры книги
-        current_genre_ids = [genre.id for genre in book.genres] if book.genres else []
-
         # Создаем чекбоксы для каждого жанра
         for genre in all_genres:
             var = ctk.BooleanVar(value=(genre.id in current_genre_ids))
@@ -1641,7 +1674,8 @@ class FullLibraryApp(ctk.CTk):
                     update_data['publish_year'] = None
 
                 # Обновляем данные книги
-                result = db.update_book(self.session, book_id, **update_data)
+                with db.session_scope() as session:
+                    result = db.update_book(session, book_id, **update_data)
                 if not result:
                     messagebox.showerror("Ошибка", "Не удалось обновить данные книги")
                     return
@@ -1653,7 +1687,8 @@ class FullLibraryApp(ctk.CTk):
                         selected_genre_ids.append(genre_id)
 
                 # Устанавливаем новые жанры
-                genre_result = db.set_book_genres(self.session, book_id, selected_genre_ids)
+                with db.session_scope() as session:
+                    genre_result = db.set_book_genres(session, book_id, selected_genre_ids)
 
                 if genre_result:
                     messagebox.showinfo("Успех", f"Книга '{title}' успешно обновлена!")
@@ -1695,7 +1730,8 @@ class FullLibraryApp(ctk.CTk):
         book_author = self.books_tree.item(selected[0])['values'][2]
 
         # Проверяем, есть ли связанные экземпляры книги
-        copies = db.get_copies_by_book(self.session, book_id)
+        with db.session_scope() as session:
+            copies = db.get_copies_by_book(session, book_id)
         if copies:
             messagebox.showwarning(
                 "Невозможно удалить",
@@ -1720,7 +1756,8 @@ class FullLibraryApp(ctk.CTk):
 
         try:
             # Выполняем удаление
-            success = db.delete_book(self.session, book_id)
+            with db.session_scope() as session:
+                success = db.delete_book(session, book_id)
             if success:
                 messagebox.showinfo("Успех", f"Книга '{book_title}' успешно удалена!")
                 self.load_books()  # Обновляем список книг
@@ -1745,7 +1782,8 @@ class FullLibraryApp(ctk.CTk):
         current_condition = self.copies_tree.item(selected[0])['values'][5]
 
         # Получаем полную информацию об экземпляре
-        copy = db.get_copy_by_id(self.session, copy_id)
+        with db.session_scope() as session:
+            copy = db.get_copy_by_id(session, copy_id)
         if not copy:
             messagebox.showerror("Ошибка", "Экземпляр не найден")
             return
@@ -1830,7 +1868,8 @@ class FullLibraryApp(ctk.CTk):
                 #     update_data['note'] = note
 
                 # Обновляем экземпляр
-                result = db.update_copy(self.session, copy_id, **update_data)
+                with db.session_scope() as session:
+                    result = db.update_copy(session, copy_id, expected_version=copy.version, **update_data)
                 if result:
                     messagebox.showinfo("Успех", f"Статус экземпляра успешно изменен на '{new_status}'")
                     dialog.destroy()
@@ -1842,7 +1881,7 @@ class FullLibraryApp(ctk.CTk):
                         print(f"Примечание: {note}")
 
                 else:
-                    messagebox.showerror("Ошибка", "Не удалось изменить статус экземпляра")
+                    self.show_update_error(result, "Не удалось изменить статус экземпляра")
 
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка при изменении статуса: {e}")
@@ -1881,13 +1920,123 @@ class FullLibraryApp(ctk.CTk):
             return
 
         try:
-            db.delete_copy(self.session, copy_id)
+            with db.session_scope() as session:
+                db.delete_copy(session, copy_id)
             messagebox.showinfo("Успех", f"Экземпляр {inv_number} списан")
             self.load_book_copies()
             self.load_books()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось списать экземпляр: {e}")
 
+    def update_search_index(self, table, rows):
+        """Обновление индекса поиска вкладки после загрузки строк"""
+        index = self.search_indexes.get(table)
+        if index is None:
+            index = self.search_indexes[table] = SearchIndex(self.SEARCH_FIELDS[table])
+        index.refresh(rows)
+
+    def bind_sort_headings(self, table, tree, columns_config):
+        """Сортировка по щелчку на заголовке для колонок из SORT_COLUMNS"""
+        headings = self.sort_headings[table] = {}
+        for col_id, heading, _ in columns_config:
+            if col_id in self.SORT_COLUMNS[table]:
+                headings[col_id] = heading
+                tree.heading(col_id, command=lambda col_id=col_id: self.sort_table(table, col_id))
+
+    def sorted_rows(self, session, table, rows):
+        """Строки вкладки в выбранном порядке сортировки (порядок id берется с сервера)"""
+        state = self.sort_states.get(table)
+        if state is None or not len(rows):
+            return rows
+        col_id, descending = state
+        ids = db.get_sorted_ids(session, table, self.SORT_COLUMNS[table][col_id], descending)
+
+        row_ids = rows.column('id') if hasattr(rows, 'column') else [row['id'] for row in rows]
+        positions = {row_id: position for position, row_id in enumerate(row_ids)}
+        order = [positions.pop(row_id) for row_id in ids if row_id in positions]
+        # Строки, которых нет в ответе сервера, остаются в конце в прежнем порядке
+        order.extend(sorted(positions.values()))
+        if hasattr(rows, 'take'):
+            return rows.take(order)
+        return [rows[position] for position in order]
+
+    def sort_table(self, table, col_id):
+        """Сортировка таблицы вкладки по колонке, повторный щелчок меняет направление"""
+        rows = getattr(self, f'all_{table}', None)
+        if rows is None:
+            return
+        previous = self.sort_states.get(table)
+        descending = previous is not None and previous[0] == col_id and not previous[1]
+        self.sort_states[table] = (col_id, descending)
+
+        tree = getattr(self, f'{table}_tree')
+        for heading_id, heading in self.sort_headings.get(table, {}).items():
+            arrow = (" ▼" if descending else " ▲") if heading_id == col_id else ""
+            tree.heading(heading_id, text=heading + arrow)
+
+        try:
+            # С сервера загружается только порядок id, строки берутся из кэша вкладки
+            with db.session_scope() as session:
+                rows = self.sorted_rows(session, table, rows)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось отсортировать таблицу: {e}")
+            return
+        self.set_table_rows(table, rows)
+
+    def set_table_rows(self, table, rows):
+        """Замена строк вкладки с сохранением текущего фильтра и поиска"""
+        setattr(self, f'all_{table}', rows)
+        self.update_search_index(table, rows)
+        getattr(self, f'search_{table}')()
+
+    def show_snapshot(self, table):
+        """
+        Показ строк вкладки из локального снимка без обращения к БД.
+        В фоне снимок догоняется до базы по изменениям после его отметки
+        (если их не отнести к строкам - строки загружаются заново)
+        """
+        rows, stamp = self.catalog_snapshot.load(table)
+        if rows is None:
+            return False
+        self.snapshot_tables.add(table)
+        self.set_table_rows(table, rows)
+
+        fetch = self.SNAPSHOT_VIEWS[table]
+
+        def worker():
+            try:
+                with db.session_scope() as session:
+                    result = sync_rows(session, table, rows, stamp)
+                    if result is None:
+                        current = snapshot_stamp(session, table)
+                        synced = fetch(session)
+                    else:
+                        synced, current = result
+                        # Персональные данные в снимок не пишутся - подгружаются из БД
+                        synced = restore_private_columns(session, table, synced)
+                    if synced is not rows:
+                        synced = self.sorted_rows(session, table, synced)
+            except Exception:
+                # Остается снимок, данные обновятся при следующей загрузке вкладки
+                return
+            self.catalog_snapshot.save(table, synced, current)
+            if self.is_running and synced is not rows:
+                self.after(0, self.apply_snapshot_sync, table, synced)
+
+        threading.Thread(target=worker, daemon=True).start()
+        return True
+
+    def apply_snapshot_sync(self, table, rows):
+        # Пока шла сверка, вкладку могли перезагрузить из БД - тогда строки уже свежее
+        if table in self.snapshot_tables:
+            self.snapshot_tables.discard(table)
+            self.set_table_rows(table, rows)
+
+    def save_snapshot(self, table, rows, stamp):
+        """Фоновая запись загруженных из БД строк вкладки в локальный снимок"""
+        self.snapshot_tables.discard(table)
+        threading.Thread(target=self.catalog_snapshot.save, args=(table, rows, stamp), daemon=True).start()
+
     def center_dialog(self, dialog):
         """Центрирование диалогового окна"""
         dialog.update_idletasks()
@@ -1895,11 +2044,33 @@ class FullLibraryApp(ctk.CTk):
         y = self.winfo_y() + (self.winfo_height() - dialog.winfo_height()) // 2
         dialog.geometry(f"+{x}+{y}")
 
+    def show_update_error(self, result, message):
+        """Сообщение о неудачном изменении записи; при конфликте версий - просьба обновить данные"""
+        if isinstance(result, db.UpdateConflict):
+            messagebox.showwarning("Конфликт изменений",
+                                   "Запись изменена другим пользователем, пока открыт диалог.\n"
+                                   "Обновите данные и повторите действие")
+        else:
+            messagebox.showerror("Ошибка", message)
+
+    def run_in_background(self, task, on_success, on_error):
+        """Выполнение долгой операции в отдельном потоке с возвратом результата в основной поток"""
+
+        def worker():
+            try:
+                result = task()
+            except Exception as e:
+                if self.is_running:
+                    self.after(0, on_error, e)
+                return
+            if self.is_running:
+                self.after(0, on_success, result)
+
+        threading.Thread(target=worker, daemon=True).start()
+
     def logout(self):
         """Выход и возврат к экрану авторизации"""
         self.is_running = False
-        if self.session:
-            db.close_session(self.session)
         self.destroy()
 
         # Запускаем новое окно авторизации
@@ -1909,9 +2080,8 @@ class FullLibraryApp(ctk.CTk):
     def on_closing(self):
         """Обработчик закрытия окна"""
         self.is_running = False
-        if hasattr(self, 'session'):
-            db.close_session(self.session)
         self.destroy()
+        db.get_engine().dispose()
         sys.exit(0)
 
     def setup_readers_tab(self):
@@ -2019,6 +2189,7 @@ class FullLibraryApp(ctk.CTk):
         for col_id, heading, width in columns_config:
             self.readers_tree.heading(col_id, text=heading)
             self.readers_tree.column(col_id, width=width)
+        self.bind_sort_headings('readers', self.readers_tree, columns_config)
 
         # Полоса прокрутки
         scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.readers_tree.yview)
@@ -2038,22 +2209,17 @@ class FullLibraryApp(ctk.CTk):
         if not hasattr(self, 'all_readers'):
             return
 
+        readers = self.all_readers
         filtered_readers = []
 
         if choice == "Все читатели":
-            filtered_readers = self.all_readers
+            filtered_readers = readers
         elif choice == "С книгами на руках":
-            for reader in self.all_readers:
-                if reader.get('active_loans', 0) > 0:
-                    filtered_readers.append(reader)
+            filtered_readers = readers.where(readers.mask('active_loans', '>', 0))
         elif choice == "С просрочками":
-            for reader in self.all_readers:
-                if reader.get('overdue', 0) > 0:
-                    filtered_readers.append(reader)
+            filtered_readers = readers.where(readers.mask('overdue', '>', 0))
         elif choice == "Без активных выдач":
-            for reader in self.all_readers:
-                if reader.get('active_loans', 0) == 0:
-                    filtered_readers.append(reader)
+            filtered_readers = readers.where(readers.mask('active_loans', '==', 0))
 
         self.display_readers(filtered_readers)
 
@@ -2064,42 +2230,19 @@ class FullLibraryApp(ctk.CTk):
             self.apply_reader_filter(self.reader_filter.get())
             return
 
-        filtered_readers = []
-        for reader in self.all_readers:
-            if (search_term in reader['name'].lower() or
-                    search_term in reader['email'].lower() or
-                    (reader['phone'] and search_term in reader['phone'])):
-                filtered_readers.append(reader)
+        filtered_readers = self.search_indexes['readers'].filter(search_term)
 
         self.display_readers(filtered_readers)
 
+    @db.instrumented()
     def load_readers(self):
         """Загрузка списка читателей"""
         try:
-            # Получаем всех читателей
-            readers = db.get_all_readers(self.session)
-
-            # Собираем расширенную информацию о каждом читателе
-            self.all_readers = []
-            for reader in readers:
-                # Получаем активные выдачи
-                active_loans = db.get_loans_by_reader(self.session, reader.id, active_only=True)
-
-                # Считаем просрочки
-                overdue_count = 0
-                for loan in active_loans:
-                    if loan.return_date < date.today():
-                        overdue_count += 1
-
-                self.all_readers.append({
-                    'id': reader.id,
-                    'name': reader.name,
-                    'email': reader.email,
-                    'phone': reader.phone_number,
-                    'reg_date': reader.registration_date,
-                    'active_loans': len(active_loans),
-                    'overdue': overdue_count
-                })
+            # Читатели с количеством активных и просроченных выдач
+            with db.session_scope() as session:
+                self.all_readers = views.reader_rows(session)
+                self.all_readers = self.sorted_rows(session, 'readers', self.all_readers)
+            self.update_search_index('readers', self.all_readers)
 
             # Применяем текущий фильтр
             self.apply_reader_filter(self.reader_filter.get())
@@ -2172,7 +2315,8 @@ class FullLibraryApp(ctk.CTk):
                 return
 
             try:
-                result = db.create_reader(self.session, name, email, phone)
+                with db.session_scope() as session:
+                    result = db.create_reader(session, name, email, phone)
                 if result:
                     messagebox.showinfo("Успех", f"Читатель {name} успешно добавлен!")
                     dialog.destroy()
@@ -2204,7 +2348,8 @@ class FullLibraryApp(ctk.CTk):
         reader_id = item['values'][0]
 
         try:
-            reader = db.get_reader_by_id(self.session, reader_id)
+            with db.session_scope() as session:
+                reader = db.get_reader_by_id(session, reader_id)
             if not reader:
                 messagebox.showerror("Ошибка", "Читатель не найден")
                 return
@@ -2255,7 +2400,8 @@ class FullLibraryApp(ctk.CTk):
                     return
 
                 try:
-                    result = db.update_reader(self.session, reader_id, name=name, email=email, phone_number=phone)
+                    with db.session_scope() as session:
+                        result = db.update_reader(session, reader_id, name=name, email=email, phone_number=phone)
                     if result:
                         messagebox.showinfo("Успех", "Данные читателя обновлены!")
                         dialog.destroy()
@@ -2292,7 +2438,8 @@ class FullLibraryApp(ctk.CTk):
 
         # Проверяем активные выдачи
         try:
-            active_loans = db.get_loans_by_reader(self.session, reader_id, active_only=True)
+            with db.session_scope() as session:
+                active_loans = db.get_loans_by_reader(session, reader_id, active_only=True)
             if active_loans:
                 messagebox.showerror("Ошибка",
                                      f"Нельзя удалить читателя {reader_name}!\n"
@@ -2307,80 +2454,25 @@ class FullLibraryApp(ctk.CTk):
             return
 
         try:
-            if db.delete_reader(self.session, reader_id):
+            with db.session_scope() as session:
+                deleted = db.delete_reader(session, reader_id)
+            if deleted:
                 messagebox.showinfo("Успех", f"Читатель {reader_name} удален")
                 self.load_readers()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось удалить читателя: {e}")
 
+    @db.instrumented()
     def load_loans(self):
         """Загрузка списка выдач"""
         try:
-            # Получаем все выдачи
-            loans = db.get_all_loans(self.session)
-
-            # Собираем расширенную информацию о каждой выдаче
-            self.all_loans = []
-            self.active_loans_count = 0
-            self.overdue_loans_count = 0
-            self.today_return_count = 0
-
-            for loan in loans:
-                # Получаем информацию о читателе
-                reader = db.get_reader_by_id(self.session, loan.reader_id)
-                reader_name = reader.name if reader else "Неизвестно"
-
-                # Получаем информацию об экземпляре и книге
-                copy = db.get_copy_by_id(self.session, loan.copy_id)
-                if copy:
-                    book = db.get_book_by_id(self.session, copy.book_id)
-                    book_title = book.title if book else "Неизвестно"
-                    inventory_number = copy.inventory_number
-                else:
-                    book_title = "Неизвестно"
-                    inventory_number = "N/A"
-
-                # Определяем статус
-                if loan.returned:
-                    status_text = "🟦 Возвращена"
-                    status_color = ""
-                else:
-                    if loan.return_date < date.today():
-                        status_text = "🔴 Просрочена"
-                        status_color = "red"
-                        self.overdue_loans_count += 1
-                    elif (loan.return_date - date.today()).days <= 3:
-                        status_text = "🟡 Скоро срок"
-                        status_color = "orange"
-                    else:
-                        status_text = "🟢 Активна"
-                        status_color = "green"
-
-                    self.active_loans_count += 1
-
-                    # Проверяем, нужно ли вернуть сегодня
-                    if loan.return_date == date.today():
-                        self.today_return_count += 1
-
-                # Форматируем даты
-                issue_date = loan.loan_date.strftime("%d.%m.%Y") if loan.loan_date else "-"
-                due_date = loan.return_date.strftime("%d.%m.%Y") if loan.return_date else "-"
-
-                self.all_loans.append({
-                    'id': loan.id,
-                    'reader_name': reader_name,
-                    'reader_id': loan.reader_id,
-                    'book_title': book_title,
-                    'inventory_number': inventory_number,
-                    'issue_date': loan.loan_date,
-                    'due_date': loan.return_date,
-                    'actual_return_date': loan.actual_return_date,
-                    'returned': loan.returned,
-                    'status_text': status_text,
-                    'status_color': status_color,
-                    'copy_id': loan.copy_id,
-                    'loan_obj': loan
-                })
+            with db.session_scope() as session:
+                self.all_loans, counters = self.take_prefetched('loans') or views.loan_rows(session)
+                self.all_loans = self.sorted_rows(session, 'loans', self.all_loans)
+            self.update_search_index('loans', self.all_loans)
+            self.active_loans_count = counters['active']
+            self.overdue_loans_count = counters['overdue']
+            self.today_return_count = counters['today_return']
 
             # Обновляем статистику
             self.update_loans_stats()
@@ -2402,21 +2494,22 @@ class FullLibraryApp(ctk.CTk):
         if not hasattr(self, 'all_loans'):
             return
 
+        loans = self.all_loans
         filtered_loans = []
         today = date.today()
 
         if choice == "Все выдачи":
-            filtered_loans = self.all_loans
+            filtered_loans = loans
         elif choice == "Активные выдачи":
-            filtered_loans = [loan for loan in self.all_loans if not loan['returned']]
+            filtered_loans = loans.where(loans.mask('returned', '==', False))
         elif choice == "Просроченные":
-            filtered_loans = [loan for loan in self.all_loans
-                              if not loan['returned'] and loan['due_date'] < today]
+            filtered_loans = loans.where(mask_and(loans.mask('returned', '==', False),
+                                                  loans.mask('due_date', '<', today)))
         elif choice == "Возвращенные":
-            filtered_loans = [loan for loan in self.all_loans if loan['returned']]
+            filtered_loans = loans.where(loans.mask('returned', '==', True))
         elif choice == "Сегодня к возврату":
-            filtered_loans = [loan for loan in self.all_loans
-                              if not loan['returned'] and loan['due_date'] == today]
+            filtered_loans = loans.where(mask_and(loans.mask('returned', '==', False),
+                                                  loans.mask('due_date', '==', today)))
 
         self.display_loans(filtered_loans)
 
@@ -2427,12 +2520,7 @@ class FullLibraryApp(ctk.CTk):
             self.apply_loans_filter(self.loans_filter.get())
             return
 
-        filtered_loans = []
-        for loan in self.all_loans:
-            if (search_term in loan['reader_name'].lower() or
-                    search_term in loan['book_title'].lower() or
-                    search_term in loan['inventory_number'].lower()):
-                filtered_loans.append(loan)
+        filtered_loans = self.search_indexes['loans'].filter(search_term)
 
         self.display_loans(filtered_loans)
 
@@ -2680,24 +2768,25 @@ class FullLibraryApp(ctk.CTk):
                                          f"Максимальный лимит - 3 книги.")
                     return
 
-                # Получаем доступные экземпляры книги
-                available_copies = db.get_available_copies(self.session, self.selected_book_id)
-                if not available_copies:
-                    messagebox.showerror("Ошибка", "Нет доступных экземпляров этой книги")
-                    return
-
-                # Берем первый доступный экземпляр
-                copy = available_copies[0]
                 days = int(self.days_var.get())
 
-                # Создаем выдачу
-                result = db.create_loan(
-                    self.session,
-                    reader_id=self.selected_reader_id,
-                    copy_id=copy.id,
-                    librarian_id=self.current_user.id,
-                    return_days=days
-                )
+                with db.session_scope() as session:
+                    # Берем первый доступный экземпляр книги
+                    available_copies = db.get_available_copies(session, self.selected_book_id)
+                    copy = available_copies[0] if available_copies else None
+
+                    # Создаем выдачу
+                    result = db.create_loan(
+                        session,
+                        reader_id=self.selected_reader_id,
+                        copy_id=copy.id,
+                        librarian_id=self.current_user.id,
+                        return_days=days
+                    ) if copy else None
+
+                if not copy:
+                    messagebox.showerror("Ошибка", "Нет доступных экземпляров этой книги")
+                    return
 
                 if result:
                     messagebox.showinfo("Успех",
@@ -2710,9 +2799,8 @@ class FullLibraryApp(ctk.CTk):
                     dialog.destroy()
                     # Обновляем списки
                     self.load_loans()
-                    if hasattr(self, 'load_books'):
+                    if "Книги" in self.built_tabs:
                         self.load_books()
-                    if hasattr(self, 'load_book_copies'):
                         self.load_book_copies()
                 else:
                     messagebox.showerror("Ошибка", "Не удалось оформить выдачу")
@@ -2739,152 +2827,77 @@ class FullLibraryApp(ctk.CTk):
         self.load_initial_readers_for_issue()
         self.load_initial_books_for_issue()
 
+    @db.instrumented()
     def search_readers_for_issue(self, event=None):
         """Поиск читателей для выдачи (по имени, email и телефону)"""
         search_term = self.reader_search_entry.get().strip()
 
         try:
-            # Используем существующую функцию поиска читателей
-            readers = db.search_readers(self.session, search_term) if search_term else db.get_all_readers(self.session,
-                                                                                                          limit=50)
-
-            # Если поиск не дал результатов, ищем по телефону отдельно
-            if search_term and not readers:
-                all_readers = db.get_all_readers(self.session)
-                readers = [r for r in all_readers if r.phone_number and search_term in r.phone_number]
-
-            # Очищаем treeview
-            for item in self.readers_issue_tree.get_children():
-                self.readers_issue_tree.delete(item)
-
-            # Заполняем данными
-            for reader in readers:
-                # Получаем активные выдачи
-                active_loans = db.get_loans_by_reader(self.session, reader.id, active_only=True)
-
-                self.readers_issue_tree.insert("", "end", values=(
-                    reader.id,
-                    reader.name,
-                    reader.email,
-                    reader.phone_number or "-",
-                    len(active_loans)
-                ))
-
+            with db.session_scope() as session:
+                rows = views.issue_reader_rows(session, search_term, limit=50)
+            self.display_readers_for_issue(rows)
         except Exception as e:
             print(f"Ошибка поиска читателей: {e}")
 
+    def display_readers_for_issue(self, readers):
+        """Отображение читателей в диалоге выдачи"""
+        for item in self.readers_issue_tree.get_children():
+            self.readers_issue_tree.delete(item)
+
+        for reader in readers:
+            self.readers_issue_tree.insert("", "end", values=(
+                reader['id'],
+                reader['name'],
+                reader['email'],
+                reader['phone'] or "-",
+                reader['active_loans']
+            ))
+
+    @db.instrumented()
     def load_initial_readers_for_issue(self):
         """Загрузка начального списка читателей"""
         try:
-            readers = db.get_all_readers(self.session, limit=30)
-
-            for item in self.readers_issue_tree.get_children():
-                self.readers_issue_tree.delete(item)
-
-            for reader in readers:
-                active_loans = db.get_loans_by_reader(self.session, reader.id, active_only=True)
-
-                self.readers_issue_tree.insert("", "end", values=(
-                    reader.id,
-                    reader.name,
-                    reader.email,
-                    reader.phone_number or "-",
-                    len(active_loans)
-                ))
-
+            with db.session_scope() as session:
+                rows = views.issue_reader_rows(session, limit=30)
+            self.display_readers_for_issue(rows)
         except Exception as e:
             print(f"Ошибка загрузки читателей: {e}")
 
+    @db.instrumented()
     def search_books_for_issue(self, event=None):
         """Поиск книг для выдачи (по отдельным словам в названии и авторе)"""
-        search_term = self.book_search_entry.get().strip().lower()
+        search_term = self.book_search_entry.get().strip()
 
         try:
-            # Получаем все книги с доступными экземплярами
-            all_books = db.get_all_books(self.session)
-
-            # Очищаем treeview
-            for item in self.books_issue_tree.get_children():
-                self.books_issue_tree.delete(item)
-
-            if not search_term:
-                # Показываем все книги с доступными экземплярами
-                for book in all_books:
-                    copies = db.get_copies_by_book(self.session, book.id)
-                    available_copies = len([c for c in copies if c.available])
-
-                    if available_copies > 0:
-                        self.books_issue_tree.insert("", "end", values=(
-                            book.id,
-                            book.title,
-                            book.author or "-",
-                            available_copies,
-                            len(copies)
-                        ))
-            else:
-                # Ищем по отдельным словам в названии и авторе
-                search_words = search_term.split()
-                found_books = []
-
-                for book in all_books:
-                    copies = db.get_copies_by_book(self.session, book.id)
-                    available_copies = len([c for c in copies if c.available])
-
-                    if available_copies == 0:
-                        continue
-
-                    # Проверяем совпадение по всем словам поиска
-                    title_lower = (book.title or "").lower()
-                    author_lower = (book.author or "").lower()
-
-                    # Ищем совпадение любого из слов в названии или авторе
-                    title_match = any(word in title_lower for word in search_words)
-                    author_match = any(word in author_lower for word in search_words)
-
-                    if title_match or author_match:
-                        found_books.append((book, available_copies, len(copies)))
-
-                # Сортируем по релевантности (количество совпадений)
-                found_books.sort(key=lambda x: (
-                    sum(word in (x[0].title or "").lower() for word in search_words) +
-                    sum(word in (x[0].author or "").lower() for word in search_words),
-                    x[1]  # затем по количеству доступных экземпляров
-                ), reverse=True)
-
-                for book, available_copies, total_copies in found_books:
-                    self.books_issue_tree.insert("", "end", values=(
-                        book.id,
-                        book.title,
-                        book.author or "-",
-                        available_copies,
-                        total_copies
-                    ))
-
+            # Книги с доступными экземплярами, отсортированные по релевантности
+            with db.session_scope() as session:
+                rows = views.issue_book_rows(session, search_term)
+            self.display_books_for_issue(rows)
         except Exception as e:
             print(f"Ошибка поиска книг: {e}")
 
+    def display_books_for_issue(self, books):
+        """Отображение книг в диалоге выдачи"""
+        for item in self.books_issue_tree.get_children():
+            self.books_issue_tree.delete(item)
+
+        for book in books:
+            self.books_issue_tree.insert("", "end", values=(
+                book['id'],
+                book['title'],
+                book['author'] or "-",
+                book['available_copies'],
+                book['total_copies']
+            ))
+
+    @db.instrumented()
     def load_initial_books_for_issue(self):
         """Загрузка начального списка книг"""
         try:
-            books = db.get_all_books(self.session)
-
-            for item in self.books_issue_tree.get_children():
-                self.books_issue_tree.delete(item)
-
             # Показываем только книги с доступными экземплярами
-            for book in books:
-                copies = db.get_copies_by_book(self.session, book.id)
-                available_copies = len([c for c in copies if c.available])
-
-                if available_copies > 0:
-                    self.books_issue_tree.insert("", "end", values=(
-                        book.id,
-                        book.title,
-                        book.author or "-",
-                        available_copies,
-                        len(copies)
-                    ))
-
+            with db.session_scope() as session:
+                rows = views.issue_book_rows(session)
+            self.display_books_for_issue(rows)
         except Exception as e:
             print(f"Ошибка загрузки книг: {e}")
 
@@ -2951,7 +2964,13 @@ class FullLibraryApp(ctk.CTk):
 
         try:
             # Получаем информацию о выдаче
-            loan = db.get_loan_by_id(self.session, loan_id)
+            with db.session_scope() as session:
+                loan = db.get_loan_by_id(session, loan_id)
+                if loan and not loan.returned:
+                    # Получаем дополнительную информацию
+                    reader = db.get_reader_by_id(session, loan.reader_id)
+                    copy = db.get_copy_by_id(session, loan.copy_id)
+                    book = db.get_book_by_id(session, copy.book_id) if copy else None
             if not loan:
                 messagebox.showerror("Ошибка", "Выдача не найдена")
                 return
@@ -2960,11 +2979,6 @@ class FullLibraryApp(ctk.CTk):
                 messagebox.showinfo("Информация", "Эта книга уже возвращена")
                 return
 
-            # Получаем дополнительную информацию
-            reader = db.get_reader_by_id(self.session, loan.reader_id)
-            copy = db.get_copy_by_id(self.session, loan.copy_id)
-            book = db.get_book_by_id(self.session, copy.book_id) if copy else None
-
             dialog = ctk.CTkToplevel(self)
             dialog.title("Возврат книги")
             dialog.geometry("500x450")
@@ -3040,28 +3054,28 @@ class FullLibraryApp(ctk.CTk):
                     condition = self.return_condition_var.get()
                     note = note_entry.get().strip() or None
 
-                    # Возвращаем книгу
-                    result = db.return_loan(self.session, loan_id)
-                    if not result:
-                        messagebox.showerror("Ошибка", "Не удалось оформить возврат")
-                        return
-
-                    # Обновляем состояние экземпляра
-                    if copy:
-                        db.update_copy(self.session, copy.id, condition=condition)
-
-                    # Создаем штраф если есть просрочка и отмечена галочка
-                    if create_fine_var.get() and loan.return_date < date.today():
+                    fine_needed = create_fine_var.get() and loan.return_date < date.today()
+                    fine_amount = None
+                    if fine_needed:
                         overdue_days = (date.today() - loan.return_date).days
                         fine_amount = overdue_days * 10  # 10 руб. в день
 
-                        fine_result = db.create_fine(
-                            self.session,
+                    with db.session_scope() as session:
+                        # Возврат, состояние экземпляра и штраф сохраняются одной транзакцией
+                        result, fine_result = db.return_loan_with_fine(
+                            session,
                             loan_id,
                             self.current_user.id,
-                            fine_amount
+                            condition=condition if copy else None,
+                            fine_amount=fine_amount,
+                            expected_version=loan.version
                         )
 
+                    if not result:
+                        self.show_update_error(result, "Не удалось оформить возврат")
+                        return
+
+                    if fine_needed:
                         if fine_result:
                             messagebox.showinfo("Успех",
                                                 f"Книга успешно возвращена!\n"
@@ -3077,9 +3091,8 @@ class FullLibraryApp(ctk.CTk):
 
                     # Обновляем интерфейс
                     self.load_loans()
-                    if hasattr(self, 'load_books'):
+                    if "Книги" in self.built_tabs:
                         self.load_books()
-                    if hasattr(self, 'load_book_copies'):
                         self.load_book_copies()
 
                 except Exception as e:
@@ -3113,7 +3126,13 @@ class FullLibraryApp(ctk.CTk):
 
         try:
             # Получаем информацию о выдаче
-            loan = db.get_loan_by_id(self.session, loan_id)
+            with db.session_scope() as session:
+                loan = db.get_loan_by_id(session, loan_id)
+                if loan and not loan.returned:
+                    # Получаем дополнительную информацию
+                    reader = db.get_reader_by_id(session, loan.reader_id)
+                    copy = db.get_copy_by_id(session, loan.copy_id)
+                    book = db.get_book_by_id(session, copy.book_id) if copy else None
             if not loan:
                 messagebox.showerror("Ошибка", "Выдача не найдена")
                 return
@@ -3126,11 +3145,6 @@ class FullLibraryApp(ctk.CTk):
             current_return_date = loan.return_date
             original_return_date = current_return_date
 
-            # Получаем дополнительную информацию
-            reader = db.get_reader_by_id(self.session, loan.reader_id)
-            copy = db.get_copy_by_id(self.session, loan.copy_id)
-            book = db.get_book_by_id(self.session, copy.book_id) if copy else None
-
             dialog = ctk.CTkToplevel(self)
             dialog.title("Продление срока")
             dialog.geometry("500x500")
@@ -3259,7 +3273,9 @@ class FullLibraryApp(ctk.CTk):
                             return
 
                     # Обновляем дату возврата
-                    result = db.update_loan(self.session, loan_id, return_date=new_return_date)
+                    with db.session_scope() as session:
+                        result = db.update_loan(session, loan_id, expected_version=loan.version,
+                                                return_date=new_return_date)
                     if result:
                         messagebox.showinfo("Успех",
                                             f"Срок успешно продлен!\n"
@@ -3278,7 +3294,7 @@ class FullLibraryApp(ctk.CTk):
                         print(log_msg)
 
                     else:
-                        messagebox.showerror("Ошибка", "Не удалось продлить срок")
+                        self.show_update_error(result, "Не удалось продлить срок")
 
                 except Exception as e:
                     messagebox.showerror("Ошибка", f"Ошибка при продлении срока: {e}")
@@ -3300,70 +3316,18 @@ class FullLibraryApp(ctk.CTk):
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка при открытии диалога продления: {e}")
 
+    @db.instrumented()
     def load_fines(self):
         """Загрузка списка штрафов"""
         try:
-            # Получаем все штрафы
-            fines = db.get_all_fines(self.session)
-
-            # Собираем расширенную информацию о каждом штрафе
-            self.all_fines = []
-            self.total_fines_count = 0
-            self.unpaid_fines_count = 0
-            self.total_amount_sum = 0
-            self.unpaid_amount_sum = 0
-
-            for fine in fines:
-                # Получаем информацию о выдаче
-                loan = db.get_loan_by_id(self.session, fine.loan_id)
-                if not loan:
-                    continue
-
-                # Получаем информацию о читателе
-                reader = db.get_reader_by_id(self.session, loan.reader_id)
-                reader_name = reader.name if reader else "Неизвестно"
-
-                # Получаем информацию об экземпляре и книге
-                copy = db.get_copy_by_id(self.session, loan.copy_id)
-                if copy:
-                    book = db.get_book_by_id(self.session, copy.book_id)
-                    book_title = book.title if book else "Неизвестно"
-                else:
-                    book_title = "Неизвестно"
-
-                # Получаем информацию о библиотекаре
-                librarian = db.get_librarian_by_id(self.session, fine.librarian_id)
-                librarian_name = librarian.name if librarian else "Неизвестно"
-
-                # Определяем статус
-                if fine.paid:
-                    status_text = "✅ Оплачен"
-                    status_color = "green"
-                else:
-                    status_text = "❌ Не оплачен"
-                    status_color = "red"
-                    self.unpaid_fines_count += 1
-                    self.unpaid_amount_sum += fine.amount
-
-                self.total_fines_count += 1
-                self.total_amount_sum += fine.amount
-
-                # Форматируем дату
-                issued_date = fine.issued_date.strftime("%d.%m.%Y") if fine.issued_date else "-"
-
-                self.all_fines.append({
-                    'id': fine.id,
-                    'reader_name': reader_name,
-                    'book_title': book_title,
-                    'amount': fine.amount,
-                    'issued_date': fine.issued_date,
-                    'status_text': status_text,
-                    'status_color': status_color,
-                    'loan_id': fine.loan_id,
-                    'librarian_name': librarian_name,
-                    'paid': fine.paid,
-                    'fine_obj': fine
-                })
+            with db.session_scope() as session:
+                self.all_fines, totals = views.fine_rows(session)
+                self.all_fines = self.sorted_rows(session, 'fines', self.all_fines)
+            self.update_search_index('fines', self.all_fines)
+            self.total_fines_count = totals['count']
+            self.unpaid_fines_count = totals['unpaid_count']
+            self.total_amount_sum = totals['amount']
+            self.unpaid_amount_sum = totals['unpaid_amount']
 
             # Обновляем статистику
             self.update_fines_stats()
@@ -3386,23 +3350,22 @@ class FullLibraryApp(ctk.CTk):
         if not hasattr(self, 'all_fines'):
             return
 
+        fines = self.all_fines
         filtered_fines = []
         today = date.today()
 
         if choice == "Все штрафы":
-            filtered_fines = self.all_fines
+            filtered_fines = fines
         elif choice == "Неоплаченные":
-            filtered_fines = [fine for fine in self.all_fines if not fine['paid']]
+            filtered_fines = fines.where(fines.mask('paid', '==', False))
         elif choice == "Оплаченные":
-            filtered_fines = [fine for fine in self.all_fines if fine['paid']]
+            filtered_fines = fines.where(fines.mask('paid', '==', True))
         elif choice == "За последнюю неделю":
             week_ago = today - timedelta(days=7)
-            filtered_fines = [fine for fine in self.all_fines
-                              if fine['issued_date'] and fine['issued_date'] >= week_ago]
+            filtered_fines = fines.where(fines.mask('issued_date', '>=', week_ago))
         elif choice == "За последний месяц":
             month_ago = today - timedelta(days=30)
-            filtered_fines = [fine for fine in self.all_fines
-                              if fine['issued_date'] and fine['issued_date'] >= month_ago]
+            filtered_fines = fines.where(fines.mask('issued_date', '>=', month_ago))
 
         self.display_fines(filtered_fines)
 
@@ -3413,13 +3376,7 @@ class FullLibraryApp(ctk.CTk):
             self.apply_fines_filter(self.fines_filter.get())
             return
 
-        filtered_fines = []
-        for fine in self.all_fines:
-            if (search_term in fine['reader_name'].lower() or
-                    search_term in fine['book_title'].lower() or
-                    search_term in str(fine['amount']) or
-                    search_term in str(fine['loan_id'])):
-                filtered_fines.append(fine)
+        filtered_fines = self.search_indexes['fines'].filter(search_term)
 
         self.display_fines(filtered_fines)
 
@@ -3616,22 +3573,24 @@ class FullLibraryApp(ctk.CTk):
 
                 reason = reason_entry.get().strip() or None
 
-                # Проверяем, нет ли уже штрафа для этой выдачи
-                existing_fine = db.get_fine_by_loan(self.session, self.selected_loan_id)
+                with db.session_scope() as session:
+                    # Проверяем, нет ли уже штрафа для этой выдачи
+                    existing_fine = db.get_fine_by_loan(session, self.selected_loan_id)
+
+                    # Создаем штраф
+                    result = db.create_fine(
+                        session,
+                        loan_id=self.selected_loan_id,
+                        librarian_id=self.current_user.id,
+                        amount=amount,
+                        issued_date=issued_date
+                    ) if not existing_fine else None
+
                 if existing_fine:
                     messagebox.showerror("Ошибка",
                                          f"Для этой выдачи уже существует штраф (ID: {existing_fine.id})")
                     return
 
-                # Создаем штраф
-                result = db.create_fine(
-                    self.session,
-                    loan_id=self.selected_loan_id,
-                    librarian_id=self.current_user.id,
-                    amount=amount,
-                    issued_date=issued_date
-                )
-
                 if result:
                     messagebox.showinfo("Успех",
                                         f"Штраф успешно создан!\n"
@@ -3673,125 +3632,42 @@ class FullLibraryApp(ctk.CTk):
         # Загружаем начальные данные
         self.load_initial_loans_for_fine()
 
+    @db.instrumented()
     def search_loans_for_fine(self, event=None):
         """Поиск выдач для создания штрафа"""
         search_term = self.loan_search_entry.get().strip()
 
         try:
-            # Получаем все выдачи
-            all_loans = db.get_all_loans(self.session)
-
-            # Очищаем treeview
-            for item in self.loans_fine_tree.get_children():
-                self.loans_fine_tree.delete(item)
-
-            found_loans = []
-
-            for loan in all_loans:
-                # Получаем информацию о читателе
-                reader = db.get_reader_by_id(self.session, loan.reader_id)
-                if not reader:
-                    continue
-
-                # Получаем информацию о книге
-                copy = db.get_copy_by_id(self.session, loan.copy_id)
-                if copy:
-                    book = db.get_book_by_id(self.session, copy.book_id)
-                    book_title = book.title if book else "Неизвестно"
-                else:
-                    book_title = "Неизвестно"
-
-                # Определяем статус
-                if loan.returned:
-                    status_text = "Возвращена"
-                else:
-                    if loan.return_date < date.today():
-                        status_text = "Просрочена"
-                    else:
-                        status_text = "Активна"
-
-                # Форматируем даты
-                issue_date = loan.loan_date.strftime("%d.%m.%Y") if loan.loan_date else "-"
-                due_date = loan.return_date.strftime("%d.%m.%Y") if loan.return_date else "-"
-
-                loan_info = {
-                    'loan': loan,
-                    'reader_name': reader.name,
-                    'book_title': book_title,
-                    'issue_date': issue_date,
-                    'due_date': due_date,
-                    'status': status_text
-                }
-
-                # Проверяем поиск
-                if not search_term or (
-                        search_term in str(loan.id) or
-                        search_term.lower() in reader.name.lower() or
-                        search_term.lower() in book_title.lower()
-                ):
-                    found_loans.append(loan_info)
-
-            # Сортируем: сначала просроченные, потом активные
-            found_loans.sort(key=lambda x: (x['status'] != "Просрочена", x['status'] != "Активна"))
-
-            for loan_info in found_loans:
-                self.loans_fine_tree.insert("", "end", values=(
-                    loan_info['loan'].id,
-                    loan_info['reader_name'],
-                    loan_info['book_title'],
-                    loan_info['issue_date'],
-                    loan_info['due_date'],
-                    loan_info['status']
-                ))
-
+            # Сначала просроченные, потом активные
+            with db.session_scope() as session:
+                rows = views.fine_loan_rows(session, search_term)
+            self.display_loans_for_fine(rows)
         except Exception as e:
             print(f"Ошибка поиска выдач: {e}")
 
+    def display_loans_for_fine(self, loans):
+        """Отображение выдач в диалоге создания штрафа"""
+        for item in self.loans_fine_tree.get_children():
+            self.loans_fine_tree.delete(item)
+
+        for loan in loans:
+            self.loans_fine_tree.insert("", "end", values=(
+                loan['id'],
+                loan['reader_name'],
+                loan['book_title'],
+                loan['issue_date'],
+                loan['due_date'],
+                loan['status']
+            ))
+
+    @db.instrumented()
     def load_initial_loans_for_fine(self):
         """Загрузка начального списка выдач"""
         try:
             # Показываем только активные и просроченные выдачи
-            active_loans = db.get_active_loans(self.session)
-            overdue_loans = db.get_overdue_loans(self.session)
-
-            all_loans = overdue_loans + active_loans
-
-            for item in self.loans_fine_tree.get_children():
-                self.loans_fine_tree.delete(item)
-
-            for loan in all_loans:
-                reader = db.get_reader_by_id(self.session, loan.reader_id)
-                if not reader:
-                    continue
-
-                copy = db.get_copy_by_id(self.session, loan.copy_id)
-                if copy:
-                    book = db.get_book_by_id(self.session, copy.book_id)
-                    book_title = book.title if book else "Неизвестно"
-                else:
-                    book_title = "Неизвестно"
-
-                # Определяем статус
-                if loan.returned:
-                    status_text = "Возвращена"
-                else:
-                    if loan.return_date < date.today():
-                        status_text = "Просрочена"
-                    else:
-                        status_text = "Активна"
-
-                issue_date = loan.loan_date.strftime("%d.%m.%Y") if loan.loan_date else "-"
-                due_date = loan.return_date.strftime("%d.%m.%Y") if loan.return_date else "-"
-
-                self.loans_fine_tree.insert("", "end", values=(
-                    loan.id,
-                    reader.name,
-                    book_title,
-                    issue_date,
-                    due_date,
-                    status_text
-                ))
-
+            with db.session_scope() as session:
+                rows = views.fine_loan_rows(session, active_only=True)
+            self.display_loans_for_fine(rows)
         except Exception as e:
             print(f"Ошибка загрузки выдач: {e}")
 
@@ -3842,7 +3718,8 @@ class FullLibraryApp(ctk.CTk):
             fine_id = self.fines_tree.item(selected[0])['values'][0]
 
         try:
-            fine = db.get_fine_by_id(self.session, fine_id)
+            with db.session_scope() as session:
+                fine = db.get_fine_by_id(session, fine_id)
             if not fine:
                 messagebox.showerror("Ошибка", "Штраф не найден")
                 return
@@ -3858,12 +3735,13 @@ class FullLibraryApp(ctk.CTk):
                 return
 
             # Отмечаем как оплаченный
-            result = db.pay_fine(self.session, fine_id)
+            with db.session_scope() as session:
+                result = db.pay_fine(session, fine_id, expected_version=fine.version)
             if result:
                 messagebox.showinfo("Успех", f"Штраф ID {fine_id} отмечен как оплаченный")
                 self.load_fines()
             else:
-                messagebox.showerror("Ошибка", "Не удалось отметить штраф как оплаченный")
+                self.show_update_error(result, "Не удалось отметить штраф как оплаченный")
 
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка при отметке оплаты: {e}")
@@ -3871,7 +3749,8 @@ class FullLibraryApp(ctk.CTk):
     def auto_create_overdue_fines(self):
         """Автоматическое создание штрафов за просрочку"""
         try:
-            result = db.auto_create_overdue_fines(self.session)
+            with db.session_scope() as session:
+                result = db.auto_create_overdue_fines(session)
             if result:
                 messagebox.showinfo("Успех",
                                     f"Создано {len(result)} штрафов за просрочку\n"
@@ -3903,7 +3782,9 @@ class FullLibraryApp(ctk.CTk):
             return
 
         try:
-            if db.delete_fine(self.session, fine_id):
+            with db.session_scope() as session:
+                deleted = db.delete_fine(session, fine_id)
+            if deleted:
                 messagebox.showinfo("Успех", f"Штраф ID {fine_id} удален")
                 self.load_fines()
             else:
@@ -3953,35 +3834,16 @@ class FullLibraryApp(ctk.CTk):
                       command=lambda: self.tabview.set("Главная"),
                       fg_color="gray").pack(pady=10)
 
+    @db.instrumented()
     def load_librarians(self):
         """Загрузка списка библиотекарей"""
         try:
-            # Получаем всех библиотекарей
-            librarians = db.get_all_librarians(self.session)
-
-            # Собираем расширенную информацию
-            self.all_librarians = []
-            self.total_librarians_count = 0
-            self.admins_count = 0
-
-            for librarian in librarians:
-                # Считаем статистику
-                self.total_librarians_count += 1
-
-                if librarian.position and "администратор" in librarian.position.lower():
-                    self.admins_count += 1
-
-                # Форматируем даты
-                hire_date = librarian.hire_date.strftime("%d.%m.%Y") if librarian.hire_date else "-"
-
-                self.all_librarians.append({
-                    'id': librarian.id,
-                    'name': librarian.name,
-                    'email': librarian.email,
-                    'position': librarian.position or "Не указана",
-                    'hire_date': hire_date,
-                    'librarian_obj': librarian
-                })
+            with db.session_scope() as session:
+                self.all_librarians, counters = views.librarian_rows(session)
+                self.all_librarians = self.sorted_rows(session, 'librarians', self.all_librarians)
+            self.update_search_index('librarians', self.all_librarians)
+            self.total_librarians_count = counters['total']
+            self.admins_count = counters['admins']
 
             # Обновляем статистику
             self.update_librarians_stats()
@@ -4029,12 +3891,7 @@ class FullLibraryApp(ctk.CTk):
             self.apply_librarians_filter(self.librarians_filter.get())
             return
 
-        filtered_librarians = []
-        for librarian in self.all_librarians:
-            if (search_term in librarian['name'].lower() or
-                    search_term in librarian['email'].lower() or
-                    search_term in librarian['position'].lower()):
-                filtered_librarians.append(librarian)
+        filtered_librarians = self.search_indexes['librarians'].filter(search_term)
 
         self.display_librarians(filtered_librarians)
 
@@ -4135,15 +3992,11 @@ class FullLibraryApp(ctk.CTk):
                     messagebox.showwarning("Ошибка", "Пароль должен содержать минимум 6 символов")
                     return
 
-                # Создаем библиотекаря
-                result = db.create_librarian(
-                    self.session,
-                    name=name,
-                    email=email,
-                    password=password,
-                    position=position
-                )
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Ошибка при добавлении библиотекаря: {e}")
+                return
 
+            def on_created(result):
                 if result:
                     messagebox.showinfo("Успех",
                                         f"Библиотекарь {name} успешно добавлен!\n\n"
@@ -4157,10 +4010,26 @@ class FullLibraryApp(ctk.CTk):
                     print(f"Администратор {self.current_user.name} создал библиотекаря: {name} ({email})")
 
                 else:
+                    save_btn.configure(text="💾 Сохранить", state="normal")
                     messagebox.showerror("Ошибка", "Не удалось добавить библиотекаря")
 
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка при добавлении библиотекаря: {e}")
+            def on_error(error):
+                save_btn.configure(text="💾 Сохранить", state="normal")
+                messagebox.showerror("Ошибка", f"Ошибка при добавлении библиотекаря: {error}")
+
+            def create():
+                with db.session_scope() as session:
+                    return db.create_librarian(
+                        session,
+                        name=name,
+                        email=email,
+                        password=password,
+                        position=position
+                    )
+
+            # Создаем библиотекаря в фоне: хэширование пароля не должно блокировать интерфейс
+            save_btn.configure(text="🔄 Сохранение...", state="disabled")
+            self.run_in_background(create, on_created, on_error)
 
         # Фрейм для кнопок
         btn_frame = ctk.CTkFrame(main_container)
@@ -4171,9 +4040,10 @@ class FullLibraryApp(ctk.CTk):
                       width=100,
                       fg_color="gray").pack(side="left", padx=(0, 10))
 
-        ctk.CTkButton(btn_frame, text="💾 Сохранить",
-                      command=save_librarian,
-                      width=100).pack(side="right")
+        save_btn = ctk.CTkButton(btn_frame, text="💾 Сохранить",
+                                 command=save_librarian,
+                                 width=100)
+        save_btn.pack(side="right")
 
         # Фокусируем на первом поле
         name_entry.focus_set()
@@ -4189,7 +4059,8 @@ class FullLibraryApp(ctk.CTk):
         librarian_id = item['values'][0]
 
         try:
-            librarian = db.get_librarian_by_id(self.session, librarian_id)
+            with db.session_scope() as session:
+                librarian = db.get_librarian_by_id(session, librarian_id)
             if not librarian:
                 messagebox.showerror("Ошибка", "Библиотекарь не найден")
                 return
@@ -4260,13 +4131,14 @@ class FullLibraryApp(ctk.CTk):
                         return
 
                     # Обновляем данные
-                    result = db.update_librarian(
-                        self.session,
-                        librarian_id,
-                        name=name,
-                        email=email,
-                        position=position
-                    )
+                    with db.session_scope() as session:
+                        result = db.update_librarian(
+                            session,
+                            librarian_id,
+                            name=name,
+                            email=email,
+                            position=position
+                        )
 
                     if result:
                         messagebox.showinfo("Успех", "Данные библиотекаря обновлены!")
@@ -4313,7 +4185,8 @@ class FullLibraryApp(ctk.CTk):
         librarian_name = item['values'][1]
 
         try:
-            librarian = db.get_librarian_by_id(self.session, librarian_id)
+            with db.session_scope() as session:
+                librarian = db.get_librarian_by_id(session, librarian_id)
             if not librarian:
                 messagebox.showerror("Ошибка", "Библиотекарь не найден")
                 return
@@ -4369,13 +4242,11 @@ class FullLibraryApp(ctk.CTk):
                         messagebox.showwarning("Ошибка", "Пароль должен содержать минимум 6 символов")
                         return
 
-                    # Обновляем пароль
-                    result = db.update_librarian(
-                        self.session,
-                        librarian_id,
-                        password=new_password
-                    )
+                except Exception as e:
+                    messagebox.showerror("Ошибка", f"Ошибка при смене пароля: {e}")
+                    return
 
+                def on_changed(result):
                     if result:
                         messagebox.showinfo("Успех", "Пароль успешно изменен!")
                         dialog.destroy()
@@ -4384,10 +4255,20 @@ class FullLibraryApp(ctk.CTk):
                         print(f"Администратор {self.current_user.name} сменил пароль библиотекаря {librarian_name}")
 
                     else:
+                        change_btn.configure(text="🔑 Сменить пароль", state="normal")
                         messagebox.showerror("Ошибка", "Не удалось изменить пароль")
 
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Ошибка при смене пароля: {e}")
+                def on_error(error):
+                    change_btn.configure(text="🔑 Сменить пароль", state="normal")
+                    messagebox.showerror("Ошибка", f"Ошибка при смене пароля: {error}")
+
+                def change():
+                    with db.session_scope() as session:
+                        return db.update_librarian(session, librarian_id, password=new_password)
+
+                # Обновляем пароль в фоне: хэширование не должно блокировать интерфейс
+                change_btn.configure(text="🔄 Сохранение...", state="disabled")
+                self.run_in_background(change, on_changed, on_error)
 
             # Фрейм для кнопок
             btn_frame = ctk.CTkFrame(main_container)
@@ -4398,9 +4279,10 @@ class FullLibraryApp(ctk.CTk):
                           width=100,
                           fg_color="gray").pack(side="left", padx=(0, 10))
 
-            ctk.CTkButton(btn_frame, text="🔑 Сменить пароль",
-                          command=change_password,
-                          width=120).pack(side="right")
+            change_btn = ctk.CTkButton(btn_frame, text="🔑 Сменить пароль",
+                                       command=change_password,
+                                       width=120)
+            change_btn.pack(side="right")
 
             # Фокусируем на поле пароля
             new_password_entry.focus_set()
@@ -4445,7 +4327,9 @@ class FullLibraryApp(ctk.CTk):
                 return
 
         try:
-            if db.delete_librarian(self.session, librarian_id):
+            with db.session_scope() as session:
+                deleted = db.delete_librarian(session, librarian_id)
+            if deleted:
                 messagebox.showinfo("Успех", f"Библиотекарь {librarian_name} удален")
                 self.load_librarians()
 
@@ -4458,5 +4342,10 @@ class FullLibraryApp(ctk.CTk):
             messagebox.showerror("Ошибка", f"Ошибка при удалении библиотекаря: {e}")
 
 if __name__ == "__main__":
+    db.configure_logging()
+    if os.environ.get('LIBRARY_SLOW_QUERY_MS'):
+        db.enable_slow_query_log()
+    # Кэш сбрасывается и по изменениям из других экземпляров приложения
+    db.start_cache_listener()
     app = LibraryApp()
     app.mainloop()
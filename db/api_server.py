@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from . import views
+from .db_config import DB_HOST, DB_NAME, DB_USER, DB_PORT, DB_PASS
+
+
+DEFAULT_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+MAX_PAGE_SIZE = 200
+MAX_HEADER_BYTES = 16 * 1024
+# API только для чтения: тело запроса не используется, большие тела не читаются
+MAX_BODY_BYTES = 1024
+
+# Время жизни ответа в кэше, секунды (статус читателя меняется чаще каталога)
+CACHE_TTL = {
+    'catalog': 30.0,
+    'book': 10.0,
+    'reader': 5.0,
+}
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# Заголовок с email читателя: без него статус читателя не выдается
+READER_EMAIL_HEADER = 'x-reader-email'
+
+# Ответы, которые нельзя хранить в общих кэшах (прокси) - данные конкретного читателя
+PRIVATE_KINDS = {'reader'}
+
+logger = logging.getLogger(__name__)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _int_param(params, name, default, minimum=0, maximum=None):
+    values = params.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise HttpError(400, f"Параметр {name} должен быть числом")
+    if value < minimum:
+        raise HttpError(400, f"Параметр {name} не может быть меньше {minimum}")
+    return min(value, maximum) if maximum else value
+
+
+class CatalogApi:
+    """
+    Read-only JSON API для киосков каталога поверх общего пула соединений.
+    Запросы к БД выполняются в пуле потоков размером с пул соединений;
+    одинаковые одновременные запросы объединяются, ответы кэшируются с ETag
+    """
+
+    def __init__(self, engine, workers=4, cache_ttl=None):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine, expire_on_commit=False)
+        self.cache_ttl = dict(CACHE_TTL, **(cache_ttl or {}))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='catalog-api')
+
+        self._cache = {}
+        self._inflight = {}
+        self.stats = {'requests': 0, 'cache_hits': 0, 'not_modified': 0, 'db_calls': 0, 'errors': 0}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.engine.dispose()
+
+    def route(self, path, params, headers=None):
+        """Возвращает (вид кэша, функция чтения) для пути запроса"""
+        parts = [part for part in path.split('/') if part]
+        if parts == ['api', 'health']:
+            return None, lambda session: {'status': 'ok', 'stats': dict(self.stats)}
+        if parts == ['api', 'catalog']:
+            search_term = (params.get('q') or [''])[0].strip()
+            limit = _int_param(params, 'limit', 50, 1, MAX_PAGE_SIZE)
+            offset = _int_param(params, 'offset', 0)
+            return 'catalog', lambda session: {
+                'items': views.catalog_rows(session, search_term, limit, offset),
+                'limit': limit,
+                'offset': offset
+            }
+        if len(parts) == 3 and parts[:2] == ['api', 'books'] and parts[2].isdigit():
+            book_id = int(parts[2])
+            return 'book', lambda session: views.book_availability(session, book_id)
+        if len(parts) == 4 and parts[:2] == ['api', 'readers'] and parts[2].isdigit() and parts[3] == 'loans':
+            reader_id = int(parts[2])
+            email = (headers or {}).get(READER_EMAIL_HEADER, '').strip()
+            if not email:
+                raise HttpError(401, f"Нужен заголовок {READER_EMAIL_HEADER} с email читателя")
+            # Неверный email неотличим от несуществующего читателя (404)
+            return 'reader', lambda session: views.reader_status(session, reader_id, email)
+        raise HttpError(404, "Неизвестный адрес")
+
+    def _read(self, reader):
+        session = self.Session()
+        try:
+            return reader(session)
+        finally:
+            session.close()
+
+    async def fetch(self, key, kind, reader):
+        """
+        Ответ (ETag, тело) из кэша или из БД. Параллельные запросы
+        с одинаковым ключом ждут один общий запрос к БД
+        """
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached and cached[0] > now:
+            self.stats['cache_hits'] += 1
+            return cached[1], cached[2]
+
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self._read, reader)
+            self._inflight[key] = future
+            self.stats['db_calls'] += 1
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Отмена одного ожидающего (клиент отключился) не отменяет общий запрос для остальных
+        data = await asyncio.shield(future)
+
+        if data is None:
+            raise HttpError(404, "Не найдено")
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        if kind:
+            self._cache[key] = (time.monotonic() + self.cache_ttl[kind], etag, body)
+            if len(self._cache) > 10000:
+                self._prune_cache()
+        return etag, body
+
+    def _prune_cache(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._cache.items() if entry[0] <= now]:
+            del self._cache[key]
+
+    async def handle(self, method, target, headers):
+        """Обработка запроса: (статус, заголовки, тело)"""
+        self.stats['requests'] += 1
+        if method not in ('GET', 'HEAD'):
+            raise HttpError(405, "Поддерживаются только GET и HEAD")
+
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        kind, reader = self.route(url.path, params, headers)
+        key = (url.path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        if kind in PRIVATE_KINDS:
+            # Ответ из кэша выдается только с тем же email
+            key += (headers[READER_EMAIL_HEADER].strip().lower(),)
+        etag, body = await self.fetch(key, kind, reader)
+
+        cache_control = 'no-store'
+        if kind:
+            cache_control = f"max-age={int(self.cache_ttl[kind])}"
+            if kind in PRIVATE_KINDS:
+                cache_control = f"private, {cache_control}"
+        response_headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'ETag': etag,
+            'Cache-Control': cache_control,
+        }
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            self.stats['not_modified'] += 1
+            return 304, response_headers, b''
+        return 200, response_headers, body
+
+    async def serve_connection(self, reader, writer):
+        """Соединение HTTP/1.1 с поддержкой keep-alive"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                length = headers.get('content-length') or '0'
+                # int() принял бы и '+5', ' 5', '5_0' - допускаются только цифры
+                valid_length = length.isascii() and length.isdigit() and int(length) <= MAX_BODY_BYTES
+                if valid_length and int(length):
+                    await reader.readexactly(int(length))
+
+                try:
+                    if not valid_length:
+                        if length.isascii() and length.isdigit():
+                            raise HttpError(413, f"Тело запроса больше {MAX_BODY_BYTES} байт")
+                        raise HttpError(400, "Некорректный заголовок Content-Length")
+                    status, response_headers, body = await self.handle(method, target, headers)
+                except HttpError as e:
+                    status, response_headers = e.status, {'Content-Type': 'application/json; charset=utf-8'}
+                    body = json.dumps({'error': e.message}, ensure_ascii=False).encode('utf-8')
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error("Ошибка при обработке %s: %s", target, e)
+                    status, response_headers = 500, {'Content-Type': 'application/json; charset=utf-8'}
+                    body = json.dumps({'error': "Внутренняя ошибка сервера"}, ensure_ascii=False).encode('utf-8')
+
+                # После ошибки в Content-Length граница следующего запроса неизвестна
+                keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                              and valid_length)
+                response_headers['Content-Length'] = str(len(body))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                response = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+                response += [f"{name}: {value}" for name, value in response_headers.items()]
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+
+async def serve(api, host='127.0.0.1', port=8080):
+    server = await asyncio.start_server(api.serve_connection, host, port, limit=MAX_HEADER_BYTES)
+    print(f"API каталога запущен на http://{host}:{port}/api/catalog")
+    async with server:
+        await server.serve_forever()
+
+
+def create_api(url=DEFAULT_URL, pool_size=4, cache_ttl=None):
+    """API с собственным пулом из pool_size соединений (общим для всех киосков)"""
+    engine = create_engine(url, pool_size=pool_size, max_overflow=0, pool_pre_ping=True)
+    return CatalogApi(engine, pool_size, cache_ttl)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON API каталога для киосков (только чтение)")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    api = create_api(args.url, args.pool_size)
+    try:
+        asyncio.run(serve(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
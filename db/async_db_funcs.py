@@ -0,0 +1,612 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import select, update, func, and_, or_
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from .models import Reader, Book, BookCopy, Genre, Librarian, Loan, Fine
+from .db_config import DB_HOST, DB_NAME, DB_USER, DB_PORT, DB_PASS
+from .db_funcs import UpdateConflict
+from .query_cache import invalidate_tables
+
+
+# Асинхронный вариант db_funcs (SQLAlchemy asyncio + asyncpg).
+# Функции повторяют синхронные по сигнатурам и поведению: ошибки пишутся
+# в лог, а вызывающий код получает None / [] / {}. Одна AsyncSession не
+# допускает параллельных запросов, поэтому для конкурентной работы
+# используется gather(), открывающий отдельную сессию на каждый вызов.
+
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+logger = logging.getLogger(__name__)
+
+_engine = None
+_session_factory = None
+
+
+def get_async_engine(url=ASYNC_DATABASE_URL, **kwargs):
+    """
+    Получение общего асинхронного движка (создается один раз на процесс)
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        try:
+            _engine = create_async_engine(url, **kwargs)
+        except ModuleNotFoundError as e:
+            raise ImportError(f"Для асинхронного доступа к БД требуется драйвер {e.name} "
+                              f"(pip install -r db/requirements.txt)") from e
+        _session_factory = async_sessionmaker(_engine, expire_on_commit=False)
+    return _engine
+
+
+def get_async_session():
+    """
+    Новая асинхронная сессия (использовать как async with get_async_session() as session)
+    """
+    get_async_engine()
+    return _session_factory()
+
+
+async def dispose_async_engine():
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+
+async def in_session(func_, *args, **kwargs):
+    """Вызов func_(session, *args, **kwargs) в отдельной сессии"""
+    async with get_async_session() as session:
+        return await func_(session, *args, **kwargs)
+
+
+async def gather(*calls):
+    """
+    Параллельное выполнение вызовов вида (функция, аргументы...) на одном цикле событий.
+    Каждый вызов получает свою сессию и свое соединение из пула
+    """
+    return await asyncio.gather(*(in_session(call[0], *call[1:]) for call in calls))
+
+
+async def _commit(session, *tables):
+    await session.commit()
+    # Синхронный кэш запросов в этом процессе не видит изменений из асинхронных сессий
+    invalidate_tables(*tables)
+
+
+# Читатели
+
+async def get_reader_by_id(session, reader_id):
+    """
+    Получение читателя по ID
+    """
+    try:
+        reader = await session.get(Reader, reader_id)
+        if reader is None:
+            logger.warning("Читатель с ID %s не найден", reader_id)
+        return reader
+    except Exception as e:
+        logger.error("Ошибка при поиске читателя: %s", e)
+        return None
+
+
+async def get_all_readers(session, limit=None, offset=None):
+    """
+    Получение списка всех читателей
+    """
+    try:
+        statement = select(Reader).order_by(Reader.id)
+        if offset:
+            statement = statement.offset(offset)
+        if limit:
+            statement = statement.limit(limit)
+        readers = (await session.scalars(statement)).all()
+        logger.debug("Найдено %s читателей", len(readers))
+        return readers
+    except Exception as e:
+        logger.error("Ошибка при получении списка читателей: %s", e)
+        return []
+
+
+async def search_readers(session, search_term):
+    """
+    Поиск читателей по имени или email
+    """
+    try:
+        readers = (await session.scalars(select(Reader).where(or_(
+            Reader.name.ilike(f"%{search_term}%"),
+            Reader.email.ilike(f"%{search_term}%")
+        )))).all()
+        logger.debug("По запросу '%s' найдено %s читателей", search_term, len(readers))
+        return readers
+    except Exception as e:
+        logger.error("Ошибка при поиске читателей: %s", e)
+        return []
+
+
+async def get_readers_count(session):
+    """
+    Получение общего количества читателей
+    """
+    try:
+        return await session.scalar(select(func.count(Reader.id)))
+    except Exception as e:
+        logger.error("Ошибка при подсчете читателей: %s", e)
+        return 0
+
+
+# Книги и экземпляры
+
+async def get_book_by_id(session, book_id):
+    """
+    Получение книги по ID
+    """
+    try:
+        book = await session.get(Book, book_id)
+        if book is None:
+            logger.warning("Книга с ID %s не найдена", book_id)
+        return book
+    except Exception as e:
+        logger.error("Ошибка при поиске книги: %s", e)
+        return None
+
+
+async def get_all_books(session):
+    """
+    Получение всех книг
+    """
+    try:
+        books = (await session.scalars(select(Book).order_by(Book.title))).all()
+        logger.debug("Найдено %s книг", len(books))
+        return books
+    except Exception as e:
+        logger.error("Ошибка при получении книг: %s", e)
+        return []
+
+
+async def search_books(session, title=None, author=None, genre_name=None, available_only=False):
+    """
+    Поиск книг по различным критериям
+    """
+    try:
+        statement = select(Book)
+        if title:
+            statement = statement.where(Book.title.ilike(f"%{title}%"))
+        if author:
+            statement = statement.where(Book.author.ilike(f"%{author}%"))
+        if genre_name:
+            statement = statement.join(Book.genres).where(Genre.name.ilike(f"%{genre_name}%"))
+        if available_only:
+            statement = statement.where(Book.available == True)
+
+        books = (await session.scalars(statement)).all()
+        logger.debug("Найдено %s книг по заданным критериям", len(books))
+        return books
+    except Exception as e:
+        logger.error("Ошибка при поиске книг: %s", e)
+        return []
+
+
+async def get_books_count(session):
+    """
+    Получение общего количества книг
+    """
+    try:
+        return await session.scalar(select(func.count(Book.id)))
+    except Exception as e:
+        logger.error("Ошибка при подсчете книг: %s", e)
+        return 0
+
+
+async def get_all_book_copies(session):
+    """
+    Получение всех экземпляров книг
+    """
+    try:
+        copies = (await session.scalars(select(BookCopy).order_by(BookCopy.inventory_number))).all()
+        logger.debug("Найдено %s экземпляров", len(copies))
+        return copies
+    except Exception as e:
+        logger.error("Ошибка при получении экземпляров: %s", e)
+        return []
+
+
+async def get_copies_by_book(session, book_id, available_only=False):
+    """
+    Получение экземпляров книги
+    """
+    try:
+        statement = select(BookCopy).where(BookCopy.book_id == book_id)
+        if available_only:
+            statement = statement.where(BookCopy.available == True)
+        copies = (await session.scalars(statement)).all()
+        logger.debug("Найдено %s экземпляров книги ID %s", len(copies), book_id)
+        return copies
+    except Exception as e:
+        logger.error("Ошибка при получении экземпляров книги: %s", e)
+        return []
+
+
+# Выдачи
+
+async def get_loan_by_id(session, loan_id):
+    """
+    Получение выдачи по ID
+    """
+    try:
+        loan = await session.get(Loan, loan_id)
+        if loan is None:
+            logger.warning("Выдача с ID %s не найдена", loan_id)
+        return loan
+    except Exception as e:
+        logger.error("Ошибка при поиске выдачи: %s", e)
+        return None
+
+
+async def get_all_loans(session):
+    """
+    Получение всех выдач
+    """
+    try:
+        loans = (await session.scalars(select(Loan).order_by(Loan.loan_date.desc()))).all()
+        logger.debug("Найдено %s выдач", len(loans))
+        return loans
+    except Exception as e:
+        logger.error("Ошибка при получении всех выдач: %s", e)
+        return []
+
+
+async def get_loans_by_reader(session, reader_id, active_only=False):
+    """
+    Получение всех выдач читателя
+    """
+    try:
+        statement = select(Loan).where(Loan.reader_id == reader_id)
+        if active_only:
+            statement = statement.where(Loan.returned == False)
+        loans = (await session.scalars(statement.order_by(Loan.loan_date.desc()))).all()
+        logger.debug("Найдено %s выдач для читателя ID %s", len(loans), reader_id)
+        return loans
+    except Exception as e:
+        logger.error("Ошибка при получении выдач читателя: %s", e)
+        return []
+
+
+async def get_active_loans(session, reader_id=None):
+    """
+    Получение активных выдач
+    """
+    try:
+        statement = select(Loan).where(Loan.returned == False)
+        if reader_id:
+            statement = statement.where(Loan.reader_id == reader_id)
+        loans = (await session.scalars(statement.order_by(Loan.loan_date))).all()
+        logger.debug("Найдено %s активных выдач", len(loans))
+        return loans
+    except Exception as e:
+        logger.error("Ошибка при получении активных выдач: %s", e)
+        return []
+
+
+async def get_overdue_loans(session):
+    """
+    Получение просроченных выдач
+    """
+    try:
+        loans = (await session.scalars(
+            select(Loan)
+            .where(and_(Loan.returned == False, Loan.return_date < date.today()))
+            .order_by(Loan.return_date)
+        )).all()
+        logger.debug("Найдено %s просроченных выдач", len(loans))
+        return loans
+    except Exception as e:
+        logger.error("Ошибка при получении просроченных выдач: %s", e)
+        return []
+
+
+async def create_loan(session, reader_id, copy_id, librarian_id, loan_date=None, return_days=14):
+    """
+    Создание новой записи о выдаче книги
+    """
+    try:
+        reader = await session.get(Reader, reader_id)
+        copy = await session.get(BookCopy, copy_id)
+        librarian = await session.get(Librarian, librarian_id)
+
+        if not reader:
+            logger.warning("Читатель с ID %s не найден", reader_id)
+            return None
+        if not copy:
+            logger.warning("Экземпляр с ID %s не найден", copy_id)
+            return None
+        if not librarian:
+            logger.warning("Библиотекарь с ID %s не найден", librarian_id)
+            return None
+
+        if not copy.available:
+            logger.warning("Экземпляр %s недоступен для выдачи", copy.inventory_number)
+            return None
+
+        if loan_date is None:
+            loan_date = date.today()
+
+        loan = Loan(
+            reader_id=reader_id,
+            copy_id=copy_id,
+            librarian_id=librarian_id,
+            loan_date=loan_date,
+            return_date=loan_date + timedelta(days=return_days)
+        )
+        copy.available = False
+
+        session.add(loan)
+        await _commit(session, 'loans', 'book_copies')
+        logger.info("Выдача создана: %s -> экземпляр %s (ID: %s)", reader.name, copy.inventory_number, loan.id)
+        return loan
+
+    except Exception as e:
+        await session.rollback()
+        logger.error("Ошибка при создании выдачи: %s", e)
+        return None
+
+
+async def return_loan(session, loan_id, actual_return_date=None, expected_version=None):
+    """
+    Возврат книги по выдаче (как db_funcs.return_loan): экземпляр освобождается,
+    только если выдача еще не была возвращена. expected_version - версия, с которой
+    начато редактирование; если выдачу уже изменили, возвращается UpdateConflict
+    """
+    try:
+        # Строка выдачи блокируется до конца транзакции, поэтому решение не меняется до UPDATE
+        released_copy_id = await session.scalar(
+            select(Loan.copy_id).where(Loan.id == loan_id, Loan.returned == False).with_for_update()
+        )
+
+        statement = update(Loan).where(Loan.id == loan_id)
+        if expected_version is not None:
+            statement = statement.where(Loan.version == expected_version)
+        loan = (await session.execute(
+            statement.values(returned=True, actual_return_date=actual_return_date or date.today(),
+                             version=Loan.version + 1).returning(Loan),
+            execution_options={'synchronize_session': False, 'populate_existing': True}
+        )).scalar_one_or_none()
+
+        if loan is None:
+            # Строка не обновлена, в базе ничего не изменилось - транзакция вызывающего кода не откатывается
+            current_version = await session.scalar(select(Loan.version).where(Loan.id == loan_id))
+            if current_version is None:
+                logger.warning("Выдача с ID %s не найдена", loan_id)
+                return None
+            logger.warning("Конфликт обновления loans ID %s: ожидалась версия %s, в базе %s",
+                           loan_id, expected_version, current_version)
+            return UpdateConflict('loans', loan_id, expected_version, current_version)
+
+        if released_copy_id is not None:
+            released = await session.execute(
+                update(BookCopy).where(BookCopy.id == released_copy_id)
+                .values(available=True, version=BookCopy.version + 1)
+            )
+            if released.rowcount != 1:
+                raise ValueError(f"Экземпляр ID {released_copy_id} выдачи ID {loan_id} не найден")
+
+        await _commit(session, 'loans', 'book_copies')
+        logger.info("Выдача ID %s обновлена. Измененные поля: returned, actual_return_date", loan_id)
+        return loan
+
+    except Exception as e:
+        await session.rollback()
+        logger.error("Ошибка при возврате книги: %s", e)
+        return None
+
+
+# Штрафы
+
+async def get_all_fines(session):
+    """
+    Получение всех штрафов
+    """
+    try:
+        fines = (await session.scalars(select(Fine).order_by(Fine.issued_date.desc()))).all()
+        logger.debug("Найдено %s штрафов", len(fines))
+        return fines
+    except Exception as e:
+        logger.error("Ошибка при получении всех штрафов: %s", e)
+        return []
+
+
+async def get_unpaid_fines(session, reader_id=None):
+    """
+    Получение неоплаченных штрафов
+    """
+    try:
+        statement = select(Fine).where(Fine.paid == False)
+        if reader_id:
+            statement = statement.join(Loan).where(Loan.reader_id == reader_id)
+        fines = (await session.scalars(statement.order_by(Fine.issued_date))).all()
+        logger.debug("Найдено %s неоплаченных штрафов", len(fines))
+        return fines
+    except Exception as e:
+        logger.error("Ошибка при получении неоплаченных штрафов: %s", e)
+        return []
+
+
+async def get_fines_by_reader(session, reader_id, unpaid_only=False):
+    """
+    Получение штрафов читателя
+    """
+    try:
+        statement = select(Fine).join(Loan).where(Loan.reader_id == reader_id)
+        if unpaid_only:
+            statement = statement.where(Fine.paid == False)
+        fines = (await session.scalars(statement.order_by(Fine.issued_date.desc()))).all()
+        logger.debug("Найдено %s штрафов для читателя ID %s", len(fines), reader_id)
+        return fines
+    except Exception as e:
+        logger.error("Ошибка при получении штрафов читателя: %s", e)
+        return []
+
+
+async def create_fine(session, loan_id, librarian_id, amount, issued_date=None):
+    """
+    Создание штрафа
+    """
+    try:
+        loan = await get_loan_by_id(session, loan_id)
+        librarian = await session.get(Librarian, librarian_id)
+
+        if not loan:
+            return None
+        if not librarian:
+            logger.warning("Библиотекарь с ID %s не найден", librarian_id)
+            return None
+
+        existing_fine = await session.scalar(select(Fine.id).where(Fine.loan_id == loan_id))
+        if existing_fine:
+            logger.warning("Штраф для выдачи ID %s уже существует", loan_id)
+            return None
+
+        fine = Fine(
+            loan_id=loan_id,
+            librarian_id=librarian_id,
+            amount=amount,
+            issued_date=issued_date or date.today()
+        )
+        session.add(fine)
+        await _commit(session, 'fines')
+        logger.info("Штраф создан: %s руб. для выдачи ID %s (ID штрафа: %s)", amount, loan_id, fine.id)
+        return fine
+
+    except Exception as e:
+        await session.rollback()
+        logger.error("Ошибка при создании штрафа: %s", e)
+        return None
+
+
+async def pay_fine(session, fine_id):
+    """
+    Оплата штрафа
+    """
+    try:
+        fine = await session.get(Fine, fine_id)
+        if not fine:
+            logger.warning("Штраф с ID %s не найден", fine_id)
+            return None
+
+        fine.paid = True
+        await _commit(session, 'fines')
+        logger.info("Штраф ID %s обновлен. Измененные поля: paid", fine_id)
+        return fine
+
+    except Exception as e:
+        await session.rollback()
+        logger.error("Ошибка при обновлении штрафа: %s", e)
+        return None
+
+
+async def auto_create_overdue_fines(session, daily_rate=10):
+    """
+    Автоматическое создание штрафов для просроченных выдач без штрафа
+    (одним запросом на выборку и одной транзакцией на запись)
+    """
+    try:
+        today = date.today()
+        overdue_loans = (await session.scalars(
+            select(Loan)
+            .outerjoin(Fine, Fine.loan_id == Loan.id)
+            .where(Loan.returned == False, Loan.return_date < today, Fine.id == None)
+            .order_by(Loan.return_date)
+        )).all()
+
+        default_librarian_id = None
+        if any(loan.librarian_id is None for loan in overdue_loans):
+            default_librarian_id = await session.scalar(select(Librarian.id).limit(1))
+
+        created_fines = []
+        for loan in overdue_loans:
+            librarian_id = loan.librarian_id or default_librarian_id
+            amount = (today - loan.return_date).days * daily_rate
+            if librarian_id and amount > 0:
+                fine = Fine(loan_id=loan.id, librarian_id=librarian_id, amount=amount, issued_date=today)
+                session.add(fine)
+                created_fines.append(fine)
+
+        await _commit(session, 'fines')
+        logger.info("Создано %s штрафов за просрочку", len(created_fines))
+        return created_fines
+
+    except Exception as e:
+        await session.rollback()
+        logger.error("Ошибка при автоматическом создании штрафов: %s", e)
+        return []
+
+
+# Статистика
+
+async def get_loan_statistics(session, reader_id=None):
+    """
+    Получение статистики по выдачам (одним запросом)
+    """
+    try:
+        statement = select(
+            func.count(Loan.id),
+            func.count(Loan.id).filter(Loan.returned == False),
+            func.count(Loan.id).filter(and_(Loan.returned == False, Loan.return_date < date.today()))
+        )
+        if reader_id:
+            statement = statement.where(Loan.reader_id == reader_id)
+        total, active, overdue = (await session.execute(statement)).one()
+        return {
+            'total': total,
+            'active': active,
+            'returned': total - active,
+            'overdue': overdue
+        }
+    except Exception as e:
+        logger.error("Ошибка при получении статистики выдач: %s", e)
+        return {}
+
+
+async def get_fine_statistics(session, reader_id=None):
+    """
+    Получение статистики по штрафам (одним запросом)
+    """
+    try:
+        statement = select(
+            func.count(Fine.id),
+            func.count(Fine.id).filter(Fine.paid == True),
+            func.coalesce(func.sum(Fine.amount), 0),
+            func.coalesce(func.sum(Fine.amount).filter(Fine.paid == False), 0)
+        )
+        if reader_id:
+            statement = statement.join(Loan, Loan.id == Fine.loan_id).where(Loan.reader_id == reader_id)
+        total, paid, total_amount, unpaid_amount = (await session.execute(statement)).one()
+        return {
+            'total': total,
+            'paid': paid,
+            'unpaid': total - paid,
+            'total_amount': float(total_amount),
+            'unpaid_amount': float(unpaid_amount)
+        }
+    except Exception as e:
+        logger.error("Ошибка при получении статистики штрафов: %s", e)
+        return {}
+
+
+async def get_dashboard_statistics():
+    """
+    Сводка для главной вкладки: запросы выполняются параллельно в отдельных сессиях
+    """
+    readers, books, loans, fines = await gather(
+        (get_readers_count,),
+        (get_books_count,),
+        (get_loan_statistics,),
+        (get_fine_statistics,),
+    )
+    return {'readers': readers, 'books': books, 'loans': loans, 'fines': fines}
+
+
+if __name__ == "__main__":
+    print(asyncio.run(get_dashboard_statistics()))
@@ -0,0 +1,769 @@
+import argparse
+import contextlib
+import inspect
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from . import db_funcs as db
+from .db_config import DB_HOST, DB_USER, DB_PORT, DB_PASS, DB_NAME
+from .instrumentation import track_queries, DEFAULT_N_PLUS_ONE_THRESHOLD
+from .models import Base, Reader, Book, BookCopy, Genre, Librarian, Loan, Fine, genres_books
+from .password_hasher import PasswordHasher
+from .snapshot import CatalogSnapshot
+
+
+# Бенчмарк работает только с отдельной базой, по умолчанию <DB_NAME>_bench
+DEFAULT_BENCH_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}_bench"
+
+INSERT_CHUNK = 5000
+
+# Служебные функции db_funcs, которые не измеряются (работают с основной БД или не обращаются к ней)
+SKIPPED_FUNCTIONS = {
+    'get_engine', 'init_db', 'get_session', 'close_session', 'check_db_connection',
+    'get_table_names', 'get_table_info', 'drop_all_tables', 'execute_raw_sql',
+    'get_database_stats', 'start_cache_listener', 'safe_commit', 'with_session',
+    'create_missing_indexes', 'get_login_stats', 'configure_password_hashing',
+    'get_metrics_text', 'session_scope', 'configure_engine', 'install_change_tracking',
+    'create_missing_columns', 'print_reader_info', 'print_librarian_info', 'print_book_info', 'print_genre_info',
+    'print_copy_info', 'print_loan_info', 'print_fine_info',
+}
+
+GENRE_NAMES = [
+    "Роман", "Детектив", "Фантастика", "Фэнтези", "Поэзия", "Драма", "История",
+    "Биография", "Научная литература", "Психология", "Философия", "Приключения",
+    "Детская литература", "Классика", "Ужасы", "Юмор", "Публицистика", "Экономика",
+    "Искусство", "Справочники",
+]
+
+POSITIONS = ["Администратор", "Старший библиотекарь", "Библиотекарь", "Помощник библиотекаря"]
+
+# Значения фильтров по умолчанию для безголового запуска загрузчиков FullLibraryApp
+HEADLESS_WIDGET_VALUES = {
+    'books_filter': "Все книги",
+    'copies_filter': "Все экземпляры",
+    'reader_filter': "Все читатели",
+    'loans_filter': "Все выдачи",
+    'fines_filter': "Все штрафы",
+    'librarians_filter': "Все библиотекари",
+}
+
+HEADLESS_WIDGET_SUFFIXES = ('_tree', '_label', '_filter', '_search', '_entry')
+
+
+def _popularity_weights(count, skew):
+    """Распределение Ципфа: элемент с рангом r выбирается с весом 1 / r^skew"""
+    cumulative = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+def _insert(connection, table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        connection.execute(table.insert(), rows[start:start + INSERT_CHUNK])
+
+
+def generate_library(engine, readers=2000, books=1000, copies=3000, loans=10000, fines=1000,
+                     librarians=10, skew=1.1, seed=42):
+    """
+    Заполнение базы синтетической библиотекой.
+    Популярность книг и активность читателей распределены по Ципфу (параметр skew).
+    Все таблицы пересоздаются!
+    """
+    rng = random.Random(seed)
+    today = date.today()
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    db.install_change_tracking(engine)
+
+    password_hash = PasswordHasher(rounds=4).hash("password")
+
+    genre_rows = [{'id': i + 1, 'name': name} for i, name in enumerate(GENRE_NAMES)]
+
+    librarian_rows = [{
+        'id': i + 1,
+        'name': f"Библиотекарь {i + 1}",
+        'email': f"librarian{i + 1}@library.ru",
+        'password_hash': password_hash,
+        'hire_date': today - timedelta(days=rng.randint(30, 3650)),
+        'position': POSITIONS[0] if i == 0 else rng.choice(POSITIONS),
+    } for i in range(librarians)]
+
+    reader_rows = [{
+        'id': i + 1,
+        'name': f"Читатель {i + 1}",
+        'email': f"reader{i + 1}@mail.ru",
+        'phone_number': f"+7900{i:07d}",
+        'registration_date': today - timedelta(days=rng.randint(0, 3650)),
+    } for i in range(readers)]
+
+    authors = [f"Автор {i + 1}" for i in range(max(1, books // 5))]
+    book_rows = [{
+        'id': i + 1,
+        'title': f"Книга {i + 1}",
+        'author': rng.choice(authors),
+        'isbn': f"978{i:010d}",
+        'publish_year': rng.randint(1900, today.year),
+        'description': None,
+        'available': True,
+    } for i in range(books)]
+
+    genre_book_rows = []
+    for book in book_rows:
+        for genre_id in rng.sample(range(1, len(GENRE_NAMES) + 1), rng.randint(1, 3)):
+            genre_book_rows.append({'genre_id': genre_id, 'book_id': book['id']})
+
+    # Популярные книги получают больше экземпляров
+    book_weights = _popularity_weights(books, skew)
+    copy_rows = []
+    copies_by_book = {}
+    book_ids = [book['id'] for book in book_rows]
+    for i in range(copies):
+        book_id = book_ids[i] if i < books else rng.choices(book_ids, cum_weights=book_weights)[0]
+        copy_id = i + 1
+        copies_by_book.setdefault(book_id, []).append(copy_id)
+        copy_rows.append({
+            'id': copy_id,
+            'book_id': book_id,
+            'inventory_number': f"INV-{copy_id:08d}",
+            'condition': rng.choice(["Отличное", "Хорошее", "Хорошее", "Удовлетворительное"]),
+            'location': f"Стеллаж {rng.randint(1, 50)}",
+            'available': True,
+            'status': 'available',
+        })
+
+    reader_weights = _popularity_weights(readers, skew / 2)
+    reader_ids = [reader['id'] for reader in reader_rows]
+    books_with_copies = [book_id for book_id in book_ids if book_id in copies_by_book]
+    loan_book_weights = list(itertools.accumulate(1.0 / book_id ** skew for book_id in books_with_copies))
+    active_copies = set()
+    loan_rows = []
+    for i in range(loans):
+        book_id = rng.choices(books_with_copies, cum_weights=loan_book_weights)[0]
+        copy_id = rng.choice(copies_by_book[book_id])
+        loan_date = today - timedelta(days=rng.randint(0, 730))
+        return_date = loan_date + timedelta(days=14)
+        active = (today - loan_date).days <= 45 and copy_id not in active_copies and rng.random() < 0.7
+        if active:
+            active_copies.add(copy_id)
+            copy_rows[copy_id - 1]['available'] = False
+            copy_rows[copy_id - 1]['status'] = 'borrowed'
+            actual_return_date = None
+        else:
+            actual_return_date = min(today, loan_date + timedelta(days=rng.randint(1, 30)))
+        loan_rows.append({
+            'id': i + 1,
+            'reader_id': rng.choices(reader_ids, cum_weights=reader_weights)[0],
+            'copy_id': copy_id,
+            'librarian_id': rng.randint(1, librarians),
+            'loan_date': loan_date,
+            'return_date': return_date,
+            'actual_return_date': actual_return_date,
+            'returned': not active,
+        })
+
+    late_loans = [loan for loan in loan_rows
+                  if (loan['actual_return_date'] or today) > loan['return_date']]
+    fine_rows = []
+    for i, loan in enumerate(rng.sample(late_loans, min(fines, len(late_loans)))):
+        overdue_days = ((loan['actual_return_date'] or today) - loan['return_date']).days
+        fine_rows.append({
+            'id': i + 1,
+            'loan_id': loan['id'],
+            'librarian_id': loan['librarian_id'],
+            'amount': overdue_days * 10,
+            'issued_date': loan['return_date'] + timedelta(days=1),
+            'paid': rng.random() < 0.6,
+        })
+
+    with engine.begin() as connection:
+        _insert(connection, Genre.__table__, genre_rows)
+        _insert(connection, Librarian.__table__, librarian_rows)
+        _insert(connection, Reader.__table__, reader_rows)
+        _insert(connection, Book.__table__, book_rows)
+        _insert(connection, genres_books, genre_book_rows)
+        _insert(connection, BookCopy.__table__, copy_rows)
+        _insert(connection, Loan.__table__, loan_rows)
+        _insert(connection, Fine.__table__, fine_rows)
+
+        # Явные id не сдвигают последовательности PostgreSQL
+        if engine.dialect.name == 'postgresql':
+            for table in (Genre, Librarian, Reader, Book, BookCopy, Loan, Fine):
+                name = table.__tablename__
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {name}), 1))"
+                ))
+
+    sizes = {
+        'genres': len(genre_rows), 'librarians': len(librarian_rows), 'readers': len(reader_rows),
+        'books': len(book_rows), 'copies': len(copy_rows), 'loans': len(loan_rows), 'fines': len(fine_rows),
+    }
+    print(f"Сгенерирована библиотека: {sizes}")
+    return sizes
+
+
+class BenchContext:
+    """Случайные существующие id для аргументов измеряемых функций"""
+
+    def __init__(self, session, seed=42):
+        self.rng = random.Random(seed)
+        self.unique = 0
+
+        def ids(model):
+            return [row[0] for row in session.query(model.id).all()]
+
+        self.reader_ids = ids(Reader)
+        self.book_ids = ids(Book)
+        self.copy_ids = ids(BookCopy)
+        self.genre_ids = ids(Genre)
+        self.librarian_ids = ids(Librarian)
+        self.loan_ids = ids(Loan)
+        self.fine_ids = ids(Fine)
+        self.reader = session.query(Reader).first()
+        self.librarian = session.query(Librarian).first()
+        self.book = session.query(Book).first()
+        self.copy = session.query(BookCopy).first()
+        self.genre = session.query(Genre).first()
+
+    def pick(self, ids):
+        return self.rng.choice(ids)
+
+    def next_suffix(self):
+        self.unique += 1
+        return f"{os.getpid()}-{time.time_ns()}-{self.unique}"
+
+
+def _available_copy_id(session):
+    copy = session.query(BookCopy).filter(BookCopy.available == True).first()
+    return copy.id if copy else None
+
+
+def _create_and_delete_reader(session, ctx):
+    reader = db.create_reader(session, "Временный читатель", f"tmp{ctx.next_suffix()}@bench.ru")
+    if reader:
+        db.delete_reader(session, reader.id)
+
+
+def _loan_cycle(session, ctx):
+    copy_id = _available_copy_id(session)
+    if copy_id is None:
+        return
+    loan = db.create_loan(session, ctx.pick(ctx.reader_ids), copy_id, ctx.librarian.id)
+    if loan:
+        fine = db.create_fine(session, loan.id, ctx.librarian.id, 10)
+        if fine:
+            db.pay_fine(session, fine.id)
+            db.delete_fine(session, fine.id)
+        db.return_loan(session, loan.id)
+        db.delete_loan(session, loan.id)
+
+    copy_id = _available_copy_id(session)
+    loan = copy_id and db.create_loan(session, ctx.pick(ctx.reader_ids), copy_id, ctx.librarian.id)
+    if loan:
+        _, fine = db.return_loan_with_fine(session, loan.id, ctx.librarian.id, 'good', 10)
+        if fine:
+            db.delete_fine(session, fine.id)
+        db.delete_loan(session, loan.id)
+
+
+def _overdue_fines_cycle(session):
+    fines = db.auto_create_overdue_fines(session)
+    if fines:
+        session.query(Fine).filter(Fine.id.in_([fine.id for fine in fines])).delete(synchronize_session=False)
+        session.commit()
+
+
+def _book_cycle(session, ctx):
+    suffix = ctx.next_suffix()
+    book = db.create_book(session, f"Временная книга {suffix}", "Бенчмарк", isbn=f"bench-{suffix}"[:20])
+    genre = db.create_genre(session, f"Жанр {suffix}")
+    if genre:
+        db.add_genre_to_book(session, book.id, genre.id)
+        db.remove_genre_from_book(session, book.id, genre.id)
+        db.set_book_genres(session, book.id, [genre.id])
+        db.update_genre(session, genre.id, name=f"Жанр* {suffix}")
+        db.delete_genre(session, genre.id)
+    db.create_book_copy(session, book.id, f"B-{suffix}"[:50])
+    db.create_multiple_copies(session, book.id, [f"M1-{suffix}"[:50], f"M2-{suffix}"[:50]])
+    db.mark_all_copies_unavailable(session, book.id)
+    db.update_book(session, book.id, description="Обновлено")
+    db.delete_book(session, book.id)
+
+
+def _copy_cycle(session, ctx):
+    suffix = ctx.next_suffix()
+    copy = db.create_book_copy(session, ctx.book.id, f"C-{suffix}"[:50])
+    db.update_copy(session, copy.id, condition="Хорошее")
+    db.update_book_copy_status(session, copy.id, 'available')
+    db.write_off_copy(session, copy.id)
+    db.delete_copy_by_inventory(session, copy.inventory_number)
+
+
+def _librarian_cycle(session, ctx):
+    suffix = ctx.next_suffix()
+    librarian = db.create_librarian(session, "Временный библиотекарь", f"lib{suffix}@bench.ru", "password")
+    if librarian:
+        db.authenticate_librarian(session, librarian.email, "password", source=suffix)
+        db.change_librarian_password(session, librarian.id, "password", "password2")
+        db.update_librarian(session, librarian.id, position="Библиотекарь")
+        db.delete_librarian_by_email(session, librarian.email)
+
+
+def function_cases(ctx):
+    """
+    Измеряемые вызовы db_funcs: (имя, функция(session)).
+    Изменяющие операции собраны в циклы создания/удаления, чтобы база оставалась прежней
+    """
+    pick = ctx.pick
+    return [
+        ('get_reader_by_id', lambda s: db.get_reader_by_id(s, pick(ctx.reader_ids))),
+        ('get_reader_by_email', lambda s: db.get_reader_by_email(s, ctx.reader.email)),
+        ('get_all_readers', lambda s: db.get_all_readers(s)),
+        ('get_readers_page', lambda s: db.get_readers_page(s, order_by='name')),
+        ('search_readers', lambda s: db.search_readers(s, "Читатель 1")),
+        ('get_readers_count', lambda s: db.get_readers_count(s)),
+        ('get_recent_readers', lambda s: db.get_recent_readers(s)),
+        ('update_reader', lambda s: db.update_reader(s, pick(ctx.reader_ids), phone_number="+79000000000")),
+        ('create_reader+delete_reader', lambda s: _create_and_delete_reader(s, ctx)),
+        ('delete_reader_by_email', lambda s: db.delete_reader_by_email(s, "missing@bench.ru")),
+        ('hash_password', lambda s: db.hash_password("password")),
+        ('verify_password', lambda s: db.verify_password("password", ctx.librarian.password_hash)),
+        ('get_librarian_by_id', lambda s: db.get_librarian_by_id(s, pick(ctx.librarian_ids))),
+        ('get_librarian_by_email', lambda s: db.get_librarian_by_email(s, ctx.librarian.email)),
+        ('get_all_librarians', lambda s: db.get_all_librarians(s)),
+        ('get_librarians_page', lambda s: db.get_librarians_page(s)),
+        ('search_librarians', lambda s: db.search_librarians(s, "Библиотекарь")),
+        ('get_librarians_count', lambda s: db.get_librarians_count(s)),
+        ('librarian_cycle', lambda s: _librarian_cycle(s, ctx)),
+        ('delete_librarian', lambda s: db.delete_librarian(s, -1)),
+        ('get_book_by_id', lambda s: db.get_book_by_id(s, pick(ctx.book_ids))),
+        ('get_book_by_isbn', lambda s: db.get_book_by_isbn(s, ctx.book.isbn)),
+        ('search_books', lambda s: db.search_books(s, title="Книга 1", available_only=True)),
+        ('get_books_by_author', lambda s: db.get_books_by_author(s, ctx.book.author)),
+        ('get_books_by_year', lambda s: db.get_books_by_year(s, ctx.book.publish_year)),
+        ('get_all_books', lambda s: db.get_all_books(s)),
+        ('get_books_page', lambda s: db.get_books_page(s, order_by='author')),
+        ('get_books_count', lambda s: db.get_books_count(s)),
+        ('book_cycle', lambda s: _book_cycle(s, ctx)),
+        ('get_genre_by_id', lambda s: db.get_genre_by_id(s, pick(ctx.genre_ids))),
+        ('get_genre_by_name', lambda s: db.get_genre_by_name(s, ctx.genre.name)),
+        ('get_all_genres', lambda s: db.get_all_genres(s)),
+        ('search_genres', lambda s: db.search_genres(s, "а")),
+        ('get_books_by_genre', lambda s: db.get_books_by_genre(s, pick(ctx.genre_ids))),
+        ('get_genres_by_book', lambda s: db.get_genres_by_book(s, pick(ctx.book_ids))),
+        ('get_genres_count', lambda s: db.get_genres_count(s)),
+        ('get_copy_by_id', lambda s: db.get_copy_by_id(s, pick(ctx.copy_ids))),
+        ('get_copy_by_inventory', lambda s: db.get_copy_by_inventory(s, ctx.copy.inventory_number)),
+        ('get_copies_by_book', lambda s: db.get_copies_by_book(s, pick(ctx.book_ids))),
+        ('get_available_copies', lambda s: db.get_available_copies(s, pick(ctx.book_ids))),
+        ('get_available_copies_count', lambda s: db.get_available_copies_count(s, pick(ctx.book_ids))),
+        ('get_all_copies', lambda s: db.get_all_copies(s)),
+        ('get_copies_page', lambda s: db.get_copies_page(s, order_by='inventory_number')),
+        ('get_all_book_copies', lambda s: db.get_all_book_copies(s)),
+        ('search_copies', lambda s: db.search_copies(s, inventory_number="INV-0000")),
+        ('get_copies_count', lambda s: db.get_copies_count(s, available_only=True)),
+        ('get_copies_statistics', lambda s: db.get_copies_statistics(s)),
+        ('copy_cycle', lambda s: _copy_cycle(s, ctx)),
+        ('delete_copy', lambda s: db.delete_copy(s, -1)),
+        ('get_loan_by_id', lambda s: db.get_loan_by_id(s, pick(ctx.loan_ids))),
+        ('get_loans_by_reader', lambda s: db.get_loans_by_reader(s, pick(ctx.reader_ids))),
+        ('get_loans_by_copy', lambda s: db.get_loans_by_copy(s, pick(ctx.copy_ids))),
+        ('get_active_loans', lambda s: db.get_active_loans(s)),
+        ('get_overdue_loans', lambda s: db.get_overdue_loans(s)),
+        ('get_all_loans', lambda s: db.get_all_loans(s)),
+        ('get_loans_page', lambda s: db.get_loans_page(s, order_by='return_date', descending=True)),
+        ('get_sorted_ids', lambda s: db.get_sorted_ids(s, 'loans', 'return_date')),
+        ('get_changes_since', lambda s: db.get_changes_since(
+            s, 'loans', (datetime.now() - timedelta(days=1)).isoformat())),
+        ('get_change_token', lambda s: db.get_change_token(s)),
+        ('purge_deleted_rows', lambda s: db.purge_deleted_rows(s)),
+        ('get_returned_loans', lambda s: db.get_returned_loans(s)),
+        ('get_active_loan_by_copy', lambda s: db.get_active_loan_by_copy(s, pick(ctx.copy_ids))),
+        ('calculate_overdue_fine', lambda s: db.calculate_overdue_fine(s, pick(ctx.loan_ids))),
+        ('get_loan_statistics', lambda s: db.get_loan_statistics(s)),
+        ('update_loan', lambda s: db.update_loan(s, pick(ctx.loan_ids))),
+        ('loan_cycle', lambda s: _loan_cycle(s, ctx)),
+        ('get_fine_by_id', lambda s: db.get_fine_by_id(s, pick(ctx.fine_ids))),
+        ('get_fine_by_loan', lambda s: db.get_fine_by_loan(s, pick(ctx.loan_ids))),
+        ('get_fines_by_reader', lambda s: db.get_fines_by_reader(s, pick(ctx.reader_ids))),
+        ('get_unpaid_fines', lambda s: db.get_unpaid_fines(s)),
+        ('get_all_fines', lambda s: db.get_all_fines(s)),
+        ('get_fines_page', lambda s: db.get_fines_page(s, order_by='amount')),
+        ('get_fine_statistics', lambda s: db.get_fine_statistics(s)),
+        ('update_fine', lambda s: db.update_fine(s, pick(ctx.fine_ids))),
+        ('auto_create_overdue_fines', lambda s: _overdue_fines_cycle(s)),
+        ('load_by_ids', lambda s: db.load_by_ids(s, Fine, ctx.rng.sample(ctx.fine_ids, min(100, len(ctx.fine_ids))))),
+        ('get_readers_by_ids', lambda s: db.get_readers_by_ids(s, ctx.rng.sample(ctx.reader_ids, min(100, len(ctx.reader_ids))))),
+        ('get_books_by_ids', lambda s: db.get_books_by_ids(s, ctx.rng.sample(ctx.book_ids, min(100, len(ctx.book_ids))))),
+        ('get_copies_by_ids', lambda s: db.get_copies_by_ids(s, ctx.rng.sample(ctx.copy_ids, min(100, len(ctx.copy_ids))))),
+        ('get_librarians_by_ids', lambda s: db.get_librarians_by_ids(s, ctx.librarian_ids)),
+        ('get_loans_by_ids', lambda s: db.get_loans_by_ids(s, ctx.rng.sample(ctx.loan_ids, min(100, len(ctx.loan_ids))))),
+        ('iter_all_readers', lambda s: sum(1 for _ in db.iter_all_readers(s))),
+        ('iter_all_librarians', lambda s: sum(1 for _ in db.iter_all_librarians(s))),
+        ('iter_all_copies', lambda s: sum(1 for _ in db.iter_all_copies(s))),
+        ('iter_all_loans', lambda s: sum(1 for _ in db.iter_all_loans(s))),
+        ('iter_returned_loans', lambda s: sum(1 for _ in db.iter_returned_loans(s))),
+        ('iter_all_fines', lambda s: sum(1 for _ in db.iter_all_fines(s))),
+        ('iter_all_books', lambda s: sum(1 for _ in db.iter_all_books(s))),
+        ('iter_all_book_copies', lambda s: sum(1 for _ in db.iter_all_book_copies(s))),
+    ]
+
+
+# Функции, вызываемые внутри циклов создания/удаления
+CYCLE_FUNCTIONS = {
+    'create_reader', 'delete_reader', 'create_loan', 'create_fine', 'pay_fine', 'delete_fine',
+    'return_loan', 'return_loan_with_fine', 'delete_loan', 'create_book', 'create_genre', 'add_genre_to_book',
+    'remove_genre_from_book', 'set_book_genres', 'update_genre', 'delete_genre', 'create_book_copy',
+    'create_multiple_copies', 'mark_all_copies_unavailable', 'update_book', 'delete_book',
+    'update_copy', 'update_book_copy_status', 'write_off_copy', 'delete_copy_by_inventory',
+    'create_librarian', 'authenticate_librarian', 'change_librarian_password', 'update_librarian',
+    'delete_librarian_by_email',
+}
+
+
+def uncovered_functions(cases):
+    """Публичные функции db_funcs, для которых нет замера"""
+    covered = {name for name, _ in cases} | CYCLE_FUNCTIONS | SKIPPED_FUNCTIONS
+    public = {
+        name for name, member in inspect.getmembers(db, inspect.isfunction)
+        if not name.startswith('_') and member.__module__ == db.__name__
+    }
+    return sorted(public - covered)
+
+
+class _HeadlessWidget:
+    """Заглушка виджета Tk: хранит строки таблицы и значение поля ввода"""
+
+    def __init__(self, value=''):
+        self.value = value
+        self.rows = []
+
+    def get(self, *args):
+        return self.value
+
+    def get_children(self, *args):
+        return list(range(len(self.rows)))
+
+    def insert(self, parent, index, values=(), **kwargs):
+        self.rows.append(values)
+        return len(self.rows) - 1
+
+    def delete(self, *items):
+        self.rows.clear()
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _HeadlessMessagebox:
+    """Ошибки загрузчиков превращаются в исключения вместо диалогов"""
+
+    @staticmethod
+    def showerror(title, message, **kwargs):
+        raise RuntimeError(message)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def headless_app(session, user):
+    """
+    Экземпляр FullLibraryApp без окна: виджеты заменены заглушками,
+    поэтому методы load_* выполняют только работу с данными.
+    Сессии приложения открываются на движке переданной сессии
+    """
+    import app as gui
+
+    gui.messagebox = _HeadlessMessagebox()
+    db.configure_engine(session.get_bind())
+
+    class HeadlessLibraryApp(gui.FullLibraryApp):
+        def __init__(self):
+            self.current_user = user
+            self.is_running = True
+            self.search_indexes = {}
+            self.sort_states = {}
+            self.sort_headings = {}
+            self.built_tabs = set()
+            self.prefetched = {}
+            self.catalog_snapshot = CatalogSnapshot(None)
+            self.snapshot_tables = set()
+
+        def __getattr__(self, name):
+            if not name.endswith(HEADLESS_WIDGET_SUFFIXES):
+                raise AttributeError(name)
+            widget = _HeadlessWidget(HEADLESS_WIDGET_VALUES.get(name, ''))
+            self.__dict__[name] = widget
+            return widget
+
+    return HeadlessLibraryApp()
+
+
+APP_LOADERS = [
+    'load_books', 'load_book_copies', 'load_readers', 'load_loans', 'load_fines', 'load_librarians',
+    'load_initial_readers_for_issue', 'load_initial_books_for_issue', 'load_initial_loans_for_fine',
+    'search_books_for_issue',
+]
+
+
+def app_cases(ctx):
+    def loader(name):
+        def run(session):
+            app = headless_app(session, ctx.librarian)
+            if name == 'search_books_for_issue':
+                app.book_search_entry.value = "книга 1"
+            getattr(app, name)()
+        return run
+
+    return [(f"app.{name}", loader(name)) for name in APP_LOADERS]
+
+
+def _percentile(sorted_values, fraction):
+    # Метод ближайшего ранга
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def measure(Session, name, func, iterations):
+    """
+    Замер задержки, количества запросов и повторов одной формы запроса за iterations вызовов.
+    Кэш запросов очищается перед каждым вызовом: замеряется выполнение в БД, а не попадание в кэш
+    """
+    timings = []
+    queries = []
+    db_timings = []
+    repeats = 0
+    for _ in range(iterations):
+        db.query_cache.invalidate_all()
+        session = Session()
+        try:
+            with track_queries(name, report=False) as stats:
+                started = time.perf_counter()
+                func(session)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(stats.statements)
+            db_timings.append(stats.db_time * 1000)
+            repeats = max(repeats, stats.max_repeats)
+        finally:
+            session.close()
+
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': statistics.fmean(timings),
+        'min_ms': timings[0],
+        'p50_ms': _percentile(timings, 0.50),
+        'p90_ms': _percentile(timings, 0.90),
+        'p99_ms': _percentile(timings, 0.99),
+        'max_ms': timings[-1],
+        'queries': statistics.fmean(queries),
+        'db_ms': statistics.fmean(db_timings),
+        'max_repeats': repeats,
+    }
+
+
+# Выборки по ID: прежний вариант (новый ORM Query на каждый вызов) и функция db_funcs
+LOOKUP_CASES = [
+    ('get_reader_by_id', 'reader_ids', lambda session, id_: session.query(Reader).filter(Reader.id == id_).first(),
+     db.get_reader_by_id),
+    ('get_book_by_id', 'book_ids', lambda session, id_: session.query(Book).filter(Book.id == id_).first(),
+     db.get_book_by_id),
+    ('get_copy_by_id', 'copy_ids', lambda session, id_: session.query(BookCopy).filter(BookCopy.id == id_).first(),
+     db.get_copy_by_id),
+    ('get_loan_by_id', 'loan_ids', lambda session, id_: session.query(Loan).filter(Loan.id == id_).first(),
+     db.get_loan_by_id),
+    ('get_fine_by_id', 'fine_ids', lambda session, id_: session.query(Fine).filter(Fine.id == id_).first(),
+     db.get_fine_by_id),
+    ('get_active_loan_by_copy', 'copy_ids',
+     lambda session, id_: session.query(Loan).filter(Loan.copy_id == id_, Loan.returned == False).first(),
+     db.get_active_loan_by_copy),
+]
+
+
+def _per_call_us(session, func, ids, calls):
+    session.expunge_all()
+    started = time.perf_counter()
+    for id_ in itertools.islice(itertools.cycle(ids), calls):
+        func(session, id_)
+    return (time.perf_counter() - started) * 1e6 / calls
+
+
+def run_lookup_benchmarks(engine, calls=2000, seed=42):
+    """
+    Накладные расходы одного вызова выборки по ID (мкс) в плотном цикле:
+    ORM Query, собираемый заново, против заранее построенного запроса db_funcs
+    """
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        ctx = BenchContext(session, seed)
+        results = {}
+        for name, ids_attr, legacy, current in LOOKUP_CASES:
+            ids = getattr(ctx, ids_attr)
+            if not ids:
+                continue
+            # Прогрев: кэш компиляции и пул соединений
+            _per_call_us(session, legacy, ids, min(calls, 100))
+            _per_call_us(session, current, ids, min(calls, 100))
+            before = _per_call_us(session, legacy, ids, calls)
+            after = _per_call_us(session, current, ids, calls)
+            results[name] = {'before_us': before, 'after_us': after}
+            print(f"{name:30s} было {before:8.1f} мкс  стало {after:8.1f} мкс  x{before / after:5.2f}")
+        return results
+    finally:
+        session.close()
+
+
+def run_benchmarks(engine, iterations=20, include_app=False, only=None, seed=42):
+    """Замер всех функций db_funcs (и загрузчиков интерфейса при include_app)"""
+    Session = sessionmaker(bind=engine)
+
+    setup_session = Session()
+    ctx = BenchContext(setup_session, seed)
+    cases = function_cases(ctx)
+    if include_app:
+        cases += app_cases(ctx)
+    if only:
+        cases = [case for case in cases if any(pattern in case[0] for pattern in only)]
+
+    results = {}
+    for name, func in cases:
+        # Вывод print() из db_funcs не должен попадать в замеры через терминал
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                stats = measure(Session, name, func, iterations)
+            except Exception as e:
+                stats = {'error': str(e)}
+        results[name] = stats
+        if 'error' in stats:
+            print(f"{name:40s} ОШИБКА: {stats['error']}")
+        else:
+            print(f"{name:40s} p50 {stats['p50_ms']:9.2f} мс  p90 {stats['p90_ms']:9.2f} мс  "
+                  f"p99 {stats['p99_ms']:9.2f} мс  запросов {stats['queries']:8.1f}")
+            if stats['max_repeats'] > DEFAULT_N_PLUS_ONE_THRESHOLD:
+                print(f"{'':40s} возможный N+1: один запрос выполнен {stats['max_repeats']} раз")
+    setup_session.close()
+
+    missing = uncovered_functions(function_cases(ctx))
+    if missing:
+        print(f"Функции без замера: {', '.join(missing)}")
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'iterations': iterations,
+            'dialect': engine.dialect.name,
+            'rows': {
+                'readers': len(ctx.reader_ids), 'books': len(ctx.book_ids), 'copies': len(ctx.copy_ids),
+                'loans': len(ctx.loan_ids), 'fines': len(ctx.fine_ids),
+            },
+        },
+        'results': results,
+    }
+
+
+def compare_runs(baseline, current, threshold=1.2, min_delta_ms=1.0):
+    """
+    Сравнение двух запусков. Регрессия - рост p50 или p90 больше чем в threshold раз
+    (и не меньше чем на min_delta_ms), либо рост числа запросов.
+    Возвращает список регрессий
+    """
+    regressions = []
+    print(f"{'операция':40s} {'p50 было':>10s} {'p50 стало':>10s} {'x':>6s} {'запросы':>15s}")
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if not old or 'error' in old or 'error' in new:
+            continue
+        ratio = new['p50_ms'] / old['p50_ms'] if old['p50_ms'] else float('inf')
+        slower = any(
+            new[key] > old[key] * threshold and new[key] - old[key] >= min_delta_ms
+            for key in ('p50_ms', 'p90_ms')
+        )
+        more_queries = new['queries'] > old['queries']
+        mark = ""
+        if slower or more_queries:
+            regressions.append(name)
+            mark = "  <-- регрессия"
+        print(f"{name:40s} {old['p50_ms']:10.2f} {new['p50_ms']:10.2f} {ratio:6.2f} "
+              f"{old['queries']:7.1f}->{new['queries']:<7.1f}{mark}")
+    print(f"Регрессий: {len(regressions)}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк функций db_funcs на синтетической библиотеке")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help="Пересоздать тестовую базу с синтетическими данными")
+    generate.add_argument('--url', default=DEFAULT_BENCH_URL)
+    generate.add_argument('--readers', type=int, default=2000)
+    generate.add_argument('--books', type=int, default=1000)
+    generate.add_argument('--copies', type=int, default=3000)
+    generate.add_argument('--loans', type=int, default=10000)
+    generate.add_argument('--fines', type=int, default=1000)
+    generate.add_argument('--librarians', type=int, default=10)
+    generate.add_argument('--skew', type=float, default=1.1)
+    generate.add_argument('--seed', type=int, default=42)
+
+    run = subparsers.add_parser('run', help="Выполнить замеры")
+    run.add_argument('--url', default=DEFAULT_BENCH_URL)
+    run.add_argument('--iterations', type=int, default=20)
+    run.add_argument('--app', action='store_true', help="Также замерить загрузчики FullLibraryApp")
+    run.add_argument('--only', nargs='*', help="Замерять только операции, содержащие эти подстроки")
+    run.add_argument('--out', help="Сохранить результаты в JSON")
+    run.add_argument('--seed', type=int, default=42)
+
+    lookups = subparsers.add_parser('lookups', help="Сравнить накладные расходы выборок по ID")
+    lookups.add_argument('--url', default=DEFAULT_BENCH_URL)
+    lookups.add_argument('--calls', type=int, default=2000)
+    lookups.add_argument('--seed', type=int, default=42)
+
+    compare = subparsers.add_parser('compare', help="Сравнить два сохраненных запуска")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=1.2)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        engine = create_engine(args.url)
+        generate_library(engine, args.readers, args.books, args.copies, args.loans, args.fines,
+                         args.librarians, args.skew, args.seed)
+        return 0
+
+    if args.command == 'run':
+        engine = create_engine(args.url)
+        report = run_benchmarks(engine, args.iterations, args.app, args.only, args.seed)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"Результаты сохранены в {args.out}")
+        return 0
+
+    if args.command == 'lookups':
+        run_lookup_benchmarks(create_engine(args.url), args.calls, args.seed)
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    return 1 if compare_runs(baseline, current, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2 @@
+# test_db.py - ручной сценарий для PostgreSQL (запускается как скрипт), а не набор тестов pytest
+collect_ignore = ['test_db.py']
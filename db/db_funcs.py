@@ -1,10 +1,66 @@
-import bcrypt
-from sqlalchemy import create_engine, and_, or_, text, inspect, func
+import base64
+import json
+import logging
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, and_, or_, text, inspect, func, select, update, tuple_, bindparam, any_, Integer
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import sessionmaker
-from datetime import date, timedelta
+from sqlalchemy.schema import CreateColumn
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-from .models import Base, Reader, Book, BookCopy, Genre, Librarian, Loan, Fine
+from .models import (
+    Base, Reader, Book, BookCopy, Genre, Librarian, Loan, Fine, deleted_rows, DELETED_ROWS_RETENTION_DAYS
+)
 from .db_config import DB_HOST, DB_NAME, DB_USER, DB_PORT, DB_PASS
+from .instrumentation import (
+    track_queries, instrumented, enable_tracking, assert_max_queries, assert_no_n_plus_one
+)
+from .login_limiter import LoginLimiter
+from .metrics import (
+    registry as metrics_registry, instrument_module, ErrorCountingHandler, configure_logging,
+    write_prometheus_textfile, start_metrics_server
+)
+from .password_hasher import PasswordHasher
+from .query_cache import (
+    cached_query, invalidate_tables, get_cache_stats, listen_for_invalidations, query_cache, NOTIFY_CHANNEL
+)
+from .slow_queries import enable_slow_query_log, disable_slow_query_log
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(ErrorCountingHandler())
+
+_engine = None
+
+
+# Заранее построенные запросы для частых выборок по ID (вызываются в циклах).
+# Запрос не собирается заново при каждом вызове, а скомпилированный SQL берется
+# из кэша компиляции движка. psycopg2 не поддерживает серверные prepared statements;
+# драйвер psycopg 3 (postgresql+psycopg://) подготавливает такие повторяющиеся
+# запросы на сервере сам после нескольких выполнений (prepare_threshold)
+_BY_ID_STATEMENTS = {
+    model: select(model).where(model.id == bindparam('id'))
+    for model in (Reader, Book, BookCopy, Librarian, Genre, Loan, Fine)
+}
+_ACTIVE_LOAN_BY_COPY = select(Loan).where(Loan.copy_id == bindparam('copy_id'), Loan.returned == False).limit(1)
+
+
+def _get_by_id(session, model, object_id):
+    return session.execute(_BY_ID_STATEMENTS[model], {'id': object_id}).scalar_one_or_none()
+
+
+def get_engine():
+    """
+    Получение общего движка SQLAlchemy (создается один раз на процесс)
+    """
+    global _engine
+    if _engine is None:
+        database_url = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+        _engine = create_engine(database_url)
+    return _engine
 
 
 def init_db():
@@ -15,28 +71,78 @@ def init_db():
         database_url = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
         engine = create_engine(database_url)
         Base.metadata.create_all(engine)
+        install_change_tracking(engine)
+        create_missing_columns(engine)
+        create_missing_indexes()
         Session = sessionmaker(bind=engine)
-        print("База данных успешно инициализирована")
+        logger.info("База данных успешно инициализирована")
         return Session
     except Exception as e:
-        print(f"Ошибка при инициализации базы данных: {e}")
+        logger.error("Ошибка при инициализации базы данных: %s", e)
         return None
 
 
+_session_factory = None
+
+
+def configure_engine(engine):
+    """
+    Использовать другой движок для get_session() и session_scope()
+    (например, тестовую базу бенчмарка)
+    """
+    global _engine, _session_factory
+    _engine = engine
+    _session_factory = sessionmaker(bind=engine)
+
+
 def get_session():
     """
-    Получение сессии для работы с базой данных
+    Получение сессии для работы с базой данных (соединение берется из пула общего движка).
+    После commit объекты истекают и перечитываются из базы при следующем обращении
     """
+    global _session_factory
     try:
-        database_url = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-        engine = create_engine(database_url)
-        Session = sessionmaker(bind=engine)
-        return Session()
+        if _session_factory is None:
+            _session_factory = sessionmaker(bind=get_engine())
+        return _session_factory()
     except Exception as e:
-        print(f"Ошибка при создании сессии: {e}")
+        logger.error("Ошибка при создании сессии: %s", e)
         return None
 
 
+@contextmanager
+def session_scope():
+    """
+    Короткая сессия на одну операцию: identity map не копится между операциями,
+    а соединение возвращается в пул при выходе из блока.
+    Объекты используются и после закрытия сессии, поэтому истекшие после commit
+    перечитываются перед выходом (запрос на модель) - окно получает значения из базы
+    """
+    session = get_session()
+    try:
+        yield session
+        _reload_expired(session)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        close_session(session)
+
+
+def _reload_expired(session):
+    """
+    Загрузка столбцов объектов сессии, истекших после commit. Сессии только для чтения
+    не коммитят, и для них запросов нет
+    """
+    expired = {}
+    for obj in list(session.identity_map.values()):
+        state = inspect(obj)
+        if state.expired_attributes and state.mapper.class_ in _BY_ID_STATEMENTS:
+            expired.setdefault(state.mapper.class_, []).append(state.identity[0])
+    for model, ids in expired.items():
+        load_by_ids(session, model, ids)
+
+
 def close_session(session):
     """
     Закрытие сессии
@@ -44,9 +150,9 @@ def close_session(session):
     try:
         if session:
             session.close()
-            print("Сессия закрыта")
+            logger.debug("Сессия закрыта")
     except Exception as e:
-        print(f"Ошибка при закрытии сессии: {e}")
+        logger.error("Ошибка при закрытии сессии: %s", e)
 
 
 def check_db_connection():
@@ -58,11 +164,11 @@ def check_db_connection():
         if session:
             _ = session.execute(text("SELECT 1"))
             session.close()
-            print("Подключение к базе данных установлено")
+            logger.info("Подключение к базе данных установлено")
             return True
         return False
     except Exception as e:
-        print(f"Ошибка подключения к базе данных: {e}")
+        logger.error("Ошибка подключения к базе данных: %s", e)
         return False
 
 
@@ -75,12 +181,12 @@ def get_table_names():
         engine = create_engine(database_url)
         inspector = inspect(engine)
         tables = inspector.get_table_names()
-        print("Таблицы в базе данных:")
+        logger.info("Таблицы в базе данных:")
         for table in tables:
-            print(f"  - {table}")
+            logger.debug("  - %s", table)
         return tables
     except Exception as e:
-        print(f"Ошибка при получении списка таблиц: {e}")
+        logger.error("Ошибка при получении списка таблиц: %s", e)
         return []
 
 
@@ -93,12 +199,12 @@ def get_table_info(table_name):
         engine = create_engine(database_url)
         inspector = inspect(engine)
         columns = inspector.get_columns(table_name)
-        print(f"Структура таблицы '{table_name}':")
+        logger.info("Структура таблицы '%s':", table_name)
         for column in columns:
-            print(f"  - {column['name']}: {column['type']} {'(nullable)' if column['nullable'] else '(not null)'}")
+            logger.debug("  - %s: %s %s", column['name'], column['type'], '(nullable)' if column['nullable'] else '(not null)')
         return columns
     except Exception as e:
-        print(f"Ошибка при получении информации о таблице: {e}")
+        logger.error("Ошибка при получении информации о таблице: %s", e)
         return []
 
 
@@ -117,7 +223,7 @@ def drop_all_tables():
         else:
             print("Операция отменена")
     except Exception as e:
-        print(f"Ошибка при удалении таблиц: {e}")
+        logger.error("Ошибка при удалении таблиц: %s", e)
 
 
 def execute_raw_sql(query, params=None):
@@ -129,16 +235,18 @@ def execute_raw_sql(query, params=None):
         if query.strip().upper().startswith('SELECT'):
             result = session.execute(text(query), params or {})
             rows = result.fetchall()
-            print(f"Запрос выполнен, найдено {len(rows)} записей")
+            logger.debug("Запрос выполнен, найдено %s записей", len(rows))
             return rows
         else:
             result = session.execute(text(query), params or {})
             session.commit()
-            print("Запрос выполнен успешно")
+            # Произвольный SQL может изменить любую таблицу
+            query_cache.invalidate_all()
+            logger.info("Запрос выполнен успешно")
             return result.rowcount
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при выполнении SQL-запроса: {e}")
+        logger.error("Ошибка при выполнении SQL-запроса: %s", e)
         return None
     finally:
         close_session(session)
@@ -162,9 +270,9 @@ def get_database_stats():
             SELECT pg_size_pretty(pg_database_size(current_database()))
         """)).scalar()
 
-        print("Статистика базы данных:")
-        print(f"  - Количество таблиц: {tables_count}")
-        print(f"  - Размер базы данных: {db_size}")
+        logger.debug("Статистика базы данных:")
+        logger.debug("  - Количество таблиц: %s", tables_count)
+        logger.debug("  - Размер базы данных: %s", db_size)
 
         session.close()
         return {
@@ -172,10 +280,27 @@ def get_database_stats():
             'database_size': db_size
         }
     except Exception as e:
-        print(f"Ошибка при получении статистики: {e}")
+        logger.error("Ошибка при получении статистики: %s", e)
         return {}
 
 
+def start_cache_listener(channel=NOTIFY_CHANNEL):
+    """
+    Запуск фонового прослушивания NOTIFY для инвалидации кэша запросов.
+    Возвращает событие, установка которого останавливает прослушивание,
+    или None, если база не PostgreSQL (уведомления рассылаются только там).
+    """
+    try:
+        engine = get_engine()
+        if engine.dialect.name != 'postgresql':
+            logger.debug("Прослушивание уведомлений кэша не запущено: база %s", engine.dialect.name)
+            return None
+        return listen_for_invalidations(engine, channel)
+    except Exception as e:
+        logger.error("Ошибка при запуске прослушивания уведомлений: %s", e)
+        return None
+
+
 # Утилиты для работы с транзакциями
 def safe_commit(session, operation_name=""):
     """
@@ -184,14 +309,14 @@ def safe_commit(session, operation_name=""):
     try:
         session.commit()
         if operation_name:
-            print(f"{operation_name} выполнено успешно")
+            logger.info("%s выполнено успешно", operation_name)
         return True
     except Exception as e:
         session.rollback()
         if operation_name:
-            print(f"Ошибка при {operation_name}: {e}")
+            logger.error("Ошибка при %s: %s", operation_name, e)
         else:
-            print(f"Ошибка при выполнении операции: {e}")
+            logger.error("Ошибка при выполнении операции: %s", e)
         return False
 
 
@@ -204,9 +329,10 @@ def with_session(func):
         session = get_session()
         try:
             result = func(session, *args, **kwargs)
+            _reload_expired(session)
             return result
         except Exception as e:
-            print(f"Ошибка в функции {func.__name__}: {e}")
+            logger.error("Ошибка в функции %s: %s", func.__name__, e)
             return None
         finally:
             close_session(session)
@@ -214,6 +340,344 @@ def with_session(func):
     return wrapper
 
 
+def create_missing_indexes():
+    """
+    Создание индексов из моделей, отсутствующих в существующей базе данных
+    (create_all не добавляет индексы к уже созданным таблицам)
+    """
+    try:
+        engine = get_engine()
+        created = []
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+                created.append(index.name)
+        logger.debug("Проверено индексов: %s", len(created))
+        return created
+    except Exception as e:
+        logger.error("Ошибка при создании индексов: %s", e)
+        return []
+
+
+def create_missing_columns(engine=None):
+    """
+    Добавление колонок из моделей, отсутствующих в существующих таблицах
+    (create_all не меняет уже созданные таблицы). Колонка NOT NULL добавляется,
+    только если у нее есть значение по умолчанию на стороне БД
+    """
+    try:
+        engine = engine or get_engine()
+        added = []
+        with engine.begin() as connection:
+            inspector = inspect(connection)
+            preparer = connection.dialect.identifier_preparer
+            for table in Base.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    if not column.nullable and column.server_default is None:
+                        logger.warning("Колонка %s.%s не добавлена: NOT NULL без значения по умолчанию",
+                                       table.name, column.name)
+                        continue
+                    definition = CreateColumn(column).compile(dialect=connection.dialect)
+                    connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}")
+                    added.append(f"{table.name}.{column.name}")
+        if added:
+            logger.info("Добавлены колонки: %s", ", ".join(added))
+        return added
+    except Exception as e:
+        logger.error("Ошибка при добавлении колонок: %s", e)
+        return []
+
+
+# Таблицы с отслеживанием изменений: updated_at и записи об удалении в deleted_rows
+CHANGE_TRACKED_MODELS = {
+    'readers': Reader,
+    'books': Book,
+    'copies': BookCopy,
+    'loans': Loan,
+    'fines': Fine,
+}
+
+# Запас отметки изменений, если транзакции части сеансов не видны в pg_stat_activity
+# (у роли приложения нет pg_read_all_stats): строки за этот запас вернутся повторно,
+# но транзакции короче запаса не будут пропущены
+HIDDEN_TRANSACTIONS_MARGIN = timedelta(minutes=10)
+
+_PG_CHANGE_TRACKING_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION track_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_deleted_row() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO deleted_rows (table_name, row_id, deleted_at) VALUES (TG_TABLE_NAME, OLD.id, clock_timestamp());
+    RETURN OLD;
+END $$ LANGUAGE plpgsql;
+"""
+
+_PG_CHANGE_TRACKING_TABLE = """
+ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+DROP TRIGGER IF EXISTS {table}_updated_at ON {table};
+CREATE TRIGGER {table}_updated_at BEFORE INSERT OR UPDATE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION track_updated_at();
+DROP TRIGGER IF EXISTS {table}_deleted ON {table};
+CREATE TRIGGER {table}_deleted AFTER DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION track_deleted_row();
+"""
+
+_SQLITE_CHANGE_TRACKING_TABLE = """
+CREATE TRIGGER IF NOT EXISTS {table}_inserted AFTER INSERT ON {table} FOR EACH ROW WHEN NEW.updated_at IS NULL
+BEGIN UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id; END;
+CREATE TRIGGER IF NOT EXISTS {table}_updated_at AFTER UPDATE ON {table} FOR EACH ROW
+BEGIN UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id; END;
+CREATE TRIGGER IF NOT EXISTS {table}_deleted AFTER DELETE ON {table} FOR EACH ROW
+BEGIN INSERT INTO deleted_rows (table_name, row_id, deleted_at) VALUES ('{table}', OLD.id, CURRENT_TIMESTAMP); END;
+"""
+
+
+def install_change_tracking(engine=None):
+    """
+    Колонки updated_at и триггеры отслеживания изменений для CHANGE_TRACKED_MODELS
+    (PostgreSQL и SQLite). Триггеры срабатывают и на массовые UPDATE/DELETE в обход ORM.
+    Повторный вызов безопасен
+    """
+    try:
+        engine = engine or get_engine()
+        deleted_rows.create(engine, checkfirst=True)
+        tables = [model.__tablename__ for model in CHANGE_TRACKED_MODELS.values()]
+
+        with engine.begin() as connection:
+            if engine.dialect.name == 'postgresql':
+                connection.exec_driver_sql(_PG_CHANGE_TRACKING_FUNCTIONS)
+                for table in tables:
+                    connection.exec_driver_sql(_PG_CHANGE_TRACKING_TABLE.format(table=table))
+            elif engine.dialect.name == 'sqlite':
+                inspector = inspect(connection)
+                for table in tables:
+                    if 'updated_at' not in {column['name'] for column in inspector.get_columns(table)}:
+                        # SQLite не добавляет колонку с DEFAULT CURRENT_TIMESTAMP, значения заполняются отдельно
+                        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME")
+                        connection.exec_driver_sql(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP")
+                    for statement in _SQLITE_CHANGE_TRACKING_TABLE.format(table=table).split(";\n"):
+                        if statement.strip():
+                            connection.exec_driver_sql(statement)
+            else:
+                raise ValueError(f"Отслеживание изменений не поддерживается для {engine.dialect.name}")
+
+        logger.debug("Отслеживание изменений установлено для таблиц: %s", ", ".join(tables))
+        return tables
+    except Exception as e:
+        logger.error("Ошибка при установке отслеживания изменений: %s", e)
+        return []
+
+
+class UpdateConflict:
+    """
+    Результат update_copy/update_loan/update_fine, если строку уже изменили
+    в другом сеансе: версия в базе не совпала с expected_version.
+    Ложен в условиях, как и None
+    """
+
+    def __init__(self, table, object_id, expected_version, current_version):
+        self.table = table
+        self.object_id = object_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return (f"<UpdateConflict({self.table}, id={self.object_id}, "
+                f"expected={self.expected_version}, current={self.current_version})>")
+
+
+def _update_conflict(session, model, object_id, expected_version):
+    try:
+        current_version = session.scalar(select(model.version).where(model.id == object_id))
+    except Exception:
+        current_version = None
+    logger.warning("Конфликт обновления %s ID %s: ожидалась версия %s, в базе %s",
+                   model.__tablename__, object_id, expected_version, current_version)
+    return UpdateConflict(model.__tablename__, object_id, expected_version, current_version)
+
+
+def _update_returning(session, model, object_id, values, expected_version=None, *criteria):
+    """
+    Обновление строки одним запросом UPDATE ... WHERE id = :id RETURNING вместо
+    SELECT + UPDATE. Уникальность значений проверяет база (IntegrityError).
+    У моделей с версией она увеличивается, а expected_version добавляется в условие.
+    Без values строка только загружается. Возвращает объект с новыми значениями,
+    None (строки нет или она не подходит под criteria) или UpdateConflict.
+    Если строка не обновлена, в базе ничего не изменилось, поэтому транзакция
+    вызывающего кода не откатывается
+    """
+    versioned = 'version' in model.__table__.c
+    if not values:
+        obj = _get_by_id(session, model, object_id)
+        if obj is not None and versioned and expected_version is not None and obj.version != expected_version:
+            return _update_conflict(session, model, object_id, expected_version)
+        return obj
+
+    statement = update(model).where(model.id == object_id, *criteria)
+    if versioned:
+        values = dict(values, version=model.version + 1)
+        if expected_version is not None:
+            statement = statement.where(model.version == expected_version)
+    obj = session.execute(
+        statement.values(values).returning(model),
+        execution_options={'synchronize_session': False, 'populate_existing': True}
+    ).scalar_one_or_none()
+
+    if obj is None and versioned and expected_version is not None:
+        # Строка не обновлена: ее нет или у нее уже другая версия
+        if session.scalar(select(model.id).where(model.id == object_id, *criteria)) is not None:
+            return _update_conflict(session, model, object_id, expected_version)
+    return obj
+
+
+# Курсорная (keyset) пагинация: следующая страница ищется по последнему ключу сортировки,
+# поэтому глубокие страницы стоят столько же, сколько первая
+def _encode_cursor(values):
+    payload = [
+        value.isoformat() if isinstance(value, date) else str(value) if isinstance(value, Decimal) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor, columns):
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if len(payload) != len(columns):
+        raise ValueError("Курсор не соответствует порядку сортировки")
+    values = []
+    for value, column in zip(payload, columns):
+        if value is not None and column.type.python_type is date:
+            value = date.fromisoformat(value)
+        elif value is not None and column.type.python_type is Decimal:
+            value = Decimal(value)
+        values.append(value)
+    return values
+
+
+def _sort_order(columns, descending):
+    # NULL первой колонки идет последним по возрастанию и первым по убыванию - как при обходе индекса
+    order = [column.desc() if descending else column for column in columns]
+    if columns[0].nullable and len(columns) > 1:
+        order[0] = order[0].nulls_first() if descending else order[0].nulls_last()
+    return order
+
+
+def _keyset_page(session, model, sort_orders, order_by, after, limit, descending):
+    if order_by not in sort_orders:
+        raise ValueError(f"Недопустимый порядок сортировки '{order_by}', доступны: {', '.join(sort_orders)}")
+
+    columns = [getattr(model, name) for name in sort_orders[order_by]]
+    query = session.query(model)
+    # NULL в первой колонке считается наибольшим значением (как в индексе PostgreSQL),
+    # иначе строки с NULL не попали бы ни на одну страницу после курсора
+    nullable = columns[0].nullable and len(columns) > 1
+
+    if after:
+        cursor_values = _decode_cursor(after, columns)
+        if nullable and cursor_values[0] is None:
+            rest = tuple_(*columns[1:])
+            rest_values = tuple_(*cursor_values[1:])
+            condition = and_(columns[0].is_(None), rest < rest_values if descending else rest > rest_values)
+            if descending:
+                condition = or_(condition, columns[0].isnot(None))
+        else:
+            key = tuple_(*columns)
+            values = tuple_(*cursor_values)
+            condition = key < values if descending else key > values
+            if nullable and not descending:
+                condition = or_(condition, columns[0].is_(None))
+        query = query.filter(condition)
+
+    query = query.order_by(*_sort_order(columns, descending))
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    items = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = _encode_cursor([getattr(last, name) for name in sort_orders[order_by]])
+    return items, next_cursor
+
+
+# Порядки сортировки: колонки ключа, последней идет уникальная колонка.
+# Каждому порядку соответствует индекс в models.py
+READER_SORT_ORDERS = {
+    'id': ['id'],
+    'name': ['name', 'id'],
+    'registration_date': ['registration_date', 'id'],
+}
+
+LIBRARIAN_SORT_ORDERS = {
+    'id': ['id'],
+    'name': ['name', 'id'],
+    'hire_date': ['hire_date', 'id'],
+}
+
+COPY_SORT_ORDERS = {
+    'id': ['id'],
+    'inventory_number': ['inventory_number'],
+}
+
+BOOK_SORT_ORDERS = {
+    'id': ['id'],
+    'title': ['title', 'id'],
+    'author': ['author', 'id'],
+}
+
+LOAN_SORT_ORDERS = {
+    'id': ['id'],
+    'loan_date': ['loan_date', 'id'],
+    'return_date': ['return_date', 'id'],
+}
+
+FINE_SORT_ORDERS = {
+    'id': ['id'],
+    'amount': ['amount', 'id'],
+    'issued_date': ['issued_date', 'id'],
+}
+
+# Порядки сортировки по таблицам (сортировка колонок таблиц интерфейса)
+SORT_ORDERS = {
+    'books': (Book, BOOK_SORT_ORDERS),
+    'copies': (BookCopy, COPY_SORT_ORDERS),
+    'readers': (Reader, READER_SORT_ORDERS),
+    'loans': (Loan, LOAN_SORT_ORDERS),
+    'fines': (Fine, FINE_SORT_ORDERS),
+    'librarians': (Librarian, LIBRARIAN_SORT_ORDERS),
+}
+
+
+def get_sorted_ids(session, table, order_by='id', descending=False):
+    """
+    ID всех записей таблицы в порядке сортировки (ORDER BY на сервере).
+    Запрос читает только колонки ключа сортировки, поэтому выполняется
+    по индексу без чтения самих строк
+    """
+    try:
+        model, sort_orders = SORT_ORDERS[table]
+        if order_by not in sort_orders:
+            raise ValueError(f"Недопустимый порядок сортировки '{order_by}', доступны: {', '.join(sort_orders)}")
+
+        columns = [getattr(model, name) for name in sort_orders[order_by]]
+        ids = session.scalars(select(model.id).order_by(*_sort_order(columns, descending))).all()
+        logger.debug("Отсортировано %s записей таблицы %s по %s", len(ids), table, order_by)
+        return ids
+    except Exception as e:
+        logger.error("Ошибка при сортировке таблицы %s: %s", table, e)
+        return []
+
+
 def create_reader(session, name, email, phone_number=None):
     """
     Создание нового читателя
@@ -222,7 +686,7 @@ def create_reader(session, name, email, phone_number=None):
         # Проверяем, нет ли уже читателя с таким email
         existing_reader = session.query(Reader).filter(Reader.email == email).first()
         if existing_reader:
-            print(f"Ошибка: Читатель с email '{email}' уже существует")
+            logger.warning("Ошибка: Читатель с email '%s' уже существует", email)
             return None
 
         reader = Reader(
@@ -233,12 +697,12 @@ def create_reader(session, name, email, phone_number=None):
 
         session.add(reader)
         session.commit()
-        print(f"Читатель '{name}' успешно создан (ID: {reader.id})")
+        logger.info("Читатель '%s' успешно создан (ID: %s)", name, reader.id)
         return reader
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании читателя: {e}")
+        logger.error("Ошибка при создании читателя: %s", e)
         return None
 
 
@@ -247,14 +711,14 @@ def get_reader_by_id(session, reader_id):
     Получение читателя по ID
     """
     try:
-        reader = session.query(Reader).filter(Reader.id == reader_id).first()
+        reader = _get_by_id(session, Reader, reader_id)
         if reader:
             return reader
         else:
-            print(f"Читатель с ID {reader_id} не найден")
+            logger.warning("Читатель с ID %s не найден", reader_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске читателя: {e}")
+        logger.error("Ошибка при поиске читателя: %s", e)
         return None
 
 
@@ -267,10 +731,10 @@ def get_reader_by_email(session, email):
         if reader:
             return reader
         else:
-            print(f"Читатель с email '{email}' не найден")
+            logger.warning("Читатель с email '%s' не найден", email)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске читателя по email: {e}")
+        logger.error("Ошибка при поиске читателя по email: %s", e)
         return None
 
 
@@ -281,19 +745,33 @@ def get_all_readers(session, limit=None, offset=None):
     try:
         query = session.query(Reader).order_by(Reader.id)
 
-        if limit:
-            query = query.limit(limit)
         if offset:
             query = query.offset(offset)
+        if limit:
+            query = query.limit(limit)
 
         readers = query.all()
-        print(f"Найдено {len(readers)} читателей")
+        logger.debug("Найдено %s читателей", len(readers))
         return readers
     except Exception as e:
-        print(f"Ошибка при получении списка читателей: {e}")
+        logger.error("Ошибка при получении списка читателей: %s", e)
         return []
 
 
+def get_readers_page(session, after=None, limit=50, order_by='id', descending=False):
+    """
+    Получение страницы читателей по курсору (сортировка: id / name / registration_date).
+    Возвращает (список, курсор следующей страницы или None)
+    """
+    try:
+        items, next_cursor = _keyset_page(session, Reader, READER_SORT_ORDERS, order_by, after, limit, descending)
+        logger.debug("Найдено %s читателей на странице", len(items))
+        return items, next_cursor
+    except Exception as e:
+        logger.error("Ошибка при получении страницы читателей: %s", e)
+        return [], None
+
+
 def search_readers(session, search_term):
     """
     Поиск читателей по имени или email
@@ -306,10 +784,10 @@ def search_readers(session, search_term):
             )
         ).all()
 
-        print(f"По запросу '{search_term}' найдено {len(readers)} читателей")
+        logger.debug("По запросу '%s' найдено %s читателей", search_term, len(readers))
         return readers
     except Exception as e:
-        print(f"Ошибка при поиске читателей: {e}")
+        logger.error("Ошибка при поиске читателей: %s", e)
         return []
 
 
@@ -318,36 +796,29 @@ def update_reader(session, reader_id, **kwargs):
     Обновление данных читателя с помощью id и словаря новых значений
     """
     try:
-        reader = get_reader_by_id(session, reader_id)
-        if not reader:
-            return None
-
         valid_fields = ['name', 'email', 'phone_number']
-        updated_fields = []
-
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                # Проверяем уникальность email при обновлении
-                if field == 'email' and value != reader.email:
-                    existing = get_reader_by_email(session, value)
-                    if existing:
-                        print(f"Ошибка: Читатель с email '{value}' уже существует")
-                        return None
+        values = {field: value for field, value in kwargs.items() if field in valid_fields}
 
-                setattr(reader, field, value)
-                updated_fields.append(field)
+        reader = _update_returning(session, Reader, reader_id, values)
+        if not reader:
+            return None
 
-        if updated_fields:
+        if values:
             session.commit()
-            print(f"Читатель ID {reader_id} обновлен. Измененные поля: {', '.join(updated_fields)}")
+            logger.info("Читатель ID %s обновлен. Измененные поля: %s", reader_id, ', '.join(values))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return reader
 
+    except IntegrityError as e:
+        # Уникальность email проверяется ограничением таблицы
+        session.rollback()
+        logger.warning("Читатель ID %s не обновлен (email '%s' уже занят?): %s", reader_id, kwargs.get('email'), e.orig)
+        return None
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении читателя: {e}")
+        logger.error("Ошибка при обновлении читателя: %s", e)
         return None
 
 
@@ -362,12 +833,12 @@ def delete_reader(session, reader_id):
 
         session.delete(reader)
         session.commit()
-        print(f"Читатель ID {reader_id} успешно удален")
+        logger.info("Читатель ID %s успешно удален", reader_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении читателя: {e}")
+        logger.error("Ошибка при удалении читателя: %s", e)
         return False
 
 
@@ -382,25 +853,26 @@ def delete_reader_by_email(session, email):
 
         session.delete(reader)
         session.commit()
-        print(f"Читатель с email '{email}' успешно удален")
+        logger.info("Читатель с email '%s' успешно удален", email)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении читателя: {e}")
+        logger.error("Ошибка при удалении читателя: %s", e)
         return False
 
 
+@cached_query('readers')
 def get_readers_count(session):
     """
     Получение общего количества читателей
     """
     try:
         count = session.query(Reader).count()
-        print(f"Общее количество читателей: {count}")
+        logger.debug("Общее количество читателей: %s", count)
         return count
     except Exception as e:
-        print(f"Ошибка при подсчете читателей: {e}")
+        logger.error("Ошибка при подсчете читателей: %s", e)
         return 0
 
 
@@ -414,10 +886,10 @@ def get_recent_readers(session, days=30):
             Reader.registration_date >= cutoff_date
         ).order_by(Reader.registration_date.desc()).all()
 
-        print(f"Найдено {len(readers)} читателей, зарегистрированных за последние {days} дней")
+        logger.debug("Найдено %s читателей, зарегистрированных за последние %s дней", len(readers), days)
         return readers
     except Exception as e:
-        print(f"Ошибка при поиске недавно зарегистрированных читателей: {e}")
+        logger.error("Ошибка при поиске недавно зарегистрированных читателей: %s", e)
         return []
 
 
@@ -437,20 +909,59 @@ def print_reader_info(reader):
     print("-" * 40)
 
 
+# Общий сервис хэширования паролей (ограниченный пул потоков bcrypt)
+password_hasher = PasswordHasher()
+
+
+# Ограничение попыток входа и кэш неизвестных email
+login_limiter = LoginLimiter()
+
+
+class LoginRefused:
+    """
+    Результат authenticate_librarian, если попытка отклонена лимитом попыток
+    (reason - 'email' или 'source') и пароль не проверялся. Ложен в условиях, как и None
+    """
+
+    def __init__(self, reason):
+        self.reason = reason
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"<LoginRefused({self.reason})>"
+
+
+def _librarian_email_matches(email):
+    # Email сравнивается без учета регистра - по тому же правилу, что и ключ LoginLimiter
+    return func.lower(Librarian.email) == (email or '').strip().lower()
+
+
+def get_login_stats():
+    """
+    Счетчики попыток входа: допущенные, отклоненные лимитом, неизвестные email
+    """
+    return login_limiter.stats()
+
+
+def configure_password_hashing(rounds=None, max_workers=None, max_pending=None):
+    """
+    Настройка стоимости bcrypt и размера пула хэширования.
+    Хэши со старой стоимостью пересчитываются при следующем успешном входе.
+    """
+    password_hasher.configure(rounds=rounds, max_workers=max_workers, max_pending=max_pending)
+
+
 def hash_password(password):
     """Хэширование пароля"""
-    salt = bcrypt.gensalt()
-    password_bytes = password.encode('utf-8')
-    hashed = bcrypt.hashpw(password_bytes, salt)
-    return hashed.decode('utf-8')
+    return password_hasher.hash(password)
 
 
 def verify_password(plain_password, hashed_password):
     """Проверка пароля"""
     try:
-        plain_bytes = plain_password.encode('utf-8')
-        hashed_bytes = hashed_password.encode('utf-8')
-        return bcrypt.checkpw(plain_bytes, hashed_bytes)
+        return password_hasher.verify(plain_password, hashed_password)
     except Exception:
         return False
 
@@ -460,9 +971,9 @@ def create_librarian(session, name, email, password, position=None):
     Создание нового библиотекаря
     """
     try:
-        existing_librarian = session.query(Librarian).filter(Librarian.email == email).first()
+        existing_librarian = session.query(Librarian).filter(_librarian_email_matches(email)).first()
         if existing_librarian:
-            print(f"Библиотекарь с email '{email}' уже существует")
+            logger.warning("Библиотекарь с email '%s' уже существует", email)
             return None
 
         password_hash = hash_password(password)
@@ -476,12 +987,13 @@ def create_librarian(session, name, email, password, position=None):
 
         session.add(librarian)
         session.commit()
-        print(f"Библиотекарь '{name}' успешно создан (ID: {librarian.id})")
+        login_limiter.forget_unknown(email)
+        logger.info("Библиотекарь '%s' успешно создан (ID: %s)", name, librarian.id)
         return librarian
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании библиотекаря: {e}")
+        logger.error("Ошибка при создании библиотекаря: %s", e)
         return None
 
 
@@ -490,14 +1002,14 @@ def get_librarian_by_id(session, librarian_id):
     Получение библиотекаря по ID
     """
     try:
-        librarian = session.query(Librarian).filter(Librarian.id == librarian_id).first()
+        librarian = _get_by_id(session, Librarian, librarian_id)
         if librarian:
             return librarian
         else:
-            print(f"Библиотекарь с ID {librarian_id} не найден")
+            logger.warning("Библиотекарь с ID %s не найден", librarian_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске библиотекаря: {e}")
+        logger.error("Ошибка при поиске библиотекаря: %s", e)
         return None
 
 
@@ -506,14 +1018,14 @@ def get_librarian_by_email(session, email):
     Получение библиотекаря по email
     """
     try:
-        librarian = session.query(Librarian).filter(Librarian.email == email).first()
+        librarian = session.query(Librarian).filter(_librarian_email_matches(email)).first()
         if librarian:
             return librarian
         else:
-            print(f"Библиотекарь с email '{email}' не найден")
+            logger.warning("Библиотекарь с email '%s' не найден", email)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске библиотекаря по email: {e}")
+        logger.error("Ошибка при поиске библиотекаря по email: %s", e)
         return None
 
 
@@ -524,19 +1036,33 @@ def get_all_librarians(session, limit=None, offset=None):
     try:
         query = session.query(Librarian).order_by(Librarian.id)
 
-        if limit:
-            query = query.limit(limit)
         if offset:
             query = query.offset(offset)
+        if limit:
+            query = query.limit(limit)
 
         librarians = query.all()
-        print(f"Найдено {len(librarians)} библиотекарей")
+        logger.debug("Найдено %s библиотекарей", len(librarians))
         return librarians
     except Exception as e:
-        print(f"Ошибка при получении списка библиотекарей: {e}")
+        logger.error("Ошибка при получении списка библиотекарей: %s", e)
         return []
 
 
+def get_librarians_page(session, after=None, limit=50, order_by='id', descending=False):
+    """
+    Получение страницы библиотекарей по курсору (сортировка: id / name / hire_date).
+    Возвращает (список, курсор следующей страницы или None)
+    """
+    try:
+        items, next_cursor = _keyset_page(session, Librarian, LIBRARIAN_SORT_ORDERS, order_by, after, limit, descending)
+        logger.debug("Найдено %s библиотекарей на странице", len(items))
+        return items, next_cursor
+    except Exception as e:
+        logger.error("Ошибка при получении страницы библиотекарей: %s", e)
+        return [], None
+
+
 def search_librarians(session, search_term):
     """
     Поиск библиотекарей по имени или email
@@ -549,10 +1075,10 @@ def search_librarians(session, search_term):
             )
         ).all()
 
-        print(f"По запросу '{search_term}' найдено {len(librarians)} библиотекарей")
+        logger.debug("По запросу '%s' найдено %s библиотекарей", search_term, len(librarians))
         return librarians
     except Exception as e:
-        print(f"Ошибка при поиске библиотекарей: {e}")
+        logger.error("Ошибка при поиске библиотекарей: %s", e)
         return []
 
 
@@ -561,43 +1087,35 @@ def update_librarian(session, librarian_id, **kwargs):
     Обновление данных библиотекаря на выбор из ['name', 'email', 'position', 'password']
     """
     try:
-        librarian = get_librarian_by_id(session, librarian_id)
+        valid_fields = ['name', 'email', 'position', 'password']
+        updated_fields = [field for field in kwargs if field in valid_fields]
+        values = {field: kwargs[field] for field in updated_fields if field != 'password'}
+        if 'password' in kwargs:
+            values['password_hash'] = hash_password(kwargs['password'])
+
+        librarian = _update_returning(session, Librarian, librarian_id, values)
         if not librarian:
             return None
 
-        valid_fields = ['name', 'email', 'position', 'password']
-        updated_fields = []
-
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                if field == 'email' and value != librarian.email:
-                    existing = get_librarian_by_email(session, value)
-                    if existing:
-                        print(f"Библиотекарь с email '{value}' уже существует")
-                        return None
-                    setattr(librarian, field, value)
-                    updated_fields.append(field)
-
-                elif field == 'password':
-                    password_hash = hash_password(value)
-                    librarian.password_hash = password_hash
-                    updated_fields.append('password')
-
-                else:
-                    setattr(librarian, field, value)
-                    updated_fields.append(field)
-
-        if updated_fields:
+        if values:
             session.commit()
-            print(f"Библиотекарь ID {librarian_id} обновлен. Измененные поля: {', '.join(updated_fields)}")
+            if 'email' in values:
+                login_limiter.forget_unknown(values['email'])
+            logger.info("Библиотекарь ID %s обновлен. Измененные поля: %s", librarian_id, ', '.join(updated_fields))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return librarian
 
+    except IntegrityError as e:
+        # Уникальность email проверяется ограничением таблицы
+        session.rollback()
+        logger.warning("Библиотекарь ID %s не обновлен (email '%s' уже занят?): %s",
+                       librarian_id, kwargs.get('email'), e.orig)
+        return None
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении библиотекаря: {e}")
+        logger.error("Ошибка при обновлении библиотекаря: %s", e)
         return None
 
 
@@ -612,12 +1130,12 @@ def delete_librarian(session, librarian_id):
 
         session.delete(librarian)
         session.commit()
-        print(f"Библиотекарь ID {librarian_id} успешно удален")
+        logger.info("Библиотекарь ID %s успешно удален", librarian_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении библиотекаря: {e}")
+        logger.error("Ошибка при удалении библиотекаря: %s", e)
         return False
 
 
@@ -632,34 +1150,58 @@ def delete_librarian_by_email(session, email):
 
         session.delete(librarian)
         session.commit()
-        print(f"Библиотекарь с email '{email}' успешно удален")
+        logger.info("Библиотекарь с email '%s' успешно удален", email)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении библиотекаря: {e}")
+        logger.error("Ошибка при удалении библиотекаря: %s", e)
         return False
 
 
-def authenticate_librarian(session, email, password):
+def authenticate_librarian(session, email, password, source='local'):
     """
-    Аутентификация библиотекаря
+    Аутентификация библиотекаря.
+    Проверка bcrypt выполняется только для попыток, прошедших лимиты по email и источнику.
+    Возвращает библиотекаря, None (неверный email или пароль, ошибка БД)
+    или LoginRefused (превышен лимит попыток)
     """
+    started = time.monotonic()
     try:
-        librarian = get_librarian_by_email(session, email)
+        refusal = login_limiter.check(email, source)
+        if refusal == 'unknown':
+            login_limiter.pad(started)
+            logger.warning("Неверный email или пароль")
+            return None
+        if refusal:
+            logger.warning("Слишком много попыток входа, повторите позже")
+            return LoginRefused(refusal)
+
+        # Ошибка запроса уходит в except: в кэш неизвестных попадают только ненайденные email
+        librarian = session.query(Librarian).filter(_librarian_email_matches(email)).first()
         if not librarian:
-            print("Неверный email или пароль")
+            login_limiter.record_unknown(email)
+            login_limiter.pad(started)
+            logger.warning("Неверный email или пароль")
             return None
 
-        if verify_password(password, librarian.password_hash):
-            print(f"Успешная аутентификация для {librarian.name}")
+        verify_started = time.monotonic()
+        password_valid = verify_password(password, librarian.password_hash)
+        login_limiter.record_result(email, password_valid, time.monotonic() - verify_started)
+
+        if password_valid:
+            # Прозрачно пересчитываем хэш, если изменилась стоимость bcrypt
+            if password_hasher.needs_rehash(librarian.password_hash):
+                librarian.password_hash = hash_password(password)
+                safe_commit(session)
+            logger.info("Успешная аутентификация для %s", librarian.name)
             return librarian
         else:
-            print("Неверный email или пароль")
+            logger.warning("Неверный email или пароль")
             return None
 
     except Exception as e:
-        print(f"Ошибка при аутентификации: {e}")
+        logger.error("Ошибка при аутентификации: %s", e)
         return None
 
 
@@ -673,26 +1215,27 @@ def change_librarian_password(session, librarian_id, current_password, new_passw
             return False
 
         if not verify_password(current_password, librarian.password_hash):
-            print("Текущий пароль неверен")
+            logger.warning("Текущий пароль неверен")
             return False
 
         return update_librarian(session, librarian_id, password=new_password) is not None
 
     except Exception as e:
-        print(f"Ошибка при смене пароля: {e}")
+        logger.error("Ошибка при смене пароля: %s", e)
         return False
 
 
+@cached_query('librarians')
 def get_librarians_count(session):
     """
     Получение общего количества библиотекарей
     """
     try:
         count = session.query(Librarian).count()
-        print(f"Общее количество библиотекарей: {count}")
+        logger.debug("Общее количество библиотекарей: %s", count)
         return count
     except Exception as e:
-        print(f"Ошибка при подсчете библиотекарей: {e}")
+        logger.error("Ошибка при подсчете библиотекарей: %s", e)
         return 0
 
 
@@ -744,14 +1287,14 @@ def get_book_by_id(session, book_id):
     Получение книги по ID
     """
     try:
-        book = session.query(Book).filter(Book.id == book_id).first()
+        book = _get_by_id(session, Book, book_id)
         if book:
             return book
         else:
-            print(f"Книга с ID {book_id} не найдена")
+            logger.warning("Книга с ID %s не найдена", book_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске книги: {e}")
+        logger.error("Ошибка при поиске книги: %s", e)
         return None
 
 
@@ -764,10 +1307,10 @@ def get_book_by_isbn(session, isbn):
         if book:
             return book
         else:
-            print(f"Книга с ISBN '{isbn}' не найдена")
+            logger.warning("Книга с ISBN '%s' не найдена", isbn)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске книги по ISBN: {e}")
+        logger.error("Ошибка при поиске книги по ISBN: %s", e)
         return None
 
 
@@ -788,10 +1331,10 @@ def search_books(session, title=None, author=None, genre_name=None, available_on
             query = query.filter(Book.available == True)
 
         books = query.all()
-        print(f"Найдено {len(books)} книг по заданным критериям")
+        logger.debug("Найдено %s книг по заданным критериям", len(books))
         return books
     except Exception as e:
-        print(f"Ошибка при поиске книг: {e}")
+        logger.error("Ошибка при поиске книг: %s", e)
         return []
 
 
@@ -801,10 +1344,10 @@ def get_books_by_author(session, author):
     """
     try:
         books = session.query(Book).filter(Book.author.ilike(f"%{author}%")).all()
-        print(f"Найдено {len(books)} книг автора '{author}'")
+        logger.debug("Найдено %s книг автора '%s'", len(books), author)
         return books
     except Exception as e:
-        print(f"Ошибка при поиске книг по автору: {e}")
+        logger.error("Ошибка при поиске книг по автору: %s", e)
         return []
 
 
@@ -814,10 +1357,10 @@ def get_books_by_year(session, year):
     """
     try:
         books = session.query(Book).filter(Book.publish_year == year).all()
-        print(f"Найдено {len(books)} книг издания {year} года")
+        logger.debug("Найдено %s книг издания %s года", len(books), year)
         return books
     except Exception as e:
-        print(f"Ошибка при поиске книг по году: {e}")
+        logger.error("Ошибка при поиске книг по году: %s", e)
         return []
 
 
@@ -826,36 +1369,29 @@ def update_book(session, book_id, **kwargs):
     Обновление данных книги ['title', 'author', 'isbn', 'publish_year', 'description', 'available']
     """
     try:
-        book = get_book_by_id(session, book_id)
-        if not book:
-            return None
-
         valid_fields = ['title', 'author', 'isbn', 'publish_year', 'description', 'available']
-        updated_fields = []
-
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                # Проверяем уникальность ISBN при обновлении
-                if field == 'isbn' and value != book.isbn:
-                    existing = get_book_by_isbn(session, value)
-                    if existing:
-                        print(f"Книга с ISBN '{value}' уже существует")
-                        return None
+        values = {field: value for field, value in kwargs.items() if field in valid_fields}
 
-                setattr(book, field, value)
-                updated_fields.append(field)
+        book = _update_returning(session, Book, book_id, values)
+        if not book:
+            return None
 
-        if updated_fields:
+        if values:
             session.commit()
-            print(f"Книга ID {book_id} обновлена. Измененные поля: {', '.join(updated_fields)}")
+            logger.info("Книга ID %s обновлена. Измененные поля: %s", book_id, ', '.join(values))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return book
 
+    except IntegrityError as e:
+        # Уникальность ISBN проверяется ограничением таблицы
+        session.rollback()
+        logger.warning("Книга ID %s не обновлена (ISBN '%s' уже занят?): %s", book_id, kwargs.get('isbn'), e.orig)
+        return None
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении книги: {e}")
+        logger.error("Ошибка при обновлении книги: %s", e)
         return None
 
 
@@ -870,12 +1406,12 @@ def delete_book(session, book_id):
 
         session.delete(book)
         session.commit()
-        print(f"Книга ID {book_id} успешно удалена")
+        logger.info("Книга ID %s успешно удалена", book_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении книги: {e}")
+        logger.error("Ошибка при удалении книги: %s", e)
         return False
 
 
@@ -887,18 +1423,18 @@ def create_genre(session, name):
         # Проверяем уникальность названия жанра
         existing_genre = session.query(Genre).filter(Genre.name.ilike(name)).first()
         if existing_genre:
-            print(f"Жанр '{name}' уже существует")
+            logger.warning("Жанр '%s' уже существует", name)
             return None
 
         genre = Genre(name=name)
         session.add(genre)
         session.commit()
-        print(f"Жанр '{name}' успешно создан (ID: {genre.id})")
+        logger.info("Жанр '%s' успешно создан (ID: %s)", name, genre.id)
         return genre
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании жанра: {e}")
+        logger.error("Ошибка при создании жанра: %s", e)
         return None
 
 
@@ -907,14 +1443,14 @@ def get_genre_by_id(session, genre_id):
     Получение жанра по ID
     """
     try:
-        genre = session.query(Genre).filter(Genre.id == genre_id).first()
+        genre = _get_by_id(session, Genre, genre_id)
         if genre:
             return genre
         else:
-            print(f"Жанр с ID {genre_id} не найден")
+            logger.warning("Жанр с ID %s не найден", genre_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске жанра: {e}")
+        logger.error("Ошибка при поиске жанра: %s", e)
         return None
 
 
@@ -927,23 +1463,24 @@ def get_genre_by_name(session, name):
         if genre:
             return genre
         else:
-            print(f"Жанр '{name}' не найден")
+            logger.warning("Жанр '%s' не найден", name)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске жанра по названию: {e}")
+        logger.error("Ошибка при поиске жанра по названию: %s", e)
         return None
 
 
+@cached_query('genres')
 def get_all_genres(session):
     """
     Получение всех жанров
     """
     try:
         genres = session.query(Genre).order_by(Genre.name).all()
-        print(f"Найдено {len(genres)} жанров")
+        logger.debug("Найдено %s жанров", len(genres))
         return genres
     except Exception as e:
-        print(f"Ошибка при получении списка жанров: {e}")
+        logger.error("Ошибка при получении списка жанров: %s", e)
         return []
 
 
@@ -953,10 +1490,10 @@ def search_genres(session, search_term):
     """
     try:
         genres = session.query(Genre).filter(Genre.name.ilike(f"%{search_term}%")).all()
-        print(f"По запросу '{search_term}' найдено {len(genres)} жанров")
+        logger.debug("По запросу '%s' найдено %s жанров", search_term, len(genres))
         return genres
     except Exception as e:
-        print(f"Ошибка при поиске жанров: {e}")
+        logger.error("Ошибка при поиске жанров: %s", e)
         return []
 
 
@@ -965,36 +1502,29 @@ def update_genre(session, genre_id, **kwargs):
     Обновление данных жанра ['name']
     """
     try:
-        genre = get_genre_by_id(session, genre_id)
-        if not genre:
-            return None
-
         valid_fields = ['name']
-        updated_fields = []
+        values = {field: value for field, value in kwargs.items() if field in valid_fields}
 
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                # Проверяем уникальность названия жанра при обновлении
-                if field == 'name' and value != genre.name:
-                    existing = get_genre_by_name(session, value)
-                    if existing:
-                        print(f"Жанр '{value}' уже существует")
-                        return None
-
-                setattr(genre, field, value)
-                updated_fields.append(field)
+        genre = _update_returning(session, Genre, genre_id, values)
+        if not genre:
+            return None
 
-        if updated_fields:
+        if values:
             session.commit()
-            print(f"Жанр ID {genre_id} обновлен. Измененные поля: {', '.join(updated_fields)}")
+            logger.info("Жанр ID %s обновлен. Измененные поля: %s", genre_id, ', '.join(values))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return genre
 
+    except IntegrityError as e:
+        # Уникальность названия проверяется ограничением таблицы
+        session.rollback()
+        logger.warning("Жанр ID %s не обновлен (жанр '%s' уже существует?): %s", genre_id, kwargs.get('name'), e.orig)
+        return None
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении жанра: {e}")
+        logger.error("Ошибка при обновлении жанра: %s", e)
         return None
 
 
@@ -1009,12 +1539,12 @@ def delete_genre(session, genre_id):
 
         session.delete(genre)
         session.commit()
-        print(f"Жанр ID {genre_id} успешно удален")
+        logger.info("Жанр ID %s успешно удален", genre_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении жанра: {e}")
+        logger.error("Ошибка при удалении жанра: %s", e)
         return False
 
 
@@ -1027,22 +1557,22 @@ def add_genre_to_book(session, book_id, genre_id):
         genre = get_genre_by_id(session, genre_id)
 
         if not book or not genre:
-            print("Книга или жанр не найдены")
+            logger.warning("Книга или жанр не найдены")
             return False
 
         # Проверяем, не добавлен ли уже этот жанр к книге
         if genre in book.genres:
-            print(f"Жанр '{genre.name}' уже добавлен к книге '{book.title}'")
+            logger.warning("Жанр '%s' уже добавлен к книге '%s'", genre.name, book.title)
             return False
 
         book.genres.append(genre)
         session.commit()
-        print(f"Жанр '{genre.name}' успешно добавлен к книге '{book.title}'")
+        logger.info("Жанр '%s' успешно добавлен к книге '%s'", genre.name, book.title)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при добавлении жанра к книге: {e}")
+        logger.error("Ошибка при добавлении жанра к книге: %s", e)
         return False
 
 
@@ -1055,21 +1585,21 @@ def remove_genre_from_book(session, book_id, genre_id):
         genre = get_genre_by_id(session, genre_id)
 
         if not book or not genre:
-            print("Книга или жанр не найдены")
+            logger.warning("Книга или жанр не найдены")
             return False
 
         if genre not in book.genres:
-            print(f"Жанр '{genre.name}' не связан с книгой '{book.title}'")
+            logger.warning("Жанр '%s' не связан с книгой '%s'", genre.name, book.title)
             return False
 
         book.genres.remove(genre)
         session.commit()
-        print(f"Жанр '{genre.name}' успешно удален из книги '{book.title}'")
+        logger.info("Жанр '%s' успешно удален из книги '%s'", genre.name, book.title)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении жанра из книги: {e}")
+        logger.error("Ошибка при удалении жанра из книги: %s", e)
         return False
 
 
@@ -1083,10 +1613,10 @@ def get_books_by_genre(session, genre_id):
             return []
 
         books = genre.books
-        print(f"Найдено {len(books)} книг в жанре '{genre.name}'")
+        logger.debug("Найдено %s книг в жанре '%s'", len(books), genre.name)
         return books
     except Exception as e:
-        print(f"Ошибка при получении книг по жанру: {e}")
+        logger.error("Ошибка при получении книг по жанру: %s", e)
         return []
 
 
@@ -1100,10 +1630,10 @@ def get_genres_by_book(session, book_id):
             return []
 
         genres = book.genres
-        print(f"Найдено {len(genres)} жанров для книги '{book.title}'")
+        logger.debug("Найдено %s жанров для книги '%s'", len(genres), book.title)
         return genres
     except Exception as e:
-        print(f"Ошибка при получении жанров книги: {e}")
+        logger.error("Ошибка при получении жанров книги: %s", e)
         return []
 
 
@@ -1116,50 +1646,53 @@ def set_book_genres(session, book_id, genre_ids):
         if not book:
             return False
 
-        # Получаем объекты жанров по ID
+        # Получаем объекты жанров по ID одним запросом
+        found = load_by_ids(session, Genre, genre_ids)
         genres = []
         for genre_id in genre_ids:
-            genre = get_genre_by_id(session, genre_id)
+            genre = found.get(genre_id)
             if genre:
                 genres.append(genre)
             else:
-                print(f"Жанр с ID {genre_id} не найден")
+                logger.warning("Жанр с ID %s не найден", genre_id)
 
         # Заменяем текущие жанры
         book.genres = genres
         session.commit()
-        print(f"Для книги '{book.title}' установлено {len(genres)} жанров")
+        logger.info("Для книги '%s' установлено %s жанров", book.title, len(genres))
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при установке жанров для книги: {e}")
+        logger.error("Ошибка при установке жанров для книги: %s", e)
         return False
 
 
+@cached_query('books')
 def get_books_count(session):
     """
     Получение общего количества книг
     """
     try:
         count = session.query(Book).count()
-        print(f"Общее количество книг: {count}")
+        logger.debug("Общее количество книг: %s", count)
         return count
     except Exception as e:
-        print(f"Ошибка при подсчете книг: {e}")
+        logger.error("Ошибка при подсчете книг: %s", e)
         return 0
 
 
+@cached_query('genres')
 def get_genres_count(session):
     """
     Получение общего количества жанров
     """
     try:
         count = session.query(Genre).count()
-        print(f"Общее количество жанров: {count}")
+        logger.debug("Общее количество жанров: %s", count)
         return count
     except Exception as e:
-        print(f"Ошибка при подсчете жанров: {e}")
+        logger.error("Ошибка при подсчете жанров: %s", e)
         return 0
 
 
@@ -1204,15 +1737,15 @@ def create_book_copy(session, book_id, inventory_number, condition='good', locat
     """
     try:
         # Проверяем существование книги
-        book = session.query(Book).filter(Book.id == book_id).first()
+        book = _get_by_id(session, Book, book_id)
         if not book:
-            print(f"Книга с ID {book_id} не найдена")
+            logger.warning("Книга с ID %s не найдена", book_id)
             return None
 
         # Проверяем уникальность инвентарного номера
         existing_copy = session.query(BookCopy).filter(BookCopy.inventory_number == inventory_number).first()
         if existing_copy:
-            print(f"Экземпляр с инвентарным номером '{inventory_number}' уже существует")
+            logger.warning("Экземпляр с инвентарным номером '%s' уже существует", inventory_number)
             return None
 
         copy = BookCopy(
@@ -1224,12 +1757,12 @@ def create_book_copy(session, book_id, inventory_number, condition='good', locat
 
         session.add(copy)
         session.commit()
-        print(f"Экземпляр книги '{book.title}' создан (Инвентарный номер: {inventory_number})")
+        logger.info("Экземпляр книги '%s' создан (Инвентарный номер: %s)", book.title, inventory_number)
         return copy
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании экземпляра книги: {e}")
+        logger.error("Ошибка при создании экземпляра книги: %s", e)
         return None
 
 
@@ -1238,14 +1771,14 @@ def get_copy_by_id(session, copy_id):
     Получение экземпляра по ID
     """
     try:
-        copy = session.query(BookCopy).filter(BookCopy.id == copy_id).first()
+        copy = _get_by_id(session, BookCopy, copy_id)
         if copy:
             return copy
         else:
-            print(f"Экземпляр с ID {copy_id} не найден")
+            logger.warning("Экземпляр с ID %s не найден", copy_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске экземпляра: {e}")
+        logger.error("Ошибка при поиске экземпляра: %s", e)
         return None
 
 
@@ -1258,10 +1791,10 @@ def get_copy_by_inventory(session, inventory_number):
         if copy:
             return copy
         else:
-            print(f"Экземпляр с инвентарным номером '{inventory_number}' не найден")
+            logger.warning("Экземпляр с инвентарным номером '%s' не найден", inventory_number)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске экземпляра по инвентарному номеру: {e}")
+        logger.error("Ошибка при поиске экземпляра по инвентарному номеру: %s", e)
         return None
 
 
@@ -1277,10 +1810,10 @@ def get_copies_by_book(session, book_id, available_only=False):
 
         copies = query.all()
         status = "доступных" if available_only else ""
-        print(f"Найдено {len(copies)} {status}экземпляров книги ID {book_id}")
+        logger.debug("Найдено %s %sэкземпляров книги ID %s", len(copies), status, book_id)
         return copies
     except Exception as e:
-        print(f"Ошибка при получении экземпляров книги: {e}")
+        logger.error("Ошибка при получении экземпляров книги: %s", e)
         return []
 
 
@@ -1298,19 +1831,33 @@ def get_all_copies(session, limit=None, offset=None):
     try:
         query = session.query(BookCopy).order_by(BookCopy.id)
 
-        if limit:
-            query = query.limit(limit)
         if offset:
             query = query.offset(offset)
+        if limit:
+            query = query.limit(limit)
 
         copies = query.all()
-        print(f"Найдено {len(copies)} экземпляров")
+        logger.debug("Найдено %s экземпляров", len(copies))
         return copies
     except Exception as e:
-        print(f"Ошибка при получении списка экземпляров: {e}")
+        logger.error("Ошибка при получении списка экземпляров: %s", e)
         return []
 
 
+def get_copies_page(session, after=None, limit=50, order_by='id', descending=False):
+    """
+    Получение страницы экземпляров по курсору (сортировка: id / inventory_number).
+    Возвращает (список, курсор следующей страницы или None)
+    """
+    try:
+        items, next_cursor = _keyset_page(session, BookCopy, COPY_SORT_ORDERS, order_by, after, limit, descending)
+        logger.debug("Найдено %s экземпляров на странице", len(items))
+        return items, next_cursor
+    except Exception as e:
+        logger.error("Ошибка при получении страницы экземпляров: %s", e)
+        return [], None
+
+
 def search_copies(session, inventory_number=None, condition=None, location=None):
     """
     Поиск экземпляров по различным критериям
@@ -1326,48 +1873,45 @@ def search_copies(session, inventory_number=None, condition=None, location=None)
             query = query.filter(BookCopy.location.ilike(f"%{location}%"))
 
         copies = query.all()
-        print(f"Найдено {len(copies)} экземпляров по заданным критериям")
+        logger.debug("Найдено %s экземпляров по заданным критериям", len(copies))
         return copies
     except Exception as e:
-        print(f"Ошибка при поиске экземпляров: {e}")
+        logger.error("Ошибка при поиске экземпляров: %s", e)
         return []
 
 
-def update_copy(session, copy_id, **kwargs):
+def update_copy(session, copy_id, expected_version=None, **kwargs):
     """
-    Обновление данных экземпляра ['inventory_number', 'condition', 'location', 'available']
+    Обновление данных экземпляра ['inventory_number', 'condition', 'location', 'available'].
+    expected_version - версия, с которой начато редактирование; если строку уже изменили,
+    возвращается UpdateConflict
     """
     try:
-        copy = get_copy_by_id(session, copy_id)
-        if not copy:
-            return None
-
         valid_fields = ['inventory_number', 'condition', 'location', 'available']
-        updated_fields = []
+        values = {field: value for field, value in kwargs.items() if field in valid_fields}
 
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                # Проверяем уникальность инвентарного номера при обновлении
-                if field == 'inventory_number' and value != copy.inventory_number:
-                    existing = get_copy_by_inventory(session, value)
-                    if existing:
-                        print(f"Экземпляр с инвентарным номером '{value}' уже существует")
-                        return None
-
-                setattr(copy, field, value)
-                updated_fields.append(field)
+        copy = _update_returning(session, BookCopy, copy_id, values, expected_version)
+        if not copy:
+            # None или UpdateConflict
+            return copy
 
-        if updated_fields:
+        if values:
             session.commit()
-            print(f"Экземпляр ID {copy_id} обновлен. Измененные поля: {', '.join(updated_fields)}")
+            logger.info("Экземпляр ID %s обновлен. Измененные поля: %s", copy_id, ', '.join(values))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return copy
 
+    except IntegrityError as e:
+        # Уникальность инвентарного номера проверяется ограничением таблицы
+        session.rollback()
+        logger.warning("Экземпляр ID %s не обновлен (инвентарный номер '%s' уже занят?): %s",
+                       copy_id, kwargs.get('inventory_number'), e.orig)
+        return None
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении экземпляра: {e}")
+        logger.error("Ошибка при обновлении экземпляра: %s", e)
         return None
 
 
@@ -1382,12 +1926,12 @@ def delete_copy(session, copy_id):
 
         session.delete(copy)
         session.commit()
-        print(f"Экземпляр ID {copy_id} успешно удален")
+        logger.info("Экземпляр ID %s успешно удален", copy_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении экземпляра: {e}")
+        logger.error("Ошибка при удалении экземпляра: %s", e)
         return False
 
 
@@ -1402,12 +1946,12 @@ def delete_copy_by_inventory(session, inventory_number):
 
         session.delete(copy)
         session.commit()
-        print(f"Экземпляр с инвентарным номером '{inventory_number}' успешно удален")
+        logger.info("Экземпляр с инвентарным номером '%s' успешно удален", inventory_number)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении экземпляра: {e}")
+        logger.error("Ошибка при удалении экземпляра: %s", e)
         return False
 
 
@@ -1416,9 +1960,9 @@ def create_multiple_copies(session, book_id, inventory_numbers, condition='good'
     Создание нескольких экземпляров одной книги
     """
     try:
-        book = session.query(Book).filter(Book.id == book_id).first()
+        book = _get_by_id(session, Book, book_id)
         if not book:
-            print(f"Книга с ID {book_id} не найдена")
+            logger.warning("Книга с ID %s не найдена", book_id)
             return []
 
         created_copies = []
@@ -1426,7 +1970,7 @@ def create_multiple_copies(session, book_id, inventory_numbers, condition='good'
             # Проверяем уникальность инвентарного номера
             existing_copy = session.query(BookCopy).filter(BookCopy.inventory_number == inventory_number).first()
             if existing_copy:
-                print(f"Пропуск: экземпляр с инвентарным номером '{inventory_number}' уже существует")
+                logger.warning("Пропуск: экземпляр с инвентарным номером '%s' уже существует", inventory_number)
                 continue
 
             copy = BookCopy(
@@ -1439,12 +1983,12 @@ def create_multiple_copies(session, book_id, inventory_numbers, condition='good'
             created_copies.append(copy)
 
         session.commit()
-        print(f"Создано {len(created_copies)} экземпляров книги '{book.title}'")
+        logger.info("Создано %s экземпляров книги '%s'", len(created_copies), book.title)
         return created_copies
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании нескольких экземпляров: {e}")
+        logger.error("Ошибка при создании нескольких экземпляров: %s", e)
         return []
 
 
@@ -1463,15 +2007,15 @@ def mark_all_copies_unavailable(session, book_id):
 
         if updated_count > 0:
             session.commit()
-            print(f"Обновлено {updated_count} экземпляров книги ID {book_id} (помечены как недоступные)")
+            logger.info("Обновлено %s экземпляров книги ID %s (помечены как недоступные)", updated_count, book_id)
         else:
-            print("Нет экземпляров для обновления")
+            logger.warning("Нет экземпляров для обновления")
 
         return updated_count
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении доступности экземпляров: {e}")
+        logger.error("Ошибка при обновлении доступности экземпляров: %s", e)
         return 0
 
 
@@ -1490,20 +2034,21 @@ def get_copies_count(session, book_id=None, available_only=False):
         count = query.count()
 
         if book_id:
-            book = session.query(Book).filter(Book.id == book_id).first()
+            book = _get_by_id(session, Book, book_id)
             book_title = book.title if book else f"ID {book_id}"
             status = "доступных " if available_only else ""
-            print(f"Количество {status}экземпляров книги '{book_title}': {count}")
+            logger.debug("Количество %sэкземпляров книги '%s': %s", status, book_title, count)
         else:
             status = "доступных " if available_only else ""
-            print(f"Общее количество {status}экземпляров: {count}")
+            logger.debug("Общее количество %sэкземпляров: %s", status, count)
 
         return count
     except Exception as e:
-        print(f"Ошибка при подсчете экземпляров: {e}")
+        logger.error("Ошибка при подсчете экземпляров: %s", e)
         return 0
 
 
+@cached_query('book_copies', 'books')
 def get_copies_statistics(session, book_id=None):
     """
     Получение статистики по экземплярам
@@ -1513,7 +2058,7 @@ def get_copies_statistics(session, book_id=None):
 
         if book_id:
             query = query.filter(BookCopy.book_id == book_id)
-            book = session.query(Book).filter(Book.id == book_id).first()
+            book = _get_by_id(session, Book, book_id)
             book_info = f" книги '{book.title}'" if book else f" книги ID {book_id}"
         else:
             book_info = ""
@@ -1531,13 +2076,13 @@ def get_copies_statistics(session, book_id=None):
                 condition_count = query.filter(BookCopy.condition == condition).count()
                 condition_stats[condition] = condition_count
 
-        print(f"Статистика экземпляров{book_info}:")
-        print(f"  Всего: {total}")
-        print(f"  Доступно: {available}")
-        print(f"  Недоступно: {unavailable}")
-        print("  Состояние:")
+        logger.debug("Статистика экземпляров%s:", book_info)
+        logger.debug("  Всего: %s", total)
+        logger.debug("  Доступно: %s", available)
+        logger.debug("  Недоступно: %s", unavailable)
+        logger.debug("  Состояние:")
         for condition, count in condition_stats.items():
-            print(f"    - {condition}: {count}")
+            logger.debug("    - %s: %s", condition, count)
 
         return {
             'total': total,
@@ -1547,7 +2092,7 @@ def get_copies_statistics(session, book_id=None):
         }
 
     except Exception as e:
-        print(f"Ошибка при получении статистики: {e}")
+        logger.error("Ошибка при получении статистики: %s", e)
         return {}
 
 
@@ -1576,22 +2121,22 @@ def create_loan(session, reader_id, copy_id, librarian_id, loan_date=None, retur
     """
     try:
         # Проверяем существование читателя, экземпляра и библиотекаря
-        reader = session.query(Reader).filter(Reader.id == reader_id).first()
-        copy = session.query(BookCopy).filter(BookCopy.id == copy_id).first()
-        librarian = session.query(Librarian).filter(Librarian.id == librarian_id).first()
+        reader = _get_by_id(session, Reader, reader_id)
+        copy = _get_by_id(session, BookCopy, copy_id)
+        librarian = _get_by_id(session, Librarian, librarian_id)
 
         if not reader:
-            print(f"Читатель с ID {reader_id} не найден")
+            logger.warning("Читатель с ID %s не найден", reader_id)
             return None
         if not copy:
-            print(f"Экземпляр с ID {copy_id} не найден")
+            logger.warning("Экземпляр с ID %s не найден", copy_id)
             return None
         if not librarian:
-            print(f"Библиотекарь с ID {librarian_id} не найден")
+            logger.warning("Библиотекарь с ID %s не найден", librarian_id)
             return None
 
         if not copy.available:
-            print(f"Экземпляр {copy.inventory_number} недоступен для выдачи")
+            logger.warning("Экземпляр %s недоступен для выдачи", copy.inventory_number)
             return None
 
         if loan_date is None:
@@ -1611,12 +2156,12 @@ def create_loan(session, reader_id, copy_id, librarian_id, loan_date=None, retur
 
         session.add(loan)
         session.commit()
-        print(f"Выдача создана: {reader.name} -> {copy.book.title} (ID: {loan.id})")
+        logger.info("Выдача создана: %s -> %s (ID: %s)", reader.name, copy.book.title, loan.id)
         return loan
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании выдачи: {e}")
+        logger.error("Ошибка при создании выдачи: %s", e)
         return None
 
 
@@ -1625,14 +2170,14 @@ def get_loan_by_id(session, loan_id):
     Получение выдачи по ID
     """
     try:
-        loan = session.query(Loan).filter(Loan.id == loan_id).first()
+        loan = _get_by_id(session, Loan, loan_id)
         if loan:
             return loan
         else:
-            print(f"Выдача с ID {loan_id} не найдена")
+            logger.warning("Выдача с ID %s не найдена", loan_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске выдачи: {e}")
+        logger.error("Ошибка при поиске выдачи: %s", e)
         return None
 
 
@@ -1648,10 +2193,10 @@ def get_loans_by_reader(session, reader_id, active_only=False):
 
         loans = query.order_by(Loan.loan_date.desc()).all()
         status = "активных" if active_only else ""
-        print(f"Найдено {len(loans)} {status}выдач для читателя ID {reader_id}")
+        logger.debug("Найдено %s %sвыдач для читателя ID %s", len(loans), status, reader_id)
         return loans
     except Exception as e:
-        print(f"Ошибка при получении выдач читателя: {e}")
+        logger.error("Ошибка при получении выдач читателя: %s", e)
         return []
 
 
@@ -1661,10 +2206,10 @@ def get_loans_by_copy(session, copy_id):
     """
     try:
         loans = session.query(Loan).filter(Loan.copy_id == copy_id).order_by(Loan.loan_date.desc()).all()
-        print(f"Найдено {len(loans)} выдач для экземпляра ID {copy_id}")
+        logger.debug("Найдено %s выдач для экземпляра ID %s", len(loans), copy_id)
         return loans
     except Exception as e:
-        print(f"Ошибка при получении выдач экземпляра: {e}")
+        logger.error("Ошибка при получении выдач экземпляра: %s", e)
         return []
 
 
@@ -1680,10 +2225,10 @@ def get_active_loans(session, reader_id=None):
 
         loans = query.order_by(Loan.loan_date).all()
         reader_info = f" читателя ID {reader_id}" if reader_id else ""
-        print(f"Найдено {len(loans)} активных выдач{reader_info}")
+        logger.debug("Найдено %s активных выдач%s", len(loans), reader_info)
         return loans
     except Exception as e:
-        print(f"Ошибка при получении активных выдач: {e}")
+        logger.error("Ошибка при получении активных выдач: %s", e)
         return []
 
 
@@ -1699,55 +2244,69 @@ def get_overdue_loans(session):
             )
         ).order_by(Loan.return_date).all()
 
-        print(f"Найдено {len(loans)} просроченных выдач")
+        logger.debug("Найдено %s просроченных выдач", len(loans))
         return loans
     except Exception as e:
-        print(f"Ошибка при получении просроченных выдач: {e}")
+        logger.error("Ошибка при получении просроченных выдач: %s", e)
         return []
 
 
-def update_loan(session, loan_id, **kwargs):
+def _update_loan(session, loan_id, values, expected_version=None):
+    """
+    Изменение выдачи без коммита (для update_loan и составных операций).
+    Возвращает выдачу, None (выдачи нет) или UpdateConflict; при ошибке исключение
+    """
+    released_copy_id = None
+    if values.get('returned') == True:
+        # Особенная логика для возврата книги: дата возврата ставится и экземпляр
+        # освобождается, только если выдача еще не была возвращена. Строка выдачи
+        # блокируется до конца транзакции, поэтому решение не меняется до UPDATE
+        released_copy_id = session.scalar(
+            select(Loan.copy_id).where(Loan.id == loan_id, Loan.returned == False).with_for_update()
+        )
+        if released_copy_id is not None:
+            values.setdefault('actual_return_date', date.today())
+
+    loan = _update_returning(session, Loan, loan_id, values, expected_version)
+    if loan and released_copy_id is not None:
+        # Помечаем экземпляр как доступный
+        if _update_returning(session, BookCopy, released_copy_id, {'available': True}) is None:
+            raise ValueError(f"Экземпляр ID {released_copy_id} выдачи ID {loan_id} не найден")
+    return loan
+
+
+def update_loan(session, loan_id, expected_version=None, **kwargs):
     """
     Обновление данных выдачи ['reader_id', 'copy_id', 'librarian_id', 'loan_date', 'return_date', 'actual_return_date',
-                        'returned']
+                        'returned'].
+    expected_version - версия, с которой начато редактирование; если выдачу уже изменили,
+    возвращается UpdateConflict
     """
     try:
-        loan = get_loan_by_id(session, loan_id)
-        if not loan:
-            return None
-
         valid_fields = ['reader_id', 'copy_id', 'librarian_id', 'loan_date', 'return_date', 'actual_return_date',
                         'returned']
-        updated_fields = []
-
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                # Особенная логика для возврата книги
-                if field == 'returned' and value == True and not loan.returned:
-                    loan.actual_return_date = date.today()
-                    # Помечаем экземпляр как доступный
-                    copy = session.query(BookCopy).filter(BookCopy.id == loan.copy_id).first()
-                    if copy:
-                        copy.available = True
-
-                setattr(loan, field, value)
-                updated_fields.append(field)
-
-        if updated_fields:
+        values = {field: value for field, value in kwargs.items() if field in valid_fields}
+
+        loan = _update_loan(session, loan_id, values, expected_version)
+        if not loan:
+            # None или UpdateConflict: выдача не изменена
+            return loan
+
+        if values:
             session.commit()
-            print(f"Выдача ID {loan_id} обновлена. Измененные поля: {', '.join(updated_fields)}")
+            logger.info("Выдача ID %s обновлена. Измененные поля: %s", loan_id, ', '.join(values))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return loan
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении выдачи: {e}")
+        logger.error("Ошибка при обновлении выдачи: %s", e)
         return None
 
 
-def return_loan(session, loan_id, actual_return_date=None):
+def return_loan(session, loan_id, actual_return_date=None, expected_version=None):
     """
     Возврат книги по выдаче
     """
@@ -1755,13 +2314,50 @@ def return_loan(session, loan_id, actual_return_date=None):
         if actual_return_date is None:
             actual_return_date = date.today()
 
-        return update_loan(session, loan_id, returned=True, actual_return_date=actual_return_date)
+        return update_loan(session, loan_id, expected_version=expected_version,
+                           returned=True, actual_return_date=actual_return_date)
 
     except Exception as e:
-        print(f"Ошибка при возврате книги: {e}")
+        logger.error("Ошибка при возврате книги: %s", e)
         return None
 
 
+def return_loan_with_fine(session, loan_id, librarian_id, condition=None, fine_amount=None,
+                          expected_version=None):
+    """
+    Возврат книги одной транзакцией: выдача закрывается, у экземпляра записывается
+    состояние condition, при fine_amount создается штраф (если его еще нет).
+    Ошибка на любом шаге откатывает все. Возвращает (выдача, штраф или None);
+    при неудаче выдача - None или UpdateConflict
+    """
+    try:
+        loan = _update_loan(session, loan_id, {'returned': True, 'actual_return_date': date.today()},
+                            expected_version)
+        if not loan:
+            return loan, None
+
+        if condition is not None:
+            if _update_returning(session, BookCopy, loan.copy_id, {'condition': condition}) is None:
+                raise ValueError(f"Экземпляр ID {loan.copy_id} не найден")
+
+        fine = None
+        if fine_amount:
+            if session.scalar(select(Fine.id).where(Fine.loan_id == loan_id)) is None:
+                fine = Fine(loan_id=loan_id, librarian_id=librarian_id, amount=fine_amount, issued_date=date.today())
+                session.add(fine)
+            else:
+                logger.warning("Штраф для выдачи ID %s уже существует", loan_id)
+
+        session.commit()
+        logger.info("Выдача ID %s возвращена%s", loan_id, f", штраф {fine_amount} руб." if fine else "")
+        return loan, fine
+
+    except Exception as e:
+        session.rollback()
+        logger.error("Ошибка при возврате книги: %s", e)
+        return None, None
+
+
 def delete_loan(session, loan_id):
     """
     Удаление выдачи
@@ -1779,12 +2375,12 @@ def delete_loan(session, loan_id):
 
         session.delete(loan)
         session.commit()
-        print(f"Выдача ID {loan_id} успешно удалена")
+        logger.info("Выдача ID %s успешно удалена", loan_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении выдачи: {e}")
+        logger.error("Ошибка при удалении выдачи: %s", e)
         return False
 
 
@@ -1794,18 +2390,18 @@ def create_fine(session, loan_id, librarian_id, amount, issued_date=None):
     """
     try:
         loan = get_loan_by_id(session, loan_id)
-        librarian = session.query(Librarian).filter(Librarian.id == librarian_id).first()
+        librarian = _get_by_id(session, Librarian, librarian_id)
 
         if not loan:
-            print(f"Выдача с ID {loan_id} не найдена")
+            logger.warning("Выдача с ID %s не найдена", loan_id)
             return None
         if not librarian:
-            print(f"Библиотекарь с ID {librarian_id} не найден")
+            logger.warning("Библиотекарь с ID %s не найден", librarian_id)
             return None
 
         existing_fine = session.query(Fine).filter(Fine.loan_id == loan_id).first()
         if existing_fine:
-            print(f"Штраф для выдачи ID {loan_id} уже существует")
+            logger.warning("Штраф для выдачи ID %s уже существует", loan_id)
             return None
 
         if issued_date is None:
@@ -1820,12 +2416,12 @@ def create_fine(session, loan_id, librarian_id, amount, issued_date=None):
 
         session.add(fine)
         session.commit()
-        print(f"Штраф создан: {amount} руб. для выдачи ID {loan_id} (ID штрафа: {fine.id})")
+        logger.info("Штраф создан: %s руб. для выдачи ID %s (ID штрафа: %s)", amount, loan_id, fine.id)
         return fine
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при создании штрафа: {e}")
+        logger.error("Ошибка при создании штрафа: %s", e)
         return None
 
 
@@ -1834,14 +2430,14 @@ def get_fine_by_id(session, fine_id):
     Получение штрафа по ID
     """
     try:
-        fine = session.query(Fine).filter(Fine.id == fine_id).first()
+        fine = _get_by_id(session, Fine, fine_id)
         if fine:
             return fine
         else:
-            print(f"Штраф с ID {fine_id} не найден")
+            logger.warning("Штраф с ID %s не найден", fine_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске штрафа: {e}")
+        logger.error("Ошибка при поиске штрафа: %s", e)
         return None
 
 
@@ -1854,10 +2450,10 @@ def get_fine_by_loan(session, loan_id):
         if fine:
             return fine
         else:
-            print(f"Штраф для выдачи ID {loan_id} не найден")
+            logger.warning("Штраф для выдачи ID %s не найден", loan_id)
             return None
     except Exception as e:
-        print(f"Ошибка при поиске штрафа по выдаче: {e}")
+        logger.error("Ошибка при поиске штрафа по выдаче: %s", e)
         return None
 
 
@@ -1873,10 +2469,10 @@ def get_fines_by_reader(session, reader_id, unpaid_only=False):
 
         fines = query.order_by(Fine.issued_date.desc()).all()
         status = "неоплаченных" if unpaid_only else ""
-        print(f"Найдено {len(fines)} {status}штрафов для читателя ID {reader_id}")
+        logger.debug("Найдено %s %sштрафов для читателя ID %s", len(fines), status, reader_id)
         return fines
     except Exception as e:
-        print(f"Ошибка при получении штрафов читателя: {e}")
+        logger.error("Ошибка при получении штрафов читателя: %s", e)
         return []
 
 
@@ -1892,49 +2488,46 @@ def get_unpaid_fines(session, reader_id=None):
 
         fines = query.order_by(Fine.issued_date).all()
         reader_info = f" читателя ID {reader_id}" if reader_id else ""
-        print(f"Найдено {len(fines)} неоплаченных штрафов{reader_info}")
+        logger.debug("Найдено %s неоплаченных штрафов%s", len(fines), reader_info)
         return fines
     except Exception as e:
-        print(f"Ошибка при получении неоплаченных штрафов: {e}")
+        logger.error("Ошибка при получении неоплаченных штрафов: %s", e)
         return []
 
 
-def update_fine(session, fine_id, **kwargs):
+def update_fine(session, fine_id, expected_version=None, **kwargs):
     """
-    Обновление данных штрафа
+    Обновление данных штрафа. expected_version - версия, с которой начато
+    редактирование; если штраф уже изменили, возвращается UpdateConflict
     """
     try:
-        fine = get_fine_by_id(session, fine_id)
-        if not fine:
-            return None
-
         valid_fields = ['loan_id', 'librarian_id', 'amount', 'issued_date', 'paid']
-        updated_fields = []
+        values = {field: value for field, value in kwargs.items() if field in valid_fields}
 
-        for field, value in kwargs.items():
-            if field in valid_fields:
-                setattr(fine, field, value)
-                updated_fields.append(field)
+        fine = _update_returning(session, Fine, fine_id, values, expected_version)
+        if not fine:
+            # None или UpdateConflict
+            return fine
 
-        if updated_fields:
+        if values:
             session.commit()
-            print(f"Штраф ID {fine_id} обновлен. Измененные поля: {', '.join(updated_fields)}")
+            logger.info("Штраф ID %s обновлен. Измененные поля: %s", fine_id, ', '.join(values))
         else:
-            print("Нет полей для обновления")
+            logger.warning("Нет полей для обновления")
 
         return fine
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при обновлении штрафа: {e}")
+        logger.error("Ошибка при обновлении штрафа: %s", e)
         return None
 
 
-def pay_fine(session, fine_id):
+def pay_fine(session, fine_id, expected_version=None):
     """
     Оплата штрафа
     """
-    return update_fine(session, fine_id, paid=True)
+    return update_fine(session, fine_id, expected_version=expected_version, paid=True)
 
 
 def delete_fine(session, fine_id):
@@ -1948,12 +2541,12 @@ def delete_fine(session, fine_id):
 
         session.delete(fine)
         session.commit()
-        print(f"Штраф ID {fine_id} успешно удален")
+        logger.info("Штраф ID %s успешно удален", fine_id)
         return True
 
     except Exception as e:
         session.rollback()
-        print(f"Ошибка при удалении штрафа: {e}")
+        logger.error("Ошибка при удалении штрафа: %s", e)
         return False
 
 
@@ -1972,11 +2565,11 @@ def calculate_overdue_fine(session, loan_id, daily_rate=100):
         overdue_days = (date.today() - loan.return_date).days
         fine_amount = overdue_days * daily_rate
 
-        print(f"Просрочка: {overdue_days} дней, штраф: {fine_amount} руб.")
+        logger.info("Просрочка: %s дней, штраф: %s руб.", overdue_days, fine_amount)
         return fine_amount
 
     except Exception as e:
-        print(f"Ошибка при расчете штрафа: {e}")
+        logger.error("Ошибка при расчете штрафа: %s", e)
         return 0
 
 
@@ -2008,14 +2601,15 @@ def auto_create_overdue_fines(session, daily_rate=10):
                     if fine:
                         created_fines.append(fine)
 
-        print(f"Создано {len(created_fines)} штрафов за просрочку")
+        logger.info("Создано %s штрафов за просрочку", len(created_fines))
         return created_fines
 
     except Exception as e:
-        print(f"Ошибка при автоматическом создании штрафов: {e}")
+        logger.error("Ошибка при автоматическом создании штрафов: %s", e)
         return []
 
 
+@cached_query('loans', daily=True)
 def get_loan_statistics(session, reader_id=None):
     """
     Получение статистики по выдачам
@@ -2041,11 +2635,11 @@ def get_loan_statistics(session, reader_id=None):
             )
         ).count()
 
-        print(f"Статистика выдач{reader_info}:")
-        print(f"  Всего выдач: {total}")
-        print(f"  Активных: {active}")
-        print(f"  Возвращенных: {returned}")
-        print(f"  Просроченных: {overdue}")
+        logger.debug("Статистика выдач%s:", reader_info)
+        logger.debug("  Всего выдач: %s", total)
+        logger.debug("  Активных: %s", active)
+        logger.debug("  Возвращенных: %s", returned)
+        logger.debug("  Просроченных: %s", overdue)
 
         return {
             'total': total,
@@ -2055,10 +2649,11 @@ def get_loan_statistics(session, reader_id=None):
         }
 
     except Exception as e:
-        print(f"Ошибка при получении статистики выдач: {e}")
+        logger.error("Ошибка при получении статистики выдач: %s", e)
         return {}
 
 
+@cached_query('fines', 'loans')
 def get_fine_statistics(session, reader_id=None):
     """
     Получение статистики по штрафам
@@ -2080,12 +2675,12 @@ def get_fine_statistics(session, reader_id=None):
         total_amount = session.query(func.sum(Fine.amount)).scalar() or 0
         unpaid_amount = session.query(func.sum(Fine.amount)).filter(Fine.paid == False).scalar() or 0
 
-        print(f"Статистика штрафов{reader_info}:")
-        print(f"  Всего штрафов: {total}")
-        print(f"  Оплаченных: {paid}")
-        print(f"  Неоплаченных: {unpaid}")
-        print(f"  Общая сумма: {total_amount} руб.")
-        print(f"  Сумма неоплаченных: {unpaid_amount} руб.")
+        logger.debug("Статистика штрафов%s:", reader_info)
+        logger.debug("  Всего штрафов: %s", total)
+        logger.debug("  Оплаченных: %s", paid)
+        logger.debug("  Неоплаченных: %s", unpaid)
+        logger.debug("  Общая сумма: %s руб.", total_amount)
+        logger.debug("  Сумма неоплаченных: %s руб.", unpaid_amount)
 
         return {
             'total': total,
@@ -2096,7 +2691,7 @@ def get_fine_statistics(session, reader_id=None):
         }
 
     except Exception as e:
-        print(f"Ошибка при получении статистики штрафов: {e}")
+        logger.error("Ошибка при получении статистики штрафов: %s", e)
         return {}
 
 
@@ -2153,10 +2748,24 @@ def get_all_loans(session):
         loans = session.query(Loan).order_by(Loan.loan_date.desc()).all()
         return loans
     except Exception as e:
-        print(f"Ошибка при получении всех выдач: {e}")
+        logger.error("Ошибка при получении всех выдач: %s", e)
         return []
 
 
+def get_loans_page(session, after=None, limit=50, order_by='id', descending=False):
+    """
+    Получение страницы выдач по курсору (сортировка: id / loan_date / return_date).
+    Возвращает (список, курсор следующей страницы или None)
+    """
+    try:
+        items, next_cursor = _keyset_page(session, Loan, LOAN_SORT_ORDERS, order_by, after, limit, descending)
+        logger.debug("Найдено %s выдач на странице", len(items))
+        return items, next_cursor
+    except Exception as e:
+        logger.error("Ошибка при получении страницы выдач: %s", e)
+        return [], None
+
+
 def get_returned_loans(session):
     """
     Получение возвращенных выдач
@@ -2165,7 +2774,7 @@ def get_returned_loans(session):
         loans = session.query(Loan).filter(Loan.returned == True).order_by(Loan.loan_date.desc()).all()
         return loans
     except Exception as e:
-        print(f"Ошибка при получении возвращенных выдач: {e}")
+        logger.error("Ошибка при получении возвращенных выдач: %s", e)
         return []
 
 
@@ -2177,10 +2786,24 @@ def get_all_fines(session):
         fines = session.query(Fine).order_by(Fine.issued_date.desc()).all()
         return fines
     except Exception as e:
-        print(f"Ошибка при получении всех штрафов: {e}")
+        logger.error("Ошибка при получении всех штрафов: %s", e)
         return []
 
 
+def get_fines_page(session, after=None, limit=50, order_by='id', descending=False):
+    """
+    Получение страницы штрафов по курсору (сортировка: id / amount / issued_date).
+    Возвращает (список, курсор следующей страницы или None)
+    """
+    try:
+        items, next_cursor = _keyset_page(session, Fine, FINE_SORT_ORDERS, order_by, after, limit, descending)
+        logger.debug("Найдено %s штрафов на странице", len(items))
+        return items, next_cursor
+    except Exception as e:
+        logger.error("Ошибка при получении страницы штрафов: %s", e)
+        return [], None
+
+
 # Функции для работы с книгами (дополнение к существующим)
 def get_all_books(session):
     """Получить все книги с информацией об экземплярах"""
@@ -2188,16 +2811,31 @@ def get_all_books(session):
         books = session.query(Book).order_by(Book.title).all()
         return books
     except Exception as e:
-        print(f"Ошибка при получении книг: {e}")
+        logger.error("Ошибка при получении книг: %s", e)
         return []
 
 
+def get_books_page(session, after=None, limit=50, order_by='id', descending=False):
+    """
+    Получение страницы книг по курсору (сортировка: id / title / author).
+    Возвращает (список, курсор следующей страницы или None)
+    """
+    try:
+        items, next_cursor = _keyset_page(session, Book, BOOK_SORT_ORDERS, order_by, after, limit, descending)
+        logger.debug("Найдено %s книг на странице", len(items))
+        return items, next_cursor
+    except Exception as e:
+        logger.error("Ошибка при получении страницы книг: %s", e)
+        return [], None
+
+
+@cached_query('books')
 def get_books_count(session):
     """Получить общее количество книг"""
     try:
         return session.query(Book).count()
     except Exception as e:
-        print(f"Ошибка при подсчете книг: {e}")
+        logger.error("Ошибка при подсчете книг: %s", e)
         return 0
 
 
@@ -2208,7 +2846,7 @@ def get_all_book_copies(session):
         copies = session.query(BookCopy).order_by(BookCopy.inventory_number).all()
         return copies
     except Exception as e:
-        print(f"Ошибка при получении экземпляров: {e}")
+        logger.error("Ошибка при получении экземпляров: %s", e)
         return []
 
 
@@ -2222,7 +2860,7 @@ def get_available_copies_count(session, book_id):
         ).count()
         return count
     except Exception as e:
-        print(f"Ошибка при подсчете доступных экземпляров: {e}")
+        logger.error("Ошибка при подсчете доступных экземпляров: %s", e)
         return 0
 
 
@@ -2255,7 +2893,7 @@ def create_book_copy(session, book_id, inventory_number, condition='Хороше
 def update_book_copy_status(session, copy_id, status):
     """Обновить статус экземпляра"""
     try:
-        copy = session.query(BookCopy).filter(BookCopy.id == copy_id).first()
+        copy = _get_by_id(session, BookCopy, copy_id)
         if not copy:
             raise ValueError("Экземпляр не найден")
 
@@ -2270,7 +2908,7 @@ def update_book_copy_status(session, copy_id, status):
 def write_off_copy(session, copy_id):
     """Списать экземпляр"""
     try:
-        copy = session.query(BookCopy).filter(BookCopy.id == copy_id).first()
+        copy = _get_by_id(session, BookCopy, copy_id)
         if not copy:
             raise ValueError("Экземпляр не найден")
 
@@ -2286,17 +2924,320 @@ def write_off_copy(session, copy_id):
 def get_active_loan_by_copy(session, copy_id):
     """Получить активную выдачу для экземпляра"""
     try:
-        loan = session.query(Loan).filter(
-            Loan.copy_id == copy_id,
-            Loan.returned == False
-        ).first()
+        loan = session.execute(_ACTIVE_LOAN_BY_COPY, {'copy_id': copy_id}).scalars().first()
         return loan
     except Exception as e:
-        print(f"Ошибка при поиске активной выдачи: {e}")
+        logger.error("Ошибка при поиске активной выдачи: %s", e)
+        return None
+
+
+# Пакетная загрузка по списку ID: один запрос на модель вместо запроса на каждый ID.
+# В PostgreSQL список передается одним параметром-массивом (id = ANY(:ids)),
+# поэтому текст запроса не зависит от количества ID и берется из кэша компиляции
+_BY_IDS_ARRAY_STATEMENTS = {
+    model: select(model).where(model.id == any_(bindparam('ids', type_=ARRAY(Integer))))
+    for model in _BY_ID_STATEMENTS
+}
+_BY_IDS_EXPANDING_STATEMENTS = {
+    model: select(model).where(model.id.in_(bindparam('ids', expanding=True)))
+    for model in _BY_ID_STATEMENTS
+}
+BY_IDS_CHUNK_SIZE = 5000
+
+
+def load_by_ids(session, model, ids):
+    """
+    Загрузка объектов model по списку ID (по одному запросу на BY_IDS_CHUNK_SIZE ID).
+    Возвращает словарь {id: объект}, объекты попадают в identity map сессии
+    """
+    try:
+        ids = list(dict.fromkeys(object_id for object_id in ids if object_id is not None))
+        if not ids:
+            return {}
+        if session.get_bind().dialect.name == 'postgresql':
+            statement = _BY_IDS_ARRAY_STATEMENTS[model]
+        else:
+            statement = _BY_IDS_EXPANDING_STATEMENTS[model]
+
+        found = {}
+        for start in range(0, len(ids), BY_IDS_CHUNK_SIZE):
+            chunk = ids[start:start + BY_IDS_CHUNK_SIZE]
+            for obj in session.execute(statement, {'ids': chunk}).scalars():
+                found[obj.id] = obj
+        logger.debug("Загружено %s из %s объектов %s", len(found), len(ids), model.__name__)
+        return found
+    except Exception as e:
+        logger.error("Ошибка при пакетной загрузке %s: %s", model.__name__, e)
+        return {}
+
+
+def get_readers_by_ids(session, reader_ids):
+    """Читатели по списку ID: {id: читатель}"""
+    return load_by_ids(session, Reader, reader_ids)
+
+
+def get_books_by_ids(session, book_ids):
+    """Книги по списку ID: {id: книга}"""
+    return load_by_ids(session, Book, book_ids)
+
+
+def get_copies_by_ids(session, copy_ids):
+    """Экземпляры по списку ID: {id: экземпляр}"""
+    return load_by_ids(session, BookCopy, copy_ids)
+
+
+def get_librarians_by_ids(session, librarian_ids):
+    """Библиотекари по списку ID: {id: библиотекарь}"""
+    return load_by_ids(session, Librarian, librarian_ids)
+
+
+def get_loans_by_ids(session, loan_ids):
+    """Выдачи по списку ID: {id: выдача}"""
+    return load_by_ids(session, Loan, loan_ids)
+
+
+class BatchLoader:
+    """
+    Отложенная загрузка по ID в стиле DataLoader: load() только запоминает ID,
+    первый get() загружает все накопленные ID одним запросом на модель.
+    Уже загруженные ID повторно не запрашиваются
+
+        loader = BatchLoader(session)
+        for loan in loans:
+            loader.load(Reader, loan.reader_id).load(BookCopy, loan.copy_id)
+        reader = loader.get(Reader, loans[0].reader_id)
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._pending = {}
+        self._loaded = {}
+
+    def load(self, model, object_id):
+        return self.load_many(model, [object_id])
+
+    def load_many(self, model, ids):
+        loaded = self._loaded.get(model, {})
+        pending = self._pending.setdefault(model, set())
+        pending.update(object_id for object_id in ids if object_id is not None and object_id not in loaded)
+        return self
+
+    def dispatch(self):
+        """Загрузка всех накопленных ID"""
+        pending, self._pending = self._pending, {}
+        for model, ids in pending.items():
+            if not ids:
+                continue
+            loaded = self._loaded.setdefault(model, {})
+            found = load_by_ids(self.session, model, ids)
+            for object_id in ids:
+                loaded[object_id] = found.get(object_id)
+
+    def get(self, model, object_id):
+        if object_id not in self._loaded.get(model, {}):
+            self.load(model, object_id)
+            self.dispatch()
+        return self._loaded.get(model, {}).get(object_id)
+
+    def get_many(self, model, ids):
+        ids = list(ids)
+        self.load_many(model, ids)
+        self.dispatch()
+        loaded = self._loaded.get(model, {})
+        return [loaded.get(object_id) for object_id in ids]
+
+
+def _change_token(session):
+    """
+    Отметка для следующего get_changes_since. updated_at ставится при записи строки,
+    а видна она после коммита, поэтому отметка не позже начала самой старой
+    пишущей транзакции: ее строки не будут пропущены после коммита.
+    В PostgreSQL xact_start сеансов других ролей виден только членам pg_read_all_stats;
+    если в базе есть такие скрытые сеансы, отметка не позже HIDDEN_TRANSACTIONS_MARGIN назад
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        now, token, hidden = session.execute(text(
+            "SELECT statement_timestamp(), "
+            "least(statement_timestamp(), min(xact_start) FILTER (WHERE backend_xid IS NOT NULL)), "
+            "count(*) FILTER (WHERE usesysid IS NOT NULL AND NOT pg_has_role(usesysid, 'USAGE') "
+            "AND NOT pg_has_role('pg_read_all_stats', 'USAGE')) "
+            "FROM pg_stat_activity WHERE pid <> pg_backend_pid() "
+            "AND datid = (SELECT oid FROM pg_database WHERE datname = current_database())"
+        )).one()
+        if hidden:
+            logger.debug("Транзакции %s сеансов не видны (нет pg_read_all_stats), отметка сдвинута на %s назад",
+                         hidden, HIDDEN_TRANSACTIONS_MARGIN)
+            token = min(token, now - HIDDEN_TRANSACTIONS_MARGIN)
+        return token
+    if dialect == 'sqlite':
+        # CURRENT_TIMESTAMP с точностью до секунды: строки текущей секунды вернутся еще раз
+        return datetime.fromisoformat(session.execute(text("SELECT datetime(CURRENT_TIMESTAMP, '-1 second')")).scalar())
+    return session.execute(select(func.now())).scalar()
+
+
+def get_change_token(session):
+    """
+    Текущая отметка для get_changes_since (строка ISO). Берется до чтения данных,
+    которые потом догоняются по изменениям после нее
+    """
+    try:
+        return _change_token(session).isoformat()
+    except Exception as e:
+        logger.error("Ошибка при получении отметки изменений: %s", e)
         return None
 
 
+def get_changes_since(session, table, token=None):
+    """
+    Изменения таблицы (readers / books / copies / loans / fines) после отметки token.
+    Возвращает {'changed': измененные и новые объекты, 'deleted': id удаленных строк,
+    'token': отметка для следующего вызова, 'full': True - вернулись все строки
+    (первый вызов без token или отметка старше срока хранения записей об удалении)}.
+    Строки на границе отметки могут вернуться повторно
+    """
+    try:
+        model = CHANGE_TRACKED_MODELS[table]
+        new_token = _change_token(session)
+
+        since = datetime.fromisoformat(token) if token else None
+        if since is not None and since.tzinfo is None and new_token.tzinfo is not None:
+            since = since.replace(tzinfo=new_token.tzinfo)
+        full = since is None or since < new_token - timedelta(days=DELETED_ROWS_RETENTION_DAYS)
+
+        query = session.query(model)
+        deleted = []
+        if not full:
+            query = query.filter(model.updated_at >= since)
+            deleted = session.scalars(
+                select(deleted_rows.c.row_id)
+                .where(deleted_rows.c.table_name == model.__tablename__, deleted_rows.c.deleted_at >= since)
+            ).all()
+        changed = query.order_by(model.updated_at, model.id).all()
+
+        logger.debug("Изменения %s: изменено %s, удалено %s", table, len(changed), len(deleted))
+        return {'changed': changed, 'deleted': deleted, 'token': new_token.isoformat(), 'full': full}
+    except Exception as e:
+        logger.error("Ошибка при получении изменений таблицы %s: %s", table, e)
+        return None
+
+
+def purge_deleted_rows(session, days=DELETED_ROWS_RETENTION_DAYS):
+    """
+    Удаление записей об удалении старше days дней
+    """
+    try:
+        result = session.execute(
+            deleted_rows.delete().where(deleted_rows.c.deleted_at < _change_token(session) - timedelta(days=days))
+        )
+        session.commit()
+        logger.info("Удалено записей об удаленных строках: %s", result.rowcount)
+        return result.rowcount
+    except Exception as e:
+        session.rollback()
+        logger.error("Ошибка при очистке записей об удалении: %s", e)
+        return 0
+
+
+# Потоковые варианты get_all_*: серверный курсор и легкие кортежи строк вместо ORM-объектов
+STREAM_BATCH_SIZE = 1000
+
+
+def _iter_rows(session, statement, batch_size=STREAM_BATCH_SIZE):
+    """
+    Итерация по результату запроса пачками по batch_size строк.
+    yield_per включает серверный курсор, поэтому таблица не загружается в память целиком
+    """
+    result = session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def iter_all_readers(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех читателей (кортежи строк таблицы readers)"""
+    return _iter_rows(session, select(*Reader.__table__.c).order_by(Reader.id), batch_size)
+
+
+def iter_all_librarians(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех библиотекарей (кортежи строк таблицы librarians)"""
+    return _iter_rows(session, select(*Librarian.__table__.c).order_by(Librarian.id), batch_size)
+
+
+def iter_all_copies(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех экземпляров в порядке ID"""
+    return _iter_rows(session, select(*BookCopy.__table__.c).order_by(BookCopy.id), batch_size)
+
+
+def iter_all_loans(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех выдач"""
+    return _iter_rows(session, select(*Loan.__table__.c).order_by(Loan.loan_date.desc()), batch_size)
+
+
+def iter_returned_loans(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение возвращенных выдач"""
+    statement = select(*Loan.__table__.c).where(Loan.returned == True).order_by(Loan.loan_date.desc())
+    return _iter_rows(session, statement, batch_size)
+
+
+def iter_all_fines(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех штрафов"""
+    return _iter_rows(session, select(*Fine.__table__.c).order_by(Fine.issued_date.desc()), batch_size)
+
+
+def iter_all_books(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех книг"""
+    return _iter_rows(session, select(*Book.__table__.c).order_by(Book.title), batch_size)
+
+
+def iter_all_book_copies(session, batch_size=STREAM_BATCH_SIZE):
+    """Потоковое получение всех экземпляров в порядке инвентарных номеров"""
+    statement = select(*BookCopy.__table__.c).order_by(BookCopy.inventory_number)
+    return _iter_rows(session, statement, batch_size)
+
+
+def _cache_metrics():
+    stats = get_cache_stats()
+    return [
+        ('library_cache_hits_total', 'counter', 'Попадания в кэш запросов', stats['hits']),
+        ('library_cache_misses_total', 'counter', 'Промахи кэша запросов', stats['misses']),
+        ('library_cache_invalidations_total', 'counter', 'Инвалидации кэша запросов', stats['invalidations']),
+        ('library_cache_entries', 'gauge', 'Записей в кэше запросов', stats['size']),
+    ]
+
+
+def _login_metrics():
+    stats = get_login_stats()
+    samples = [
+        (f'library_login_{name}_total', 'counter', f'Попытки входа: {name}', stats[name])
+        for name in login_limiter.counters
+    ]
+    samples.append(('library_login_tracked_emails', 'gauge', 'Email с активным лимитом', stats['tracked_emails']))
+    samples.append(('library_login_unknown_cache_size', 'gauge', 'Неизвестные email в кэше', stats['unknown_cache_size']))
+    return samples
+
+
+def get_metrics_text():
+    """
+    Метрики функций, кэша запросов и входа в текстовом формате Prometheus
+    """
+    return metrics_registry.render_prometheus()
+
+
+metrics_registry.register_collector(_cache_metrics)
+metrics_registry.register_collector(_login_metrics)
+
+# Гистограммы задержек для всех публичных функций модуля
+# (кроме декораторов, вывода на экран и потоковых итераторов)
+instrument_module(globals(), __name__, exclude={
+    name for name in list(globals()) if name.startswith(('print_', 'iter_'))
+} | {'with_session', 'session_scope', 'get_metrics_text'})
+
+
 if __name__ == "__main__":
+    configure_logging()
     DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?client_encoding=utf8"
     engine = create_engine(DATABASE_URL, echo=False)
     session = get_session()
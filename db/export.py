@@ -0,0 +1,199 @@
+import argparse
+import csv
+from datetime import date
+
+from sqlalchemy import select
+
+from .models import Reader, Book, BookCopy, Librarian, Loan, Fine
+from .db_funcs import get_engine
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _loans_statement(date_from=None, date_to=None):
+    statement = (
+        select(
+            Loan.id, Loan.loan_date, Loan.return_date, Loan.actual_return_date, Loan.returned,
+            Loan.reader_id, Reader.name, Reader.email,
+            Loan.copy_id, BookCopy.inventory_number,
+            BookCopy.book_id, Book.title, Book.author,
+            Loan.librarian_id, Librarian.name
+        )
+        .join(Reader, Reader.id == Loan.reader_id)
+        .join(BookCopy, BookCopy.id == Loan.copy_id)
+        .join(Book, Book.id == BookCopy.book_id)
+        .outerjoin(Librarian, Librarian.id == Loan.librarian_id)
+        .order_by(Loan.id)
+    )
+    if date_from:
+        statement = statement.where(Loan.loan_date >= date_from)
+    if date_to:
+        statement = statement.where(Loan.loan_date <= date_to)
+    return statement
+
+
+def _fines_statement(date_from=None, date_to=None):
+    statement = (
+        select(
+            Fine.id, Fine.loan_id, Fine.amount, Fine.issued_date, Fine.paid,
+            Loan.reader_id, Reader.name, Book.title,
+            Fine.librarian_id, Librarian.name
+        )
+        .join(Loan, Loan.id == Fine.loan_id)
+        .join(Reader, Reader.id == Loan.reader_id)
+        .join(BookCopy, BookCopy.id == Loan.copy_id)
+        .join(Book, Book.id == BookCopy.book_id)
+        .outerjoin(Librarian, Librarian.id == Fine.librarian_id)
+        .order_by(Fine.id)
+    )
+    if date_from:
+        statement = statement.where(Fine.issued_date >= date_from)
+    if date_to:
+        statement = statement.where(Fine.issued_date <= date_to)
+    return statement
+
+
+def _catalog_statement(date_from=None, date_to=None):
+    # У каталога нет даты, фильтр по периоду не применяется
+    return (
+        select(
+            BookCopy.id, BookCopy.inventory_number, BookCopy.condition, BookCopy.location,
+            BookCopy.available, Book.id, Book.title, Book.author, Book.isbn, Book.publish_year
+        )
+        .join(Book, Book.id == BookCopy.book_id)
+        .order_by(BookCopy.id)
+    )
+
+
+# Описание выгрузок: запрос и колонки (имя, тип для Arrow/Parquet)
+EXPORTS = {
+    'loans': (_loans_statement, [
+        ('loan_id', 'int'), ('loan_date', 'date'), ('return_date', 'date'),
+        ('actual_return_date', 'date'), ('returned', 'bool'),
+        ('reader_id', 'int'), ('reader_name', 'str'), ('reader_email', 'str'),
+        ('copy_id', 'int'), ('inventory_number', 'str'),
+        ('book_id', 'int'), ('book_title', 'str'), ('book_author', 'str'),
+        ('librarian_id', 'int'), ('librarian_name', 'str'),
+    ]),
+    'fines': (_fines_statement, [
+        ('fine_id', 'int'), ('loan_id', 'int'), ('amount', 'decimal'), ('issued_date', 'date'),
+        ('paid', 'bool'), ('reader_id', 'int'), ('reader_name', 'str'), ('book_title', 'str'),
+        ('librarian_id', 'int'), ('librarian_name', 'str'),
+    ]),
+    'catalog': (_catalog_statement, [
+        ('copy_id', 'int'), ('inventory_number', 'str'), ('condition', 'str'), ('location', 'str'),
+        ('available', 'bool'), ('book_id', 'int'), ('title', 'str'), ('author', 'str'),
+        ('isbn', 'str'), ('publish_year', 'int'),
+    ]),
+}
+
+
+def stream_rows(statement, batch_size=DEFAULT_BATCH_SIZE, engine=None):
+    """
+    Потоковое чтение результата запроса пачками через серверный курсор.
+    В памяти одновременно находится не больше batch_size строк.
+    """
+    engine = engine or get_engine()
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(statement)
+        for partition in result.partitions():
+            yield partition
+
+
+def _write_csv(batches, columns, path):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for batch in batches:
+            writer.writerows(batch)
+            count += len(batch)
+    return count
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {
+        'int': pa.int64(),
+        'str': pa.string(),
+        'date': pa.date32(),
+        'bool': pa.bool_(),
+        'decimal': pa.decimal128(8, 2),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _write_arrow(batches, columns, path, file_format):
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Для выгрузки в Parquet/Arrow требуется пакет pyarrow "
+                          "(pip install -r db/requirements.txt)") from e
+
+    schema = _arrow_schema(columns)
+    if file_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pyarrow.ipc.new_file(path, schema)
+
+    count = 0
+    try:
+        for batch in batches:
+            # Перекладываем строки пачки в колонки
+            arrays = [
+                pa.array([row[i] for row in batch], type=field.type)
+                for i, field in enumerate(schema)
+            ]
+            record_batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+            if file_format == 'parquet':
+                writer.write_batch(record_batch)
+            else:
+                writer.write(record_batch)
+            count += len(batch)
+    finally:
+        writer.close()
+    return count
+
+
+def export_table(name, path, file_format='csv', date_from=None, date_to=None,
+                 batch_size=DEFAULT_BATCH_SIZE, engine=None):
+    """
+    Выгрузка loans / fines / catalog в CSV, Parquet или Arrow с постоянным расходом памяти.
+    Возвращает количество выгруженных строк.
+    """
+    if name not in EXPORTS:
+        raise ValueError(f"Неизвестная выгрузка '{name}', доступны: {', '.join(EXPORTS)}")
+
+    build_statement, columns = EXPORTS[name]
+    batches = stream_rows(build_statement(date_from, date_to), batch_size, engine)
+
+    if file_format == 'csv':
+        count = _write_csv(batches, columns, path)
+    elif file_format in ('parquet', 'arrow'):
+        count = _write_arrow(batches, columns, path, file_format)
+    else:
+        raise ValueError(f"Неизвестный формат '{file_format}'")
+
+    print(f"Выгружено {count} строк ({name}) в {path}")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковая выгрузка данных библиотеки")
+    parser.add_argument('table', choices=sorted(EXPORTS))
+    parser.add_argument('path')
+    parser.add_argument('--format', dest='file_format', choices=['csv', 'parquet', 'arrow'], default='csv')
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat)
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    export_table(args.table, args.path, args.file_format, args.date_from, args.date_to, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Порог повторов одной формы запроса, после которого операция считается N+1
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+
+# Автоматический отчет для функций с @instrumented (по умолчанию выключен)
+tracking_enabled = os.environ.get('LIBRARY_QUERY_TRACKING', '') not in ('', '0')
+
+_local = threading.local()
+
+_LITERAL_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def statement_shape(statement):
+    """
+    Форма запроса: SQL без литералов и параметров, списки IN свернуты.
+    Запросы, отличающиеся только значениями, имеют одинаковую форму
+    """
+    for pattern, replacement in _LITERAL_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class QueryStats:
+    """Статистика SQL-запросов одной логической операции"""
+
+    def __init__(self, name, threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        self.name = name
+        self.threshold = threshold
+        self.statements = 0
+        self.db_time = 0.0
+        self.wall_time = 0.0
+        self.rows = 0
+        self.shapes = Counter()
+
+    def record(self, shape, elapsed, rows):
+        self.statements += 1
+        self.db_time += elapsed
+        self.rows += rows
+        self.shapes[shape] += 1
+
+    @property
+    def max_repeats(self):
+        return max(self.shapes.values(), default=0)
+
+    @property
+    def repeated_shapes(self):
+        """Формы запросов, выполненные больше threshold раз (кандидаты на N+1)"""
+        return {shape: count for shape, count in self.shapes.most_common() if count > self.threshold}
+
+    def report(self):
+        print(f"[{self.name}] запросов: {self.statements}, время БД: {self.db_time * 1000:.1f} мс, "
+              f"всего: {self.wall_time * 1000:.1f} мс, строк: {self.rows}")
+        for shape, count in self.repeated_shapes.items():
+            print(f"[{self.name}] возможный N+1: запрос выполнен {count} раз: {shape[:200]}")
+
+
+def _active_stats():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'stack', None):
+        conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    started = conn.info.pop('query_started', None)
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    shape = statement_shape(statement)
+    # psycopg2 сообщает число строк и для SELECT, sqlite возвращает -1
+    rows = max(getattr(cursor, 'rowcount', 0) or 0, 0)
+    for stats in stack:
+        stats.record(shape, elapsed, rows)
+
+
+@contextmanager
+def track_queries(name='operation', threshold=DEFAULT_N_PLUS_ONE_THRESHOLD, report=True):
+    """
+    Подсчет запросов, времени БД и строк внутри блока with.
+    Вложенные блоки учитываются во всех внешних
+    """
+    stats = QueryStats(name, threshold)
+    stack = _active_stats()
+    stack.append(stats)
+    started = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall_time = time.perf_counter() - started
+        stack.remove(stats)
+        if report:
+            stats.report()
+
+
+def instrumented(name=None, threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+    """
+    Декоратор логической операции: при включенном отслеживании
+    (enable_tracking() или LIBRARY_QUERY_TRACKING=1) печатает статистику запросов
+    """
+
+    def decorator(func):
+        operation = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracking_enabled:
+                return func(*args, **kwargs)
+            with track_queries(operation, threshold):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable_tracking(enabled=True):
+    global tracking_enabled
+    tracking_enabled = enabled
+
+
+@contextmanager
+def assert_max_queries(limit, name='assert_max_queries'):
+    """Проверка для тестов: блок выполняет не больше limit запросов"""
+    with track_queries(name, report=False) as stats:
+        yield stats
+    if stats.statements > limit:
+        raise AssertionError(f"{name}: выполнено {stats.statements} запросов, допустимо {limit}")
+
+
+@contextmanager
+def assert_no_n_plus_one(threshold=DEFAULT_N_PLUS_ONE_THRESHOLD, name='assert_no_n_plus_one'):
+    """Проверка для тестов: ни одна форма запроса не повторяется больше threshold раз"""
+    with track_queries(name, threshold, report=False) as stats:
+        yield stats
+    repeated = stats.repeated_shapes
+    if repeated:
+        shape, count = next(iter(repeated.items()))
+        raise AssertionError(f"{name}: запрос выполнен {count} раз (порог {threshold}): {shape[:200]}")
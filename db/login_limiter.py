@@ -0,0 +1,161 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Корзина токенов: capacity попыток, пополнение refill_rate токенов в секунду"""
+
+    __slots__ = ('capacity', 'refill_rate', 'tokens', 'updated')
+
+    def __init__(self, capacity, refill_rate, now):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def consume(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class LoginLimiter:
+    """
+    Ограничение попыток входа до дорогой проверки bcrypt:
+    корзины токенов на email и на источник запроса, а также
+    кратковременный кэш неизвестных email.
+    """
+
+    def __init__(self, email_capacity=5, email_per_minute=5,
+                 source_capacity=30, source_per_minute=30,
+                 unknown_ttl=60, max_entries=10000):
+        self.email_capacity = email_capacity
+        self.email_rate = email_per_minute / 60
+        self.source_capacity = source_capacity
+        self.source_rate = source_per_minute / 60
+        self.unknown_ttl = unknown_ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._email_buckets = {}
+        self._source_buckets = {}
+        self._unknown_emails = {}
+        # Оценка длительности проверки пароля, чтобы ответ для неизвестного email
+        # занимал столько же времени, сколько и обычная неудачная попытка
+        self._verify_seconds = 0.2
+
+        self.counters = {
+            'attempts': 0,
+            'allowed': 0,
+            'rejected_email': 0,
+            'rejected_source': 0,
+            'unknown_cached': 0,
+            'unknown_email': 0,
+            'failed_password': 0,
+            'succeeded': 0,
+        }
+
+    @staticmethod
+    def _normalize(email):
+        return (email or '').strip().lower()
+
+    def _bucket(self, buckets, key, capacity, rate, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.max_entries:
+                self._prune(buckets, now)
+            bucket = buckets[key] = TokenBucket(capacity, rate, now)
+        return bucket
+
+    @staticmethod
+    def _prune(buckets, now):
+        for key in [key for key, bucket in buckets.items() if bucket.is_full(now)]:
+            del buckets[key]
+
+    def check(self, email, source):
+        """
+        Решение, стоит ли тратить проверку пароля на попытку.
+        Возвращает None, если попытка допустима, иначе причину отказа.
+        """
+        email = self._normalize(email)
+        now = time.monotonic()
+        with self._lock:
+            self.counters['attempts'] += 1
+
+            expires = self._unknown_emails.get(email)
+            if expires is not None:
+                if expires > now:
+                    self.counters['unknown_cached'] += 1
+                    return 'unknown'
+                del self._unknown_emails[email]
+
+            source_bucket = self._bucket(self._source_buckets, source,
+                                         self.source_capacity, self.source_rate, now)
+            if not source_bucket.consume(now):
+                self.counters['rejected_source'] += 1
+                return 'source'
+
+            email_bucket = self._bucket(self._email_buckets, email,
+                                        self.email_capacity, self.email_rate, now)
+            if not email_bucket.consume(now):
+                self.counters['rejected_email'] += 1
+                return 'email'
+
+            self.counters['allowed'] += 1
+            return None
+
+    def record_unknown(self, email):
+        with self._lock:
+            self.counters['unknown_email'] += 1
+            if len(self._unknown_emails) >= self.max_entries:
+                now = time.monotonic()
+                for key in [k for k, expires in self._unknown_emails.items() if expires <= now]:
+                    del self._unknown_emails[key]
+            self._unknown_emails[self._normalize(email)] = time.monotonic() + self.unknown_ttl
+
+    def forget_unknown(self, email):
+        """Сброс отрицательного кэша (например, после создания библиотекаря с этим email)"""
+        with self._lock:
+            self._unknown_emails.pop(self._normalize(email), None)
+
+    def record_result(self, email, success, verify_seconds):
+        with self._lock:
+            self._verify_seconds = 0.8 * self._verify_seconds + 0.2 * verify_seconds
+            if success:
+                self.counters['succeeded'] += 1
+                # Успешный вход восстанавливает лимит попыток для email
+                self._email_buckets.pop(self._normalize(email), None)
+            else:
+                self.counters['failed_password'] += 1
+
+    def pad(self, started):
+        """Выравнивание времени ответа без затрат процессора на bcrypt"""
+        remaining = self._verify_seconds - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.counters)
+            result['tracked_emails'] = len(self._email_buckets)
+            result['tracked_sources'] = len(self._source_buckets)
+            result['unknown_cache_size'] = len(self._unknown_emails)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._email_buckets.clear()
+            self._source_buckets.clear()
+            self._unknown_emails.clear()
+            for key in self.counters:
+                self.counters[key] = 0
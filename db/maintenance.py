@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, select, insert, update, func, case, exists, and_, or_, not_
+
+from .models import BookCopy, Librarian, Loan, Fine, deleted_rows, DELETED_ROWS_RETENTION_DAYS
+from .db_config import DB_HOST, DB_NAME, DB_USER, DB_PORT, DB_PASS
+from .query_cache import notify_invalidations
+
+
+DEFAULT_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+DEFAULT_STATE_FILE = 'maintenance_state.json'
+DEFAULT_PARTITION_SIZE = 10000
+DEFAULT_FINE_RATE = 10
+
+
+# Движок процесса-исполнителя (создается initializer'ом пула, один на процесс)
+_worker_engine = None
+
+
+def _init_worker(url):
+    global _worker_engine
+    _worker_engine = create_engine(url, pool_size=1, max_overflow=0)
+
+
+def overdue_fines_partition(connection, low, high, today, options):
+    """
+    Штрафы для просроченных выдач с id в [low, high] без штрафа.
+    Повторный запуск не создает дублей (проверка NOT EXISTS)
+    """
+    overdue = connection.execute(
+        select(Loan.id, Loan.return_date, Loan.librarian_id)
+        .where(
+            Loan.id.between(low, high),
+            Loan.returned == False,
+            Loan.return_date < today,
+            ~exists().where(Fine.loan_id == Loan.id)
+        )
+    ).all()
+    if not overdue:
+        return {'rows': 0}
+
+    default_librarian_id = connection.scalar(select(Librarian.id).order_by(Librarian.id).limit(1))
+    rate = options.get('daily_rate', DEFAULT_FINE_RATE)
+    fines = [
+        {
+            'loan_id': loan_id,
+            'librarian_id': librarian_id or default_librarian_id,
+            'amount': (today - return_date).days * rate,
+            'issued_date': today,
+            'paid': False
+        }
+        for loan_id, return_date, librarian_id in overdue
+        if librarian_id or default_librarian_id
+    ]
+    if fines:
+        connection.execute(insert(Fine), fines)
+    return {'rows': len(fines)}
+
+
+def copy_availability_partition(connection, low, high, today, options):
+    """
+    Приведение available/status экземпляров с id в [low, high] к активным выдачам:
+    выданные - недоступны ('borrowed' / 'overdue'), возвращенные - снова доступны.
+    Списанные и находящиеся на ремонте (недоступны без выдачи) не меняются.
+    Версия измененных строк увеличивается, как при обновлении через ORM
+    """
+    active = exists().where(Loan.copy_id == BookCopy.id, Loan.returned == False)
+    overdue = exists().where(Loan.copy_id == BookCopy.id, Loan.returned == False, Loan.return_date < today)
+    in_range = BookCopy.id.between(low, high)
+
+    loaned_status = case((overdue, 'overdue'), else_='borrowed')
+    loaned = connection.execute(
+        update(BookCopy)
+        .where(in_range, active, or_(BookCopy.available == True,
+                                     BookCopy.status.is_distinct_from(loaned_status)))
+        .values(available=False, status=loaned_status, version=BookCopy.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    returned = connection.execute(
+        update(BookCopy)
+        .where(in_range, not_(active), BookCopy.status.in_(['borrowed', 'overdue']))
+        .values(available=True, status='available', version=BookCopy.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return {'rows': loaned + returned}
+
+
+def statistics_partition(connection, low, high, today, options):
+    """Частичные счетчики выдач и штрафов по выдачам с id в [low, high]"""
+    total, active, overdue = connection.execute(
+        select(
+            func.count(Loan.id),
+            func.coalesce(func.sum(case((Loan.returned == False, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((and_(Loan.returned == False, Loan.return_date < today), 1), else_=0)), 0)
+        ).where(Loan.id.between(low, high))
+    ).one()
+    fines, unpaid, amount, unpaid_amount = connection.execute(
+        select(
+            func.count(Fine.id),
+            func.coalesce(func.sum(case((Fine.paid == False, 1), else_=0)), 0),
+            func.coalesce(func.sum(Fine.amount), 0),
+            func.coalesce(func.sum(case((Fine.paid == False, Fine.amount), else_=0)), 0)
+        ).where(Fine.loan_id.between(low, high))
+    ).one()
+    return {
+        'rows': total,
+        'totals': {
+            'loans': total, 'active_loans': active, 'overdue_loans': overdue,
+            'fines': fines, 'unpaid_fines': unpaid,
+            'fines_amount': float(amount), 'unpaid_amount': float(unpaid_amount)
+        }
+    }
+
+
+def purge_deleted_rows_partition(connection, low, high, today, options):
+    """
+    Удаление записей deleted_rows с id в [low, high] старше срока хранения
+    (options['retention_days']). Без очистки таблица растет с каждым удалением строки
+    """
+    days = options.get('retention_days', DELETED_ROWS_RETENTION_DAYS)
+    cutoff = datetime.combine(today, datetime.min.time()) - timedelta(days=days)
+    purged = connection.execute(
+        deleted_rows.delete().where(deleted_rows.c.id.between(low, high), deleted_rows.c.deleted_at < cutoff)
+    ).rowcount
+    return {'rows': purged}
+
+
+# Задачи: функция обработки диапазона, колонка id для диапазонов, изменяемые таблицы (для инвалидации кэша)
+JOBS = {
+    'overdue_fines': (overdue_fines_partition, Loan.id, ('fines',)),
+    'copy_availability': (copy_availability_partition, BookCopy.id, ('book_copies',)),
+    'statistics': (statistics_partition, Loan.id, ()),
+    'purge_deleted_rows': (purge_deleted_rows_partition, deleted_rows.c.id, ()),
+}
+
+
+def _run_partition(job, low, high, today, options):
+    """Выполнение одного диапазона в процессе-исполнителе (одна транзакция на диапазон)"""
+    started = time.perf_counter()
+    partition_func = JOBS[job][0]
+    with _worker_engine.begin() as connection:
+        result = partition_func(connection, low, high, today, options)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def partitions(engine, id_column, partition_size):
+    """
+    Диапазоны id [low, high] по partition_size значений. Границы кратны partition_size
+    и не зависят от текущих min/max id, поэтому при продолжении запуска диапазоны
+    совпадают с сохраненными и строки не обрабатываются повторно
+    """
+    with engine.connect() as connection:
+        low, high = connection.execute(select(func.min(id_column), func.max(id_column))).one()
+    if low is None:
+        return []
+    first = (low // partition_size) * partition_size
+    return [(start, start + partition_size - 1) for start in range(first, high + 1, partition_size)]
+
+
+def _load_state(path, today):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('date') == today.isoformat():
+            return state
+    return {'date': today.isoformat(), 'jobs': {}}
+
+
+def _save_state(path, state):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_maintenance(jobs, url=DEFAULT_URL, workers=None, partition_size=DEFAULT_PARTITION_SIZE,
+                    state_file=DEFAULT_STATE_FILE, fresh=False, options=None, today=None):
+    """
+    Выполнение задач обслуживания: диапазоны id распределяются по пулу процессов.
+    Завершенные диапазоны записываются в state_file, поэтому прерванный запуск
+    в тот же день продолжается с места остановки
+    """
+    today = today or date.today()
+    options = options or {}
+    workers = workers or os.cpu_count() or 1
+    engine = create_engine(url)
+    state = {'date': today.isoformat(), 'jobs': {}} if fresh else _load_state(state_file, today)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(url,)) as pool:
+            for job in jobs:
+                if job not in JOBS:
+                    raise ValueError(f"Неизвестная задача '{job}', доступны: {', '.join(JOBS)}")
+                _, id_column, tables = JOBS[job]
+                job_state = state['jobs'].setdefault(job, {'partitions': {}})
+                if job_state.setdefault('partition_size', partition_size) != partition_size:
+                    # Диапазоны другого размера пересекаются с сохраненными - задача выполняется заново
+                    print(f"[{job}] размер диапазона изменился ({job_state['partition_size']} -> {partition_size}), "
+                          f"задача выполняется заново")
+                    job_state = state['jobs'][job] = {'partitions': {}, 'partition_size': partition_size}
+                done = job_state['partitions']
+
+                ranges = [r for r in partitions(engine, id_column, partition_size) if f"{r[0]}-{r[1]}" not in done]
+                total = len(ranges) + len(done)
+                if done:
+                    print(f"[{job}] продолжение: выполнено {len(done)} из {total} диапазонов")
+
+                started = time.perf_counter()
+                futures = {pool.submit(_run_partition, job, low, high, today, options): (low, high)
+                           for low, high in ranges}
+                for future in as_completed(futures):
+                    low, high = futures[future]
+                    result = future.result()
+                    done[f"{low}-{high}"] = result
+                    _save_state(state_file, state)
+                    print(f"[{job}] {len(done)}/{total} id {low}-{high}: "
+                          f"строк {result['rows']}, {result['seconds']:.2f} с")
+
+                rows = sum(result['rows'] for result in done.values())
+                job_state['rows'] = rows
+                job_state['seconds'] = time.perf_counter() - started
+                if job == 'statistics':
+                    job_state['totals'] = _merge_totals(done.values())
+                _save_state(state_file, state)
+
+                slowest = max(done.items(), key=lambda item: item[1]['seconds'], default=None)
+                print(f"[{job}] готово: строк {rows}, {job_state['seconds']:.2f} с"
+                      + (f", самый долгий диапазон {slowest[0]} ({slowest[1]['seconds']:.2f} с)" if slowest else ""))
+                if job == 'statistics':
+                    print(f"[{job}] {job_state['totals']}")
+                with engine.begin() as connection:
+                    notify_invalidations(connection, tables)
+    finally:
+        engine.dispose()
+    return state
+
+
+def _merge_totals(results):
+    totals = {}
+    for result in results:
+        for key, value in result.get('totals', {}).items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ночное обслуживание базы библиотеки")
+    parser.add_argument('jobs', nargs='*', default=list(JOBS), help=f"задачи: {', '.join(JOBS)} (по умолчанию все)")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--partition-size', type=int, default=DEFAULT_PARTITION_SIZE)
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE)
+    parser.add_argument('--fresh', action='store_true', help="не продолжать прерванный запуск")
+    parser.add_argument('--daily-rate', type=int, default=DEFAULT_FINE_RATE)
+    parser.add_argument('--retention-days', type=int, default=DELETED_ROWS_RETENTION_DAYS,
+                        help="срок хранения записей об удаленных строках (задача purge_deleted_rows)")
+    args = parser.parse_args(argv)
+
+    run_maintenance(args.jobs, args.url, args.workers, args.partition_size, args.state_file,
+                    args.fresh, {'daily_rate': args.daily_rate, 'retention_days': args.retention_days})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
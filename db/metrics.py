@@ -0,0 +1,198 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s.%(funcName)s: %(message)s"
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами (формат Prometheus)"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Метрики функций доступа к данным: гистограммы задержек и счетчики ошибок.
+    Дополнительные метрики (кэш, вход) подключаются через register_collector.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._errors = {}
+        self._collectors = []
+
+    def observe(self, function, seconds):
+        with self._lock:
+            histogram = self._latency.get(function)
+            if histogram is None:
+                histogram = self._latency[function] = Histogram()
+            histogram.observe(seconds)
+
+    def count_error(self, function):
+        with self._lock:
+            self._errors[function] = self._errors.get(function, 0) + 1
+
+    def register_collector(self, collector):
+        """
+        collector() возвращает список (имя, тип, описание, значение)
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        with self._lock:
+            latency = {
+                name: {'count': h.count, 'sum': h.sum, 'buckets': list(h.counts)}
+                for name, h in self._latency.items()
+            }
+            return {'latency': latency, 'errors': dict(self._errors)}
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._errors.clear()
+
+    def render_prometheus(self):
+        """Метрики в текстовом формате Prometheus"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP library_db_call_seconds Время выполнения функций db_funcs",
+            "# TYPE library_db_call_seconds histogram",
+        ]
+        for function, data in sorted(snapshot['latency'].items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), data['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'library_db_call_seconds_bucket{{function="{function}",le="{le}"}} {cumulative}')
+            lines.append(f'library_db_call_seconds_sum{{function="{function}"}} {data["sum"]:.6f}')
+            lines.append(f'library_db_call_seconds_count{{function="{function}"}} {data["count"]}')
+
+        lines.append("# HELP library_db_errors_total Ошибки в функциях db_funcs")
+        lines.append("# TYPE library_db_errors_total counter")
+        for function, count in sorted(snapshot['errors'].items()):
+            lines.append(f'library_db_errors_total{{function="{function}"}} {count}')
+
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logging.getLogger(__name__).warning("Ошибка при сборе метрик: %s", e)
+                continue
+            for name, kind, description, value in samples:
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def timed(func, name=None):
+    """Обертка, записывающая задержку вызова и необработанные исключения"""
+    function = name or func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            registry.count_error(function)
+            raise
+        finally:
+            registry.observe(function, time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_module(namespace, module_name, exclude=()):
+    """
+    Оборачивает все публичные функции модуля (namespace = globals()) в timed.
+    Функции ищутся по имени при вызове, поэтому внутренние вызовы тоже учитываются
+    """
+    for name, value in list(namespace.items()):
+        if (callable(value) and not name.startswith('_') and name not in exclude
+                and getattr(value, '__module__', None) == module_name
+                and not isinstance(value, type)):
+            namespace[name] = timed(value, name)
+
+
+class ErrorCountingHandler(logging.Handler):
+    """
+    Функции db_funcs перехватывают исключения и пишут их в лог,
+    поэтому ошибки считаются по записям уровня ERROR
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record):
+        registry.count_error(record.funcName)
+
+
+def configure_logging(level=None, fmt=LOG_FORMAT):
+    """
+    Настройка вывода логов. Уровень берется из LIBRARY_LOG_LEVEL (по умолчанию WARNING):
+    на горячих путях сообщения уровня DEBUG/INFO не форматируются
+    """
+    level = level or os.environ.get('LIBRARY_LOG_LEVEL', 'WARNING')
+    logging.basicConfig(level=level, format=fmt)
+    logging.getLogger('db').setLevel(level)
+
+
+def write_prometheus_textfile(path):
+    """
+    Запись метрик в файл для textfile collector node_exporter (атомарно, через переименование)
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+def start_metrics_server(port=9108, host='127.0.0.1'):
+    """
+    Локальный HTTP-эндпоинт /metrics в фоновом потоке. Возвращает сервер (server.shutdown() для остановки)
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
@@ -1,6 +1,6 @@
 from sqlalchemy import (
-    create_engine, Column, Integer, String, Date, Text,
-    Boolean, Numeric, ForeignKey, Table, CheckConstraint
+    create_engine, Column, Integer, String, Date, DateTime, Text,
+    Boolean, Numeric, ForeignKey, Table, CheckConstraint, Index, FetchedValue, func
 )
 from sqlalchemy.orm import DeclarativeBase, relationship, sessionmaker
 from datetime import date
@@ -19,6 +19,34 @@ genres_books = Table(
 )
 
 
+def _updated_at_column():
+    # Время последнего изменения строки; ставится триггером БД (db_funcs.install_change_tracking),
+    # поэтому учитываются и массовые UPDATE в обход ORM
+    return Column(DateTime(timezone=True), nullable=False, server_default=func.now(), server_onupdate=FetchedValue())
+
+
+def _version_column():
+    # Номер версии строки для оптимистичной блокировки: ORM добавляет к UPDATE условие
+    # "version = загруженная версия" и увеличивает ее; 0 измененных строк - StaleDataError
+    return Column(Integer, nullable=False, server_default='1')
+
+
+# Записи об удалении хранятся столько дней (очистка - задача purge_deleted_rows в maintenance);
+# для более старой отметки get_changes_since нужна полная перезагрузка
+DELETED_ROWS_RETENTION_DAYS = 30
+
+# Удаленные строки отслеживаемых таблиц (заполняется триггером) для get_changes_since
+deleted_rows = Table(
+    'deleted_rows',
+    Base.metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('table_name', String(50), nullable=False),
+    Column('row_id', Integer, nullable=False),
+    Column('deleted_at', DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Index('ix_deleted_rows_table_name_deleted_at', 'table_name', 'deleted_at')
+)
+
+
 class Reader(Base):
     __tablename__ = 'readers'
 
@@ -27,10 +55,18 @@ class Reader(Base):
     email = Column(String(255), nullable=False, unique=True)
     phone_number = Column(String(20))
     registration_date = Column(Date, default=date.today)
+    updated_at = _updated_at_column()
 
     loans = relationship("Loan", back_populates="reader", cascade="all, delete-orphan")
     # reviews = relationship("BookReview", back_populates="reader", cascade="all, delete-orphan")
 
+    # Индексы для курсорной пагинации (сортировка по имени и дате регистрации)
+    __table_args__ = (
+        Index('ix_readers_name_id', 'name', 'id'),
+        Index('ix_readers_registration_date_id', 'registration_date', 'id'),
+        Index('ix_readers_updated_at', 'updated_at'),
+    )
+
     def repr(self):
         return f"<Reader(id={self.id}, name='{self.name}')>"
 
@@ -45,11 +81,19 @@ class Book(Base):
     publish_year = Column(Integer)
     description = Column(Text)
     available = Column(Boolean, default=True)
+    updated_at = _updated_at_column()
 
     copies = relationship("BookCopy", back_populates="book", cascade="all, delete-orphan")
     # reviews = relationship("BookReview", back_populates="book", cascade="all, delete-orphan")
     genres = relationship("Genre", secondary=genres_books, back_populates="books")
 
+    # Индексы для сортировки по названию и автору и для выборки изменений
+    __table_args__ = (
+        Index('ix_books_title_id', 'title', 'id'),
+        Index('ix_books_author_id', 'author', 'id'),
+        Index('ix_books_updated_at', 'updated_at'),
+    )
+
     def repr(self):
         return f"<Book(id={self.id}, title='{self.title}')>"
 
@@ -64,10 +108,18 @@ class BookCopy(Base):
     location = Column(String(100))
     available = Column(Boolean, default=True)
     status = Column(String(20), default='available')
+    updated_at = _updated_at_column()
+    version = _version_column()
 
     book = relationship("Book", back_populates="copies")
     loans = relationship("Loan", back_populates="copy", cascade="all, delete-orphan")
 
+    # Индекс для выборки изменений
+    __table_args__ = (
+        Index('ix_book_copies_updated_at', 'updated_at'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
     def repr(self):
         return f"<BookCopy(id={self.id}, inventory='{self.inventory_number}')>"
 
@@ -97,6 +149,12 @@ class Librarian(Base):
     loans = relationship("Loan", back_populates="librarian")
     fines = relationship("Fine", back_populates="librarian")
 
+    # Индексы для курсорной пагинации (сортировка по имени и дате приема)
+    __table_args__ = (
+        Index('ix_librarians_name_id', 'name', 'id'),
+        Index('ix_librarians_hire_date_id', 'hire_date', 'id'),
+    )
+
     def repr(self):
         return f"<Librarian(id={self.id}, name='{self.name}')>"
 
@@ -112,12 +170,22 @@ class Loan(Base):
     return_date = Column(Date)
     actual_return_date = Column(Date)
     returned = Column(Boolean, default=False)
+    updated_at = _updated_at_column()
+    version = _version_column()
 
     reader = relationship("Reader", back_populates="loans")
     copy = relationship("BookCopy", back_populates="loans")
     librarian = relationship("Librarian", back_populates="loans")
     fine = relationship("Fine", back_populates="loan", uselist=False, cascade="all, delete-orphan")
 
+    # Индексы для сортировки по дате выдачи и сроку возврата и для выборки изменений
+    __table_args__ = (
+        Index('ix_loans_loan_date_id', 'loan_date', 'id'),
+        Index('ix_loans_return_date_id', 'return_date', 'id'),
+        Index('ix_loans_updated_at', 'updated_at'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
     def repr(self):
         return f"<Loan(id={self.id}, reader_id={self.reader_id}, copy_id={self.copy_id})>"
 
@@ -152,10 +220,20 @@ class Fine(Base):
     amount = Column(Numeric(6, 2), nullable=False)
     issued_date = Column(Date, default=date.today)
     paid = Column(Boolean, default=False)
+    updated_at = _updated_at_column()
+    version = _version_column()
 
     loan = relationship("Loan", back_populates="fine")
     librarian = relationship("Librarian", back_populates="fines")
 
+    # Индексы для сортировки по сумме и дате выдачи штрафа и для выборки изменений
+    __table_args__ = (
+        Index('ix_fines_amount_id', 'amount', 'id'),
+        Index('ix_fines_issued_date_id', 'issued_date', 'id'),
+        Index('ix_fines_updated_at', 'updated_at'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
     def repr(self):
         return f"<Fine(id={self.id}, amount={self.amount}, paid={self.paid})>"
 
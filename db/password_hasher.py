@@ -0,0 +1,92 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+DEFAULT_ROUNDS = 12
+
+
+class PasswordHasher:
+    """
+    Сервис хэширования паролей на ограниченном пуле потоков.
+    bcrypt освобождает GIL, поэтому потоки масштабируются по ядрам процессора.
+    Количество ожидающих задач ограничено: при переполнении вызывающий поток ждет.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, max_workers=None, max_pending=None):
+        self.rounds = rounds
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_pending = max_pending or self.max_workers * 4
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='bcrypt')
+            return self._executor
+
+    def _submit(self, func, *args):
+        self._slots.acquire()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def configure(self, rounds=None, max_workers=None, max_pending=None):
+        """Изменение стоимости хэширования и размеров пула"""
+        if rounds is not None:
+            if not 4 <= rounds <= 31:
+                raise ValueError("Стоимость bcrypt должна быть в диапазоне 4..31")
+            self.rounds = rounds
+        if max_workers is not None or max_pending is not None:
+            self.shutdown()
+            self.max_workers = max_workers or self.max_workers
+            self.max_pending = max_pending or self.max_workers * 4
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def _hash(self, password, rounds):
+        salt = bcrypt.gensalt(rounds=rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    @staticmethod
+    def _verify(plain_password, hashed_password):
+        try:
+            return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        except Exception:
+            return False
+
+    def hash_async(self, password):
+        """Хэширование пароля в пуле, возвращает Future со строкой хэша"""
+        return self._submit(self._hash, password, self.rounds)
+
+    def verify_async(self, plain_password, hashed_password):
+        """Проверка пароля в пуле, возвращает Future с bool"""
+        return self._submit(self._verify, plain_password, hashed_password)
+
+    def hash(self, password):
+        return self.hash_async(password).result()
+
+    def verify(self, plain_password, hashed_password):
+        return self.verify_async(plain_password, hashed_password).result()
+
+    def needs_rehash(self, hashed_password):
+        """Проверка, что хэш создан с другой стоимостью, чем текущая"""
+        try:
+            # Формат bcrypt: $2b$<стоимость>$<соль и хэш>
+            return int(hashed_password.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
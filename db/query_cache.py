@@ -0,0 +1,274 @@
+import threading
+from copy import deepcopy
+from datetime import date
+from functools import wraps
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+ALL_TABLES = '*'
+
+# Канал PostgreSQL NOTIFY, по которому экземпляры приложения сообщают об измененных таблицах
+NOTIFY_CHANNEL = 'library_cache'
+
+
+class QueryCache:
+    """
+    Кэш результатов запросов с инвалидацией по таблицам.
+    Каждая запись помнит таблицы, от которых зависит её результат.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._by_table = {}
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._func_stats = {}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._func_stats.setdefault(key[0], [0, 0])[0] += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            self._func_stats.setdefault(key[0], [0, 0])[1] += 1
+            return False, None
+
+    def put(self, key, value, tables):
+        with self._lock:
+            self._entries[key] = (value, tables)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+
+    def invalidate(self, *tables):
+        """Удаление записей, зависящих от указанных таблиц"""
+        with self._lock:
+            if ALL_TABLES in tables:
+                self.invalidate_all()
+                return
+            for table in tables:
+                for key in self._by_table.pop(table, ()):
+                    entry = self._entries.pop(key, None)
+                    if entry is None:
+                        continue
+                    self.invalidations += 1
+                    for other in entry[1]:
+                        if other != table:
+                            self._by_table.get(other, set()).discard(key)
+
+    def invalidate_all(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'functions': {
+                    name: {'hits': hits, 'misses': misses}
+                    for name, (hits, misses) in self._func_stats.items()
+                }
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+            self._func_stats.clear()
+
+
+query_cache = QueryCache()
+
+
+def _freeze(value):
+    """
+    Подготовка результата к хранению в кэше.
+    ORM-объекты копируются в отсоединенные снимки, чтобы кэш не зависел от сессии,
+    в которой был выполнен запрос.
+    """
+    if isinstance(value, list):
+        return [_freeze(item) for item in value]
+    try:
+        mapper = inspect(type(value))
+    except Exception:
+        return deepcopy(value)
+
+    snapshot = mapper.class_manager.new_instance()
+    state = inspect(value)
+    for attr in mapper.column_attrs:
+        if attr.key in state.dict:
+            setattr(snapshot, attr.key, state.dict[attr.key])
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def _thaw(session, value):
+    """Выдача результата из кэша в сессию вызывающего кода"""
+    if isinstance(value, list):
+        return [_thaw(session, item) for item in value]
+    try:
+        inspect(type(value))
+    except Exception:
+        return deepcopy(value)
+    return session.merge(value, load=False)
+
+
+def cached_query(*tables, daily=False):
+    """
+    Декоратор для функций вида func(session, *args), кэширующий результат
+    по имени функции и аргументам. tables - таблицы, от которых зависит результат.
+    daily=True добавляет текущую дату в ключ (для статистики с просрочками).
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(session, *args, **kwargs):
+            if not query_cache.enabled:
+                return func(session, *args, **kwargs)
+
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            if daily:
+                key += (date.today(),)
+            try:
+                hash(key)
+            except TypeError:
+                return func(session, *args, **kwargs)
+
+            found, value = query_cache.get(key)
+            if found:
+                try:
+                    return _thaw(session, value)
+                except Exception:
+                    query_cache.invalidate(*tables)
+
+            result = func(session, *args, **kwargs)
+            # Пустые результаты функций db_funcs часто означают ошибку - их не кэшируем
+            if result or result == 0:
+                query_cache.put(key, _freeze(result), tables)
+            return result
+
+        wrapper.cache_tables = tables
+        return wrapper
+
+    return decorator
+
+
+def invalidate_tables(*tables):
+    """Инвалидация кэша для указанных таблиц"""
+    query_cache.invalidate(*tables)
+
+
+def get_cache_stats():
+    """Метрики кэша запросов: попадания, промахи, инвалидации"""
+    return query_cache.stats()
+
+
+def _changed_tables(objects):
+    tables = set()
+    for obj in objects:
+        table = getattr(obj, '__table__', None)
+        if table is None:
+            continue
+        tables.add(table.name)
+        for relationship in inspect(type(obj)).relationships:
+            if relationship.secondary is not None:
+                tables.add(relationship.secondary.name)
+    return tables
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_tables(session, flush_context):
+    changed = _changed_tables(list(session.new) + list(session.dirty) + list(session.deleted))
+    session.info.setdefault('changed_tables', set()).update(changed)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_tables(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        name = getattr(table, 'name', ALL_TABLES)
+        orm_execute_state.session.info.setdefault('changed_tables', set()).add(name)
+
+
+def notify_invalidations(connection, tables, channel=NOTIFY_CHANNEL):
+    """
+    NOTIFY с именами измененных таблиц на соединении connection: другие экземпляры
+    приложения с запущенным listen_for_invalidations() сбросят кэш для них.
+    Уведомление доставляется при коммите транзакции соединения. Только PostgreSQL
+    """
+    if tables and connection.dialect.name == 'postgresql':
+        connection.execute(text("SELECT pg_notify(:channel, :tables)"),
+                           {'channel': channel, 'tables': ','.join(sorted(tables))})
+
+
+@event.listens_for(Session, 'before_commit')
+def _notify_committing_tables(session):
+    # NOTIFY отправляется в транзакции коммита: без отдельного соединения,
+    # доставляется вместе с коммитом и пропадает при откате
+    if not session.info.get('changed_tables') and not (session.new or session.dirty or session.deleted):
+        return
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    # Изменения, которые коммит сбросил бы сам, нужны в списке таблиц уже сейчас
+    session.flush()
+    notify_invalidations(session.connection(), session.info.get('changed_tables'))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_tables(session):
+    changed = session.info.pop('changed_tables', None)
+    if changed:
+        query_cache.invalidate(*changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+def listen_for_invalidations(engine, channel=NOTIFY_CHANNEL, poll_interval=5.0):
+    """
+    Фоновое прослушивание PostgreSQL NOTIFY на канале channel.
+    Полезная нагрузка уведомления - имя таблицы (или '*' для полной очистки),
+    например: NOTIFY library_cache, 'loans';
+    """
+    import select
+
+    stop_event = threading.Event()
+
+    def listen():
+        connection = engine.raw_connection()
+        try:
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"LISTEN {channel}")
+            while not stop_event.is_set():
+                if select.select([dbapi_connection], [], [], poll_interval) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    payload = notify.payload.strip() or ALL_TABLES
+                    query_cache.invalidate(*payload.split(','))
+        except Exception as e:
+            print(f"Ошибка при прослушивании уведомлений кэша: {e}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=listen, daemon=True)
+    thread.start()
+    return stop_event
@@ -0,0 +1,257 @@
+import operator
+import sys
+from array import array
+from itertools import compress, repeat
+
+
+# Колонка с не более чем MAX_CATEGORIES различными значениями хранится
+# как байтовые коды + список значений (статусы, флаги, должности)
+MAX_CATEGORIES = 255
+
+_OPERATORS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+_NOT_TABLE = bytes([1, 0]) + bytes(254)
+
+
+def mask_and(*masks):
+    """Поэлементное И масок одинаковой длины"""
+    result = int.from_bytes(masks[0], 'big')
+    for mask in masks[1:]:
+        result &= int.from_bytes(mask, 'big')
+    return result.to_bytes(len(masks[0]), 'big')
+
+
+def mask_or(*masks):
+    """Поэлементное ИЛИ масок одинаковой длины"""
+    result = int.from_bytes(masks[0], 'big')
+    for mask in masks[1:]:
+        result |= int.from_bytes(mask, 'big')
+    return result.to_bytes(len(masks[0]), 'big')
+
+
+def mask_not(mask):
+    return mask.translate(_NOT_TABLE)
+
+
+class _Column:
+    """
+    Значения одной колонки: array('q') для целых, байтовые коды + категории
+    для колонок с малым числом значений, иначе список с общими объектами
+    для одинаковых значений (строки интернируются)
+    """
+
+    __slots__ = ('values', 'codes', 'categories', 'lowered')
+
+    def __init__(self, values):
+        self.codes = None
+        self.categories = None
+        self.lowered = None
+
+        distinct = {}
+        for value in values:
+            if value not in distinct:
+                if len(distinct) > MAX_CATEGORIES:
+                    break
+                distinct[value] = len(distinct)
+
+        if len(distinct) <= MAX_CATEGORIES and len(distinct) * 2 <= max(len(values), 2):
+            self.categories = list(distinct)
+            self.codes = bytearray(map(distinct.__getitem__, values))
+            self.values = None
+        elif values and all(type(value) is int for value in values):
+            self.values = array('q', values)
+        else:
+            shared = {}
+            self.values = [
+                sys.intern(value) if type(value) is str else shared.setdefault(value, value)
+                for value in values
+            ]
+
+    def __len__(self):
+        return len(self.codes) if self.codes is not None else len(self.values)
+
+    def get(self, position):
+        if self.codes is not None:
+            return self.categories[self.codes[position]]
+        return self.values[position]
+
+    def lowered_text(self):
+        """Значения в нижнем регистре для поиска подстроки (None - пустая строка)"""
+        if self.lowered is None:
+            source = self.categories if self.codes is not None else self.values
+            cache = {None: ""}
+            self.lowered = [
+                cache[value] if value in cache else cache.setdefault(value, str(value).lower())
+                for value in source
+            ]
+        return self.lowered
+
+
+class Row:
+    """Строка хранилища: доступ к значениям по имени колонки, как у словаря"""
+
+    __slots__ = ('_store', '_position')
+
+    def __init__(self, store, position):
+        self._store = store
+        self._position = position
+
+    def __getitem__(self, name):
+        return self._store._columns[name].get(self._position)
+
+    def get(self, name, default=None):
+        column = self._store._columns.get(name)
+        return default if column is None else column.get(self._position)
+
+    def keys(self):
+        return list(self._store._columns)
+
+    def to_dict(self):
+        return {name: column.get(self._position) for name, column in self._store._columns.items()}
+
+    def __repr__(self):
+        return f"Row({self.to_dict()!r})"
+
+
+class RowStore:
+    """
+    Колоночное хранилище строк для кэшей вкладок интерфейса.
+    Строки добавляются словарями через append(), после compact() хранятся
+    по колонкам. names - имена колонок, чтобы они были известны и у пустого
+    хранилища (иначе берутся из первой строки). Фильтры строятся как байтовые маски по колонкам
+    (mask, search, mask_and/mask_or/mask_not), where() возвращает
+    представление с выбранными строками без копирования колонок
+    """
+
+    __slots__ = ('_pending', '_columns', '_index')
+
+    def __init__(self, columns=None, index=None, names=()):
+        self._pending = {name: [] for name in names}
+        self._columns = columns
+        self._index = index
+
+    @classmethod
+    def from_rows(cls, rows, names=()):
+        store = cls(names=names)
+        for row in rows:
+            store.append(row)
+        return store.compact()
+
+    def append(self, row):
+        if self._columns is not None:
+            raise RuntimeError("Хранилище уже упаковано, добавление строк невозможно")
+        pending = self._pending
+        if not pending:
+            for name in row:
+                pending[name] = []
+        for name, values in pending.items():
+            values.append(row[name])
+
+    def compact(self):
+        """Перевод накопленных строк в колоночное представление"""
+        if self._columns is None:
+            self._columns = {name: _Column(values) for name, values in self._pending.items()}
+            self._pending = None
+        return self
+
+    def _positions(self):
+        if self._index is not None:
+            return self._index
+        return range(len(next(iter(self._columns.values()))) if self._columns else 0)
+
+    def __len__(self):
+        return len(self._positions())
+
+    def __iter__(self):
+        for position in self._positions():
+            yield Row(self, position)
+
+    def __getitem__(self, item):
+        return Row(self, self._positions()[item])
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def column(self, name):
+        """Значения колонки для строк представления"""
+        if not self._columns:
+            # Пустое хранилище без заданных имен колонок
+            return []
+        return list(map(self._columns[name].get, self._positions()))
+
+    def _codes(self, column):
+        if self._index is None:
+            return bytes(column.codes)
+        return bytes(map(column.codes.__getitem__, self._index))
+
+    def _values(self, column):
+        if self._index is None:
+            return column.values
+        return list(map(column.values.__getitem__, self._index))
+
+    def mask(self, name, op, value):
+        """
+        Маска строк, для которых «колонка op value» истинно.
+        op - '==', '!=', '<', '<=', '>', '>=' или 'in' (value - набор значений).
+        Строки с None в сравнениях порядка в маску не попадают
+        """
+        if not len(self):
+            return b''
+        column = self._columns[name]
+        if op == 'in':
+            test = value.__contains__
+        else:
+            compare = _OPERATORS[op]
+            if op in ('==', '!='):
+                test = lambda item: compare(item, value)
+            else:
+                test = lambda item: item is not None and compare(item, value)
+
+        if column.codes is not None:
+            # Условие проверяется один раз на категорию, затем коды переводятся таблицей
+            table = bytes(1 if test(category) else 0 for category in column.categories)
+            return self._codes(column).translate(table.ljust(256, b'\0'))
+        if type(column.values) is array and op in _OPERATORS:
+            return bytes(map(_OPERATORS[op], self._values(column), repeat(value)))
+        return bytes(map(test, self._values(column)))
+
+    def search(self, term, *names):
+        """Маска строк, где term (в нижнем регистре) входит в одну из колонок names"""
+        if not len(self):
+            return b''
+        masks = []
+        for name in names:
+            column = self._columns[name]
+            lowered = column.lowered_text()
+            if column.codes is not None:
+                table = bytes(1 if term in text else 0 for text in lowered)
+                masks.append(self._codes(column).translate(table.ljust(256, b'\0')))
+            else:
+                if self._index is not None:
+                    lowered = map(lowered.__getitem__, self._index)
+                masks.append(bytes(term in text for text in lowered))
+        return mask_or(*masks) if masks else bytes(len(self))
+
+    def where(self, mask):
+        """Представление со строками, отмеченными в маске"""
+        return RowStore(self._columns, array('I', compress(self._positions(), mask)))
+
+    def take(self, positions):
+        """Представление со строками с номерами positions (номера в этом представлении)"""
+        if self._index is None:
+            return RowStore(self._columns, array('I', positions))
+        return RowStore(self._columns, array('I', map(self._index.__getitem__, positions)))
+
+
+if __name__ == "__main__":
+    rows = RowStore.from_rows(
+        {'id': i, 'status': 'available' if i % 3 else 'borrowed', 'title': f"Книга {i}", 'copies': i % 4}
+        for i in range(1, 11)
+    )
+    borrowed = rows.where(rows.mask('status', '==', 'borrowed'))
+    print([row['id'] for row in borrowed])
+    print([row['id'] for row in rows.where(mask_and(rows.mask('copies', '>', 1), rows.search('книга 1', 'title')))])
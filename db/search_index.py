@@ -0,0 +1,177 @@
+from array import array
+from itertools import accumulate
+
+
+def _column(rows, name):
+    if hasattr(rows, 'column'):
+        return rows.column(name)
+    return [row[name] for row in rows]
+
+
+class SearchIndex:
+    """
+    Индекс подстрочного поиска по строкам таблицы интерфейса.
+    Индексируются различные значения полей в нижнем регистре: для каждой
+    n-граммы хранится список значений, для каждого поля - номера строк
+    с каждым значением (массивы смещений и номеров строк, без объектов
+    на строку). Строки поиска короче n проверяются по списку различных
+    значений. refresh() сравнивает колонки новых строк с прежними:
+    неизменившиеся поля не перестраиваются, n-граммы разбираются только
+    для новых значений
+    """
+
+    def __init__(self, fields, n=3):
+        self.fields = tuple(fields)
+        self.n = n
+
+        self._value_ids = {}
+        self._values = []
+        self._grams = {}
+        self._dead = 0
+
+        # Для каждого поля: {исходное значение: id значения} и (смещения, номера строк) по id значения
+        self._raw_ids = {field: {} for field in self.fields}
+        self._postings = {}
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _value_id(self, text):
+        value_id = self._value_ids.get(text)
+        if value_id is None:
+            value_id = self._value_ids[text] = len(self._values)
+            self._values.append(text)
+            grams = self._grams
+            n = self.n
+            for gram in {text[i:i + n] for i in range(len(text) - n + 1)}:
+                postings = grams.get(gram)
+                if postings is None:
+                    postings = grams[gram] = array('I')
+                postings.append(value_id)
+        return value_id
+
+    def _build(self, field, values):
+        # id значения для каждой строки (-1 - пустое значение); одинаковые значения
+        # в кэшах вкладок - общие объекты, нижний регистр считается один раз на значение
+        old_ids = self._raw_ids[field]
+        raw_ids = {}
+        ids = array('i')
+        for value in values:
+            value_id = raw_ids.get(value)
+            if value_id is None:
+                value_id = old_ids.get(value)
+                if value_id is None:
+                    text = "" if value is None else value.lower() if type(value) is str else str(value).lower()
+                    value_id = self._value_id(text) if text else -1
+                raw_ids[value] = value_id
+            ids.append(value_id)
+        self._raw_ids[field] = raw_ids
+
+        # Номера строк, упорядоченные по id значения (внутри значения - по возрастанию)
+        counts = [0] * (len(self._values) + 1)
+        for value_id in ids:
+            counts[value_id + 1] += 1
+        offsets = array('I', accumulate(counts[1:], initial=0))
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        # Строки с пустым значением (-1) идут первыми и в индекс не попадают
+        return offsets, array('I', order[counts[0]:])
+
+    def refresh(self, rows):
+        """
+        Привязка индекса к новым строкам (RowStore или список словарей).
+        Поле перестраивается, только если его колонка отличается от прежней
+        """
+        if self._dead > len(self._value_ids):
+            # Удаленных значений больше живых - индекс строится заново
+            self.__init__(self.fields, self.n)
+
+        old_rows = self._rows
+        # Тот же объект мог измениться на месте - сравнивать не с чем
+        comparable = rows is not old_rows and len(rows) == len(old_rows)
+        rebuilt = False
+        for field in self.fields:
+            values = _column(rows, field)
+            if field in self._postings and comparable and values == _column(old_rows, field):
+                continue
+            self._postings[field] = self._build(field, values)
+            rebuilt = True
+
+        self._rows = rows
+        if rebuilt:
+            self._release()
+        return self
+
+    def _release(self):
+        # Значения без строк остаются в списках n-грамм, но при поиске пропускаются
+        used = bytearray(len(self._values))
+        for offsets, _ in self._postings.values():
+            for value_id in range(len(offsets) - 1):
+                if offsets[value_id + 1] != offsets[value_id]:
+                    used[value_id] = 1
+        values = self._values
+        for value_id, text in enumerate(values):
+            if text is not None and not used[value_id]:
+                del self._value_ids[text]
+                values[value_id] = None
+                self._dead += 1
+
+    def _matching_values(self, term):
+        values = self._values
+        if len(term) < self.n:
+            # Короткая строка поиска - проход по различным значениям
+            return [value_id for value_id, text in enumerate(values) if text is not None and term in text]
+        if len(term) == self.n:
+            # Строка поиска сама является n-граммой - проверка подстроки не нужна
+            return [value_id for value_id in self._grams.get(term, ()) if values[value_id] is not None]
+
+        postings = []
+        for i in range(len(term) - self.n + 1):
+            gram_postings = self._grams.get(term[i:i + self.n])
+            if gram_postings is None:
+                return []
+            postings.append(gram_postings)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for gram_postings in postings[1:3]:
+            candidates.intersection_update(gram_postings)
+            if not candidates:
+                return []
+        return [value_id for value_id in candidates if values[value_id] is not None and term in values[value_id]]
+
+    def positions(self, term):
+        """Номера строк (по возрастанию), в полях которых встречается term"""
+        term = term.lower()
+        if not term:
+            return list(range(len(self._rows)))
+        value_ids = self._matching_values(term)
+        found = set()
+        for offsets, positions in self._postings.values():
+            # Значения, появившиеся после построения поля, в нем не встречаются
+            limit = len(offsets) - 1
+            for value_id in value_ids:
+                if value_id < limit:
+                    found.update(positions[offsets[value_id]:offsets[value_id + 1]])
+        return sorted(found)
+
+    def filter(self, term):
+        """Строки, в полях которых встречается term, в исходном порядке"""
+        positions = self.positions(term)
+        rows = self._rows
+        if hasattr(rows, 'take'):
+            return rows.take(positions)
+        return [rows[position] for position in positions]
+
+
+if __name__ == "__main__":
+    rows = [
+        {'id': 1, 'title': "Война и мир", 'author': "Толстой"},
+        {'id': 2, 'title': "Мир за стеной", 'author': None},
+        {'id': 3, 'title': "Анна Каренина", 'author': "Толстой"},
+    ]
+    index = SearchIndex(('title', 'author')).refresh(rows)
+    print([row['id'] for row in index.filter("мир")], [row['id'] for row in index.filter("толст")])
+    rows[1] = {'id': 2, 'title': "Стена", 'author': None}
+    index.refresh(rows[1:])
+    print([row['id'] for row in index.filter("мир")], [row['id'] for row in index.filter("стен")])
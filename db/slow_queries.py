@@ -0,0 +1,272 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .instrumentation import statement_shape
+
+
+DEFAULT_LOG_PATH = os.path.join('logs', 'slow_queries.log')
+DEFAULT_THRESHOLD_MS = 200
+
+# Модули, которые не считаются источником запроса при поиске вызывающей функции
+_INTERNAL_MODULES = ('sqlalchemy', 'db.slow_queries', 'db.instrumentation', 'db.metrics',
+                     'db.query_cache', 'contextlib', 'functools')
+
+# Блокирующие SELECT: EXPLAIN ANALYZE повторно взял бы блокировки строк
+_LOCKING_CLAUSE = re.compile(r'\bFOR\s+(?:NO\s+KEY\s+)?(?:KEY\s+)?(?:UPDATE|SHARE)\b', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+class SlowQueryLog:
+    """
+    Запись запросов дольше threshold_ms в ротируемый файл (JSON по строке на запрос).
+    Строковые параметры (email, телефоны, хэши паролей) пишутся только типом и длиной.
+    Для доли explain_sample медленных SELECT дополнительно сохраняется
+    план EXPLAIN (ANALYZE, BUFFERS) (только PostgreSQL)
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH, threshold_ms=DEFAULT_THRESHOLD_MS, explain_sample=0.0,
+                 max_bytes=5 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.explain_sample = explain_sample
+        self.recorded = 0
+
+        self._writer = logging.getLogger(f"{__name__}.file")
+        self._writer.propagate = False
+        self._writer.setLevel(logging.INFO)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self._writer.addHandler(self._handler)
+
+    def start(self):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def stop(self):
+        event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._writer.removeHandler(self._handler)
+        self._handler.close()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['slow_query_started'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('slow_query_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold:
+            return
+
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(elapsed * 1000, 3),
+            'function': _calling_function(),
+            'statement': statement,
+            'parameters': _jsonable(parameters),
+            'executemany': executemany,
+        }
+        if (self.explain_sample and conn.dialect.name == 'postgresql' and not executemany
+                and statement.lstrip()[:6].upper() == 'SELECT'
+                and not _LOCKING_CLAUSE.search(statement)
+                and random.random() < self.explain_sample):
+            record['plan'] = _explain(cursor, statement, parameters)
+
+        self.recorded += 1
+        self._writer.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _calling_function():
+    """
+    Функция, выполнившая запрос: публичная функция db_funcs, а если запрос
+    пришел не из нее - ближайший кадр вне SQLAlchemy и служебных модулей
+    """
+    frame = sys._getframe(2)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        name = frame.f_code.co_name
+        if module == 'db.db_funcs' and not name.startswith('_') and name != 'wrapper':
+            return f"db_funcs.{name}"
+        if fallback is None and not module.startswith(_INTERNAL_MODULES):
+            fallback = f"{module}.{getattr(frame.f_code, 'co_qualname', name)}"
+        frame = frame.f_back
+    return fallback
+
+
+def _jsonable(parameters, limit=50):
+    """
+    Параметры запроса для журнала. Значения строк не записываются - в них бывают
+    персональные данные и хэши паролей; числа, даты и флаги остаются для воспроизведения
+    """
+    if isinstance(parameters, (list, tuple)):
+        items = [_jsonable(item, limit) for item in parameters[:limit]]
+        if len(parameters) > limit:
+            items.append(f"... еще {len(parameters) - limit}")
+        return items
+    if isinstance(parameters, dict):
+        return {key: _jsonable(value, limit) for key, value in parameters.items()}
+    if parameters is None or isinstance(parameters, (int, float, bool)):
+        return parameters
+    if isinstance(parameters, (date, datetime)):
+        return parameters.isoformat()
+    if isinstance(parameters, Decimal):
+        return str(parameters)
+    if isinstance(parameters, (str, bytes, bytearray, memoryview)):
+        return f"<{type(parameters).__name__}:{len(parameters)}>"
+    return f"<{type(parameters).__name__}>"
+
+
+def _explain(cursor, statement, parameters):
+    """
+    EXPLAIN ANALYZE выполняет запрос повторно, поэтому используется только для SELECT
+    без FOR UPDATE/SHARE на том же соединении DBAPI (мимо событий SQLAlchemy).
+    В транзакции вызывающего кода план снимается внутри точки сохранения, откат
+    к которой отменяет последствия запроса, а ошибка EXPLAIN не прерывает транзакцию
+    """
+    try:
+        explain_cursor = cursor.connection.cursor()
+        savepoint = not getattr(cursor.connection, 'autocommit', False)
+        try:
+            if savepoint:
+                explain_cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                explain_cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                return "\n".join(row[0] for row in explain_cursor.fetchall())
+            finally:
+                if savepoint:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                    explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        finally:
+            explain_cursor.close()
+    except Exception as e:
+        logger.warning("Не удалось получить план запроса: %s", e)
+        return None
+
+
+_active_log = None
+
+
+def enable_slow_query_log(path=None, threshold_ms=None, explain_sample=None):
+    """
+    Включение записи медленных запросов для всех движков процесса.
+    Значения по умолчанию берутся из LIBRARY_SLOW_QUERY_LOG, LIBRARY_SLOW_QUERY_MS
+    и LIBRARY_SLOW_QUERY_EXPLAIN
+    """
+    global _active_log
+    disable_slow_query_log()
+    _active_log = SlowQueryLog(
+        path or os.environ.get('LIBRARY_SLOW_QUERY_LOG', DEFAULT_LOG_PATH),
+        threshold_ms if threshold_ms is not None else float(os.environ.get('LIBRARY_SLOW_QUERY_MS', DEFAULT_THRESHOLD_MS)),
+        explain_sample if explain_sample is not None else float(os.environ.get('LIBRARY_SLOW_QUERY_EXPLAIN', 0)),
+    )
+    _active_log.start()
+    return _active_log
+
+
+def disable_slow_query_log():
+    global _active_log
+    if _active_log is not None:
+        _active_log.stop()
+        _active_log = None
+
+
+def read_records(path):
+    """Чтение записей из файла и его ротированных копий (от старых к новым)"""
+    paths = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        paths.append(f"{path}.{index}")
+        index += 1
+    paths.reverse()
+    if os.path.exists(path):
+        paths.append(path)
+
+    for file_path in paths:
+        with open(file_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def aggregate(records):
+    """Группировка медленных запросов по форме запроса"""
+    groups = {}
+    for record in records:
+        shape = statement_shape(record['statement'])
+        group = groups.get(shape)
+        if group is None:
+            group = groups[shape] = {
+                'shape': shape, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'functions': {}, 'plan': None, 'slowest': None,
+            }
+        duration = record['duration_ms']
+        group['count'] += 1
+        group['total_ms'] += duration
+        function = record.get('function') or '?'
+        group['functions'][function] = group['functions'].get(function, 0) + 1
+        if duration >= group['max_ms']:
+            group['max_ms'] = duration
+            group['slowest'] = record
+        if record.get('plan'):
+            group['plan'] = record['plan']
+
+    for group in groups.values():
+        group['mean_ms'] = group['total_ms'] / group['count']
+    return list(groups.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Просмотр журнала медленных запросов")
+    parser.add_argument('path', nargs='?', default=DEFAULT_LOG_PATH)
+    parser.add_argument('--sort', choices=['total', 'count', 'max', 'mean'], default='total')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--plans', action='store_true', help="показывать сохраненные планы EXPLAIN")
+    args = parser.parse_args(argv)
+
+    groups = aggregate(read_records(args.path))
+    if not groups:
+        print(f"В {args.path} нет записей")
+        return 0
+
+    sort_key = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms', 'mean': 'mean_ms'}[args.sort]
+    groups.sort(key=lambda group: group[sort_key], reverse=True)
+    for group in groups[:args.top]:
+        functions = ', '.join(f"{name} ({count})" for name, count in
+                              sorted(group['functions'].items(), key=lambda item: -item[1]))
+        print(f"{group['count']:6d} раз  всего {group['total_ms']:10.1f} мс  "
+              f"среднее {group['mean_ms']:8.1f} мс  макс {group['max_ms']:8.1f} мс")
+        print(f"  {group['shape'][:300]}")
+        print(f"  функции: {functions}")
+        print(f"  параметры самого медленного: {json.dumps(group['slowest'].get('parameters'), ensure_ascii=False)}")
+        if args.plans and group['plan']:
+            for line in group['plan'].splitlines():
+                print(f"    {line}")
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from datetime import date, datetime
+
+from sqlalchemy import select, func, text
+
+from .models import Book, BookCopy, Genre, Reader, Loan, genres_books
+from .row_store import RowStore
+from . import db_funcs, views
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_FILE = 'catalog_snapshot.sqlite3'
+
+
+def _user_data_dir():
+    # Каталог данных приложения в профиле пользователя, а не рабочий каталог запуска
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Application Support')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'library_app')
+
+
+# Путь к снимку можно переопределить переменной окружения LIBRARY_SNAPSHOT_FILE
+DEFAULT_SNAPSHOT_PATH = (
+    os.environ.get('LIBRARY_SNAPSHOT_FILE') or os.path.join(_user_data_dir(), DEFAULT_SNAPSHOT_FILE)
+)
+
+# Колонки, которые не записываются в файл снимка (персональные данные читателей).
+# При чтении снимка в них стоит заглушка, значения загружаются из БД (restore_private_columns)
+PRIVATE_COLUMNS = {
+    'copies': {'reader': "…"},
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    dataset TEXT PRIMARY KEY,
+    columns TEXT NOT NULL,
+    row_order TEXT NOT NULL,
+    stamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    dataset TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (dataset, id)
+);
+"""
+
+# Таблицы, от которых зависят строки набора (views.book_rows / views.copy_rows)
+SOURCE_TABLES = {
+    'books': (Book.__table__, BookCopy.__table__, Genre.__table__, genres_books),
+    'copies': (BookCopy.__table__, Book.__table__, Loan.__table__, Reader.__table__),
+}
+
+# Таблицы набора с отслеживанием изменений (db_funcs.get_changes_since): по ним
+# снимок догоняется построчно. Изменение остальных таблиц SOURCE_TABLES сверяется
+# по change_stamp и ведет к полной загрузке набора. Читатели в снимок не пишутся
+# (PRIVATE_COLUMNS) и загружаются заново при каждой сверке
+TRACKED_TABLES = {
+    'books': ('books', 'copies'),
+    'copies': ('copies', 'books', 'loans'),
+}
+UNTRACKED_TABLES = {
+    'books': (Genre.__table__, genres_books),
+    'copies': (),
+}
+
+# Порядок строк набора, как в views.book_rows / views.copy_rows
+ROW_ORDER = {'books': 'title', 'copies': 'inventory_number'}
+
+# При большем числе затронутых строк набор дешевле загрузить целиком
+SYNC_MAX_ROWS = 1000
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def restore_private_columns(session, dataset, rows):
+    """Строки снимка с загруженными из БД значениями колонок PRIVATE_COLUMNS"""
+    if dataset != 'copies' or not len(rows):
+        return rows
+    readers = views.copy_readers(session)
+    restored = RowStore(names=rows.columns)
+    for row in rows:
+        record = row.to_dict()
+        # Как в views.copy_rows: читатель показывается только у экземпляров не в наличии
+        record['reader'] = "-" if record['status'] == "В наличии" else readers.get(record['id']) or "-"
+        restored.append(record)
+    return restored.compact()
+
+
+def change_stamp(session, dataset, tables=None):
+    """
+    Отметка состояния таблиц набора одним запросом: число строк, наибольший id
+    и последнее изменение (updated_at у таблиц с отслеживанием изменений),
+    на PostgreSQL еще счетчик вставок/изменений/удалений из pg_stat_user_tables
+    (для таблиц без updated_at). Отметка изменилась - изменились данные набора.
+    tables - только эти таблицы; по умолчанию все SOURCE_TABLES набора
+    """
+    tables = SOURCE_TABLES[dataset] if tables is None else tables
+    if not tables:
+        return {}
+    columns = {}
+    for table in tables:
+        columns[table.name] = [select(func.count()).select_from(table).scalar_subquery()]
+        for name in ('id', 'updated_at'):
+            if name in table.c:
+                columns[table.name].append(select(func.max(table.c[name])).scalar_subquery())
+    values = iter(session.execute(select(*(column for group in columns.values() for column in group))).one())
+
+    stamp = {}
+    for name, group in columns.items():
+        # Отметка хранится в JSON и сравнивается с прочитанной из файла
+        stamp[name] = [_json_value(next(values)) for _ in group]
+    if session.get_bind().dialect.name == 'postgresql':
+        statement = text(
+            "SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables WHERE relname = ANY(:names)"
+        )
+        for name, changes in session.execute(statement, {'names': list(stamp)}):
+            stamp[name].append(changes)
+    return stamp
+
+
+def snapshot_stamp(session, dataset, today=None):
+    """
+    Отметка строк набора для снимка: отметка изменений для get_changes_since,
+    дата (от нее зависят просрочки) и change_stamp таблиц без отслеживания изменений.
+    Берется до чтения строк
+    """
+    return {
+        'token': db_funcs.get_change_token(session),
+        'date': (today or date.today()).isoformat(),
+        'tables': change_stamp(session, dataset, UNTRACKED_TABLES[dataset]),
+    }
+
+
+def _affected_rows(session, dataset, rows, changes, overdue_changed):
+    """(id строк для пересборки, id удаленных строк) или None, если изменения не отнести к строкам"""
+    if dataset == 'books':
+        # Удаленный экземпляр не связать с книгой - пересчитать экземпляры нечем
+        if changes['copies']['deleted']:
+            return None
+        affected = {book.id for book in changes['books']['changed']}
+        affected.update(copy.book_id for copy in changes['copies']['changed'])
+        return affected, set(changes['books']['deleted'])
+
+    if changes['loans']['deleted'] or changes['books']['deleted']:
+        return None
+    affected = {copy.id for copy in changes['copies']['changed']}
+    affected.update(loan.copy_id for loan in changes['loans']['changed'])
+    book_ids = [book.id for book in changes['books']['changed']]
+    if len(book_ids) > SYNC_MAX_ROWS:
+        return None
+    if book_ids:
+        affected.update(session.scalars(select(BookCopy.id).where(BookCopy.book_id.in_(book_ids))))
+    if overdue_changed and len(rows):
+        # С новым днем выданные экземпляры могут стать просроченными
+        affected.update(rows.where(rows.mask('status', '==', "На руках")).column('id'))
+    return affected, set(changes['copies']['deleted'])
+
+
+def sync_rows(session, dataset, rows, stamp, today=None):
+    """
+    Догоняет строки снимка до состояния БД по изменениям после stamp['token']:
+    пересобираются только затронутые строки, удаленные убираются.
+    Возвращает (строки, новая отметка) или None, если набор нужно загрузить целиком
+    (отметка старого формата, изменились таблицы без отслеживания, удаления,
+    которые нельзя отнести к строкам, слишком много изменений)
+    """
+    today = today or date.today()
+    if not isinstance(stamp, dict) or not stamp.get('token'):
+        return None
+    current = snapshot_stamp(session, dataset, today)
+    if current['token'] is None or current['tables'] != stamp.get('tables'):
+        return None
+
+    changes = {}
+    for table in TRACKED_TABLES[dataset]:
+        result = db_funcs.get_changes_since(session, table, stamp['token'])
+        if result is None or result['full']:
+            return None
+        changes[table] = result
+
+    affected = _affected_rows(session, dataset, rows, changes, stamp.get('date') != current['date'])
+    if affected is None:
+        return None
+    affected, deleted = affected
+    # id удаленной строки может получить новая (SQLite без AUTOINCREMENT): такие строки
+    # перечитываются, и строка остается, только если она есть в базе
+    deleted -= affected
+    if len(affected) > SYNC_MAX_ROWS:
+        return None
+    if not affected and deleted.isdisjoint(rows.column('id')):
+        return rows, current
+
+    ids = sorted(affected)
+    if dataset == 'books':
+        fresh = views.book_rows(session, book_ids=ids)
+    else:
+        fresh = views.copy_rows(session, today, copy_ids=ids)
+    fresh = {row['id']: row.to_dict() for row in fresh}
+
+    records = []
+    for row in rows:
+        row_id = row['id']
+        if row_id in deleted:
+            continue
+        if row_id in affected:
+            # Строки нет в ответе - ее удалили после сборки списка изменений
+            if row_id in fresh:
+                records.append(fresh.pop(row_id))
+            continue
+        records.append(row.to_dict())
+    records.extend(fresh.values())
+    if affected:
+        key = ROW_ORDER[dataset]
+        records.sort(key=lambda record: record[key] or "")
+
+    synced = RowStore(names=rows.columns)
+    for record in records:
+        synced.append(record)
+    logger.debug("Снимок %s: обновлено строк %s, удалено %s", dataset, len(affected), len(deleted))
+    return synced.compact(), current
+
+
+class CatalogSnapshot:
+    """
+    Локальный снимок строк вкладок каталога (файл SQLite) для быстрого запуска:
+    строки показываются из снимка сразу, затем догоняются до базы по изменениям
+    после отметки snapshot_stamp() (sync_rows). Строки хранятся по одной, поэтому save() записывает только
+    изменившиеся. Файл лежит в каталоге данных пользователя и доступен только ему,
+    колонки PRIVATE_COLUMNS в него не пишутся. path=None - снимок отключен
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH):
+        self.path = path
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.executescript(_SCHEMA)
+        return connection
+
+    def _create(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        connection = self._connect()
+        os.chmod(self.path, 0o600)
+        return connection
+
+    def load(self, dataset):
+        """
+        (строки RowStore, отметка) из снимка или (None, None), если снимка нет
+        или он поврежден. В колонках PRIVATE_COLUMNS - заглушки
+        """
+        if not self.path or not os.path.exists(self.path):
+            return None, None
+        try:
+            with closing(self._connect()) as connection:
+                meta = connection.execute(
+                    "SELECT columns, row_order, stamp FROM meta WHERE dataset = ?", (dataset,)
+                ).fetchone()
+                if meta is None:
+                    return None, None
+                data = dict(connection.execute("SELECT id, data FROM rows WHERE dataset = ?", (dataset,)))
+            columns = json.loads(meta[0])
+            private = PRIVATE_COLUMNS.get(dataset, {})
+            rows = RowStore(names=list(columns) + list(private))
+            for row_id in json.loads(meta[1]):
+                record = dict(zip(columns, json.loads(data[row_id])))
+                record.update(private)
+                rows.append(record)
+            return rows.compact(), json.loads(meta[2])
+        except (sqlite3.Error, ValueError, KeyError) as e:
+            logger.warning("Снимок каталога '%s' не прочитан: %s", self.path, e)
+            return None, None
+
+    def save(self, dataset, rows, stamp):
+        """Запись строк набора с отметкой. Возвращает число записанных и удаленных строк"""
+        if not self.path:
+            return 0
+        private = PRIVATE_COLUMNS.get(dataset, {})
+        columns = None
+        records = {}
+        order = []
+        for row in rows:
+            if columns is None:
+                columns = [name for name in row.keys() if name not in private]
+            records[row['id']] = json.dumps([row[name] for name in columns], ensure_ascii=False, default=str)
+            order.append(row['id'])
+
+        try:
+            with closing(self._create()) as connection, connection:
+                old = dict(connection.execute("SELECT id, data FROM rows WHERE dataset = ?", (dataset,)))
+                changed = [(dataset, row_id, data) for row_id, data in records.items() if old.get(row_id) != data]
+                removed = [(dataset, row_id) for row_id in old if row_id not in records]
+                connection.executemany("INSERT OR REPLACE INTO rows (dataset, id, data) VALUES (?, ?, ?)", changed)
+                connection.executemany("DELETE FROM rows WHERE dataset = ? AND id = ?", removed)
+                connection.execute(
+                    "INSERT OR REPLACE INTO meta (dataset, columns, row_order, stamp) VALUES (?, ?, ?, ?)",
+                    (dataset, json.dumps(columns or []), json.dumps(order), json.dumps(stamp))
+                )
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Снимок каталога '%s' не сохранен: %s", self.path, e)
+            return 0
+        logger.debug("Снимок '%s': записано строк %s, удалено %s", dataset, len(changed), len(removed))
+        return len(changed) + len(removed)
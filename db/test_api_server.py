@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+
+from db.api_server import MAX_BODY_BYTES, CatalogApi
+
+
+class FakeWriter:
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def api():
+    api = CatalogApi(create_engine('sqlite://'), workers=2)
+    yield api
+    api.close()
+
+
+def _serve(api, request, body_bytes=b''):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(request + body_bytes)
+        reader.feed_eof()
+        writer = FakeWriter()
+        await api.serve_connection(reader, writer)
+        return reader, writer
+    return asyncio.run(run())
+
+
+def test_large_body_is_rejected_without_reading(api):
+    body = b'x' * (MAX_BODY_BYTES + 1)
+    request = f"GET /api/health HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1')
+    reader, writer = _serve(api, request, body)
+    assert writer.data.startswith(b'HTTP/1.1 413 Payload Too Large')
+    assert b'Connection: close' in writer.data and writer.closed
+    # Тело не прочитано - соединение закрыто, а не разобрано как следующий запрос
+    assert len(reader._buffer) == len(body)
+    assert api.stats['requests'] == 0
+
+
+def test_small_body_is_skipped(api):
+    request = b"GET /api/health HTTP/1.1\r\nContent-Length: 2\r\nConnection: close\r\n\r\n"
+    _, writer = _serve(api, request, b'{}')
+    assert writer.data.startswith(b'HTTP/1.1 200 OK')
+
+
+def test_cancelled_waiter_does_not_cancel_shared_read(api):
+    started, release = threading.Event(), threading.Event()
+
+    def read(session):
+        started.set()
+        release.wait(5)
+        return {'value': 1}
+
+    async def run():
+        first = asyncio.ensure_future(api.fetch('key', None, read))
+        second = asyncio.ensure_future(api.fetch('key', None, read))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        _, body = await second
+        assert first.cancelled()
+        return body
+
+    assert asyncio.run(run()) == b'{"value": 1}'
+    assert api.stats['db_calls'] == 1 and api._inflight == {}
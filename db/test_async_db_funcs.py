@@ -0,0 +1,78 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db import async_db_funcs as adb
+from db.db_funcs import UpdateConflict
+from db.models import Base, Book, BookCopy, Loan, Reader
+
+# Асинхронные функции проверяются на SQLite через aiosqlite вместо asyncpg
+pytest.importorskip('aiosqlite')
+
+
+def _run(scenario):
+    """Запуск сценария на отдельной базе; движок закрывается и при упавшей проверке"""
+    async def main():
+        engine = create_async_engine('sqlite+aiosqlite://')
+        try:
+            await scenario(*await _setup(engine))
+        finally:
+            await engine.dispose()
+    asyncio.run(main())
+
+
+async def _setup(engine):
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    async with Session() as session:
+        reader = Reader(name="Читатель", email="reader@lib.ru")
+        book = Book(title="Книга")
+        session.add_all([reader, book])
+        await session.flush()
+        copy = BookCopy(book_id=book.id, inventory_number="INV-1", available=False)
+        session.add(copy)
+        await session.flush()
+        loan = Loan(reader_id=reader.id, copy_id=copy.id, loan_date=date(2026, 1, 10), return_date=date(2026, 1, 24))
+        session.add(loan)
+        await session.commit()
+        return Session, loan.id, copy.id
+
+
+async def _copy_available(session, copy_id):
+    return await session.scalar(select(BookCopy.available).where(BookCopy.id == copy_id))
+
+
+def test_second_return_does_not_release_reissued_copy():
+    async def scenario(Session, loan_id, copy_id):
+        async with Session() as session:
+            returned = await adb.return_loan(session, loan_id, actual_return_date=date(2026, 1, 20))
+            assert returned.returned and returned.actual_return_date == date(2026, 1, 20)
+            assert await _copy_available(session, copy_id) is True
+
+            # Экземпляр снова выдан - повторный возврат старой выдачи не должен его освобождать
+            copy = await session.get(BookCopy, copy_id)
+            copy.available = False
+            await session.commit()
+            assert await adb.return_loan(session, loan_id)
+            assert await _copy_available(session, copy_id) is False
+    _run(scenario)
+
+
+def test_return_bumps_version_and_detects_conflict():
+    async def scenario(Session, loan_id, copy_id):
+        async with Session() as session:
+            version = (await session.get(Loan, loan_id)).version
+            conflict = await adb.return_loan(session, loan_id, expected_version=version - 1)
+            assert isinstance(conflict, UpdateConflict) and not conflict
+            assert (conflict.expected_version, conflict.current_version) == (version - 1, version)
+            assert await session.scalar(select(Loan.returned).where(Loan.id == loan_id)) is False
+            assert await _copy_available(session, copy_id) is False
+
+            returned = await adb.return_loan(session, loan_id, expected_version=version)
+            assert returned.returned and returned.version == version + 1
+            assert await adb.return_loan(session, 999) is None
+    _run(scenario)
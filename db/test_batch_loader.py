@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db.instrumentation import track_queries
+from db.models import Base, Book, Reader
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add_all([Reader(name=f"Читатель {number}", email=f"reader{number}@lib.ru") for number in range(5)])
+        session.add_all([Book(title=f"Книга {number}") for number in range(2)])
+        session.commit()
+        # Объекты из identity map не должны подменять загрузку
+        session.expunge_all()
+        yield session
+
+
+def test_duplicate_ids_are_loaded_once(session):
+    loader = db.BatchLoader(session)
+    for reader_id in (1, 2, 1, None, 2, 3):
+        loader.load(Reader, reader_id)
+    loader.load(Book, 1).load(Book, 1)
+
+    with track_queries('batch', report=False) as stats:
+        assert loader.get(Reader, 1).email == "reader0@lib.ru"
+        assert loader.get(Reader, 3).email == "reader2@lib.ru"
+        assert loader.get(Book, 1).title == "Книга 0"
+    # Один запрос на модель, повторные get() берут уже загруженное
+    assert stats.statements == 2
+
+
+def test_missing_ids_are_remembered(session):
+    loader = db.BatchLoader(session)
+    with track_queries('batch', report=False) as stats:
+        first, missing, again = loader.get_many(Reader, [1, 99, 1])
+        assert first.id == 1 and missing is None and again is first
+        assert loader.get(Reader, 99) is None
+        loader.load(Reader, 99).dispatch()
+    assert stats.statements == 1
+
+
+def test_large_id_lists_are_chunked(session, monkeypatch):
+    monkeypatch.setattr(db, 'BY_IDS_CHUNK_SIZE', 2)
+    loader = db.BatchLoader(session)
+    with track_queries('batch', report=False) as stats:
+        readers = loader.get_many(Reader, [5, 4, 3, 2, 1, 4])
+    assert [reader.id for reader in readers] == [5, 4, 3, 2, 1, 4]
+    assert stats.statements == 3
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, delete, update
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db.models import Base, Reader
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    assert db.install_change_tracking(engine)
+    with sessionmaker(bind=engine)() as session:
+        # Строки записаны давно: триггер вставки не трогает заданный updated_at
+        old = datetime.utcnow() - timedelta(days=2)
+        session.add_all([
+            Reader(name=f"Читатель {number}", email=f"reader{number}@lib.ru", updated_at=old)
+            for number in range(3)
+        ])
+        session.commit()
+        yield session
+
+
+def _since(days):
+    return (datetime.utcnow() - timedelta(days=days)).isoformat()
+
+
+def test_first_call_returns_all_rows(session):
+    changes = db.get_changes_since(session, 'readers')
+    assert changes['full'] and changes['deleted'] == []
+    assert len(changes['changed']) == 3 and changes['token']
+
+
+def test_changed_and_deleted_rows_since_token(session):
+    first, second, third = [reader.id for reader in db.get_changes_since(session, 'readers')['changed']]
+    session.execute(update(Reader).where(Reader.id == first).values(phone_number="123"))
+    session.execute(delete(Reader).where(Reader.id == second))
+    session.commit()
+
+    changes = db.get_changes_since(session, 'readers', _since(1))
+    assert not changes['full']
+    assert [reader.id for reader in changes['changed']] == [first]
+    assert changes['deleted'] == [second]
+
+
+def test_token_older_than_retention_returns_all_rows(session):
+    changes = db.get_changes_since(session, 'readers', _since(db.DELETED_ROWS_RETENTION_DAYS + 1))
+    assert changes['full'] and len(changes['changed']) == 3
+
+
+def test_hidden_postgresql_transactions_move_token_back():
+    now = datetime(2026, 10, 19, 12, 0)
+
+    def session(oldest_visible, hidden):
+        result = SimpleNamespace(one=lambda: (now, oldest_visible, hidden))
+        return SimpleNamespace(get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name='postgresql')),
+                               execute=lambda statement: result)
+
+    assert db._change_token(session(now - timedelta(minutes=1), 0)) == now - timedelta(minutes=1)
+    assert db._change_token(session(now, 2)) == now - db.HIDDEN_TRANSACTIONS_MARGIN
+    # Видимая транзакция старше запаса важнее
+    assert db._change_token(session(now - timedelta(hours=1), 2)) == now - timedelta(hours=1)
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db.instrumentation import (
+    assert_max_queries, assert_no_n_plus_one, statement_shape, track_queries
+)
+from db.models import Base, Reader
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add_all([Reader(name=f"Читатель {number}", email=f"reader{number}@lib.ru") for number in range(5)])
+        session.commit()
+        yield session
+
+
+def _reader_ids(session):
+    return session.scalars(select(Reader.id)).all()
+
+
+def test_statement_shape_ignores_values():
+    assert statement_shape("SELECT * FROM readers WHERE id = 5 AND name = 'Иван'") == \
+        statement_shape("SELECT * FROM readers  WHERE id = :id AND name = ?")
+    assert statement_shape("SELECT 1 WHERE id IN (1, 2, 3)") == statement_shape("SELECT 1 WHERE id IN (?)")
+
+
+def test_repeated_lookup_is_reported(session):
+    ids = _reader_ids(session)
+    with pytest.raises(AssertionError, match="5 раз"):
+        with assert_no_n_plus_one(threshold=3):
+            for reader_id in ids:
+                session.execute(select(Reader).where(Reader.id == reader_id)).scalar_one()
+
+
+def test_batched_lookup_passes(session):
+    ids = _reader_ids(session)
+    with assert_no_n_plus_one(threshold=3) as stats:
+        db.get_readers_by_ids(session, ids)
+    assert stats.statements == 1 and stats.max_repeats == 1
+
+
+def test_repeats_at_threshold_pass(session):
+    ids = _reader_ids(session)[:3]
+    with assert_no_n_plus_one(threshold=3) as stats:
+        for reader_id in ids:
+            session.execute(select(Reader).where(Reader.id == reader_id)).scalar_one()
+    assert stats.max_repeats == 3
+
+
+def test_nested_blocks_count_in_outer(session):
+    with track_queries('outer', report=False) as outer:
+        with assert_max_queries(1) as inner:
+            _reader_ids(session)
+        _reader_ids(session)
+    assert (inner.statements, outer.statements) == (1, 2)
+
+    with pytest.raises(AssertionError):
+        with assert_max_queries(1):
+            _reader_ids(session)
+            _reader_ids(session)
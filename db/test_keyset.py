@@ -0,0 +1,66 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db.models import Base, Librarian, Reader
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        dates = [date(2026, 1, 3), None, date(2026, 1, 1), None, date(2026, 1, 3), None, date(2026, 1, 2)]
+        session.add_all([Reader(name=f"Читатель {number}", email=f"reader{number}@lib.ru")
+                         for number in range(len(dates))])
+        session.add_all([Librarian(name=f"Библиотекарь {number}", email=f"lib{number}@lib.ru", password_hash="-")
+                         for number in range(len(dates))])
+        session.flush()
+        # default=date.today заполняет даты при вставке, NULL ставится отдельным UPDATE
+        for model, column in ((Reader, 'registration_date'), (Librarian, 'hire_date')):
+            for object_id, value in enumerate(dates, start=1):
+                session.execute(update(model).where(model.id == object_id).values({column: value}))
+        session.commit()
+        yield session
+
+
+def _all_pages(get_page, session, order_by, descending, limit):
+    ids, after, pages = [], None, 0
+    while True:
+        items, after = get_page(session, after=after, limit=limit, order_by=order_by, descending=descending)
+        ids += [item.id for item in items]
+        pages += 1
+        if after is None:
+            return ids, pages
+        assert pages < 20
+
+
+def _expected(session, model, column, descending):
+    rows = [(getattr(item, column), item.id) for item in session.query(model)]
+    # NULL - наибольшее значение: последним по возрастанию, первым по убыванию
+    rows.sort(key=lambda row: (row[0] is None, row[0] or date.min, row[1]), reverse=descending)
+    return [object_id for _, object_id in rows]
+
+
+@pytest.mark.parametrize('table, get_page, model, column', [
+    ('readers', db.get_readers_page, Reader, 'registration_date'),
+    ('librarians', db.get_librarians_page, Librarian, 'hire_date'),
+])
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 2, 3, 10])
+def test_pages_include_null_keys(session, table, get_page, model, column, descending, limit):
+    ids, _ = _all_pages(get_page, session, column, descending, limit)
+    expected = _expected(session, model, column, descending)
+    assert ids == expected
+    assert db.get_sorted_ids(session, table, column, descending) == expected
+
+
+def test_cursor_on_null_key_continues(session):
+    # Первая страница по убыванию заканчивается на строке с NULL
+    first, after = db.get_readers_page(session, limit=1, order_by='registration_date', descending=True)
+    assert first[0].registration_date is None and after
+    rest, _ = db.get_readers_page(session, after=after, limit=10, order_by='registration_date', descending=True)
+    assert [reader.id for reader in first + rest] == [6, 4, 2, 5, 1, 7, 3]
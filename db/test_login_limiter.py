@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db import login_limiter as limiter_module
+from db.login_limiter import LoginLimiter, TokenBucket
+from db.models import Base
+from db.password_hasher import DEFAULT_ROUNDS
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db.configure_password_hashing(rounds=4)
+    db.login_limiter.reset()
+    with sessionmaker(bind=engine)() as session:
+        yield session
+    db.configure_password_hashing(rounds=DEFAULT_ROUNDS)
+    db.login_limiter.reset()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время для LoginLimiter (time.monotonic модуля login_limiter)"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(limiter_module, 'time', SimpleNamespace(monotonic=lambda: clock.now, sleep=lambda _: None))
+    return clock
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(capacity=2, refill_rate=0.5, now=0.0)
+    assert bucket.consume(0.0) and bucket.consume(0.0)
+    assert not bucket.consume(1.0)
+    # Через 2 секунды при 0.5 токена в секунду появляется один токен
+    assert bucket.consume(3.0)
+    assert not bucket.is_full(3.0)
+    assert bucket.is_full(100.0) and bucket.tokens == 2
+
+
+def test_email_limit_refills_over_time(clock):
+    limiter = LoginLimiter(email_capacity=2, email_per_minute=1)
+    assert limiter.check("Admin@lib.ru", 'local') is None
+    assert limiter.check("admin@lib.ru", 'local') is None
+    assert limiter.check("admin@lib.ru", 'local') == 'email'
+    clock.now += 60
+    assert limiter.check("admin@lib.ru", 'local') is None
+    assert limiter.stats()['rejected_email'] == 1
+
+
+def test_source_limit_applies_across_emails(clock):
+    limiter = LoginLimiter(source_capacity=2, source_per_minute=1)
+    assert limiter.check("a@lib.ru", 'kiosk') is None
+    assert limiter.check("b@lib.ru", 'kiosk') is None
+    assert limiter.check("c@lib.ru", 'kiosk') == 'source'
+    assert limiter.check("c@lib.ru", 'desk') is None
+
+
+def test_success_restores_email_limit(clock):
+    limiter = LoginLimiter(email_capacity=1)
+    assert limiter.check("admin@lib.ru", 'local') is None
+    assert limiter.check("admin@lib.ru", 'local') == 'email'
+    limiter.record_result("admin@lib.ru", True, 0.1)
+    assert limiter.check("admin@lib.ru", 'local') is None
+
+
+def test_unknown_email_expires_after_ttl(clock):
+    limiter = LoginLimiter(unknown_ttl=60)
+    limiter.record_unknown("Nobody@lib.ru")
+    assert limiter.check("nobody@lib.ru", 'local') == 'unknown'
+    clock.now += 59
+    assert limiter.check("nobody@lib.ru", 'local') == 'unknown'
+    clock.now += 1
+    assert limiter.check("nobody@lib.ru", 'local') is None
+    assert limiter.stats()['unknown_cache_size'] == 0
+
+
+def test_full_tables_drop_idle_entries(clock):
+    limiter = LoginLimiter(email_capacity=1, email_per_minute=60, max_entries=2)
+    for email in ("a@lib.ru", "b@lib.ru"):
+        limiter.check(email, 'local')
+    clock.now += 1
+    # Корзины уже заполнились снова и удаляются при добавлении новой
+    limiter.check("c@lib.ru", 'local')
+    assert limiter.stats()['tracked_emails'] == 1
+
+
+def test_email_case_does_not_lock_out_librarian(session):
+    db.create_librarian(session, "Администратор", "Admin@Lib.ru", "secret")
+    assert db.authenticate_librarian(session, "ADMIN@lib.ru", "secret")
+    assert db.authenticate_librarian(session, "admin@lib.ru", "secret")
+    assert db.get_login_stats()['unknown_cache_size'] == 0
+
+
+def test_unknown_email_is_cached_case_insensitively(session):
+    assert db.authenticate_librarian(session, "Nobody@Lib.ru", "secret") is None
+    assert db.login_limiter.check("nobody@lib.ru", 'local') == 'unknown'
+
+    db.create_librarian(session, "Новый", "nobody@lib.ru", "secret")
+    assert db.authenticate_librarian(session, "NOBODY@lib.ru", "secret")
+
+
+def test_database_error_is_not_cached_as_unknown(session):
+    session.get_bind().dispose()
+    Base.metadata.drop_all(session.get_bind())
+    assert db.authenticate_librarian(session, "admin@lib.ru", "secret") is None
+    assert db.get_login_stats()['unknown_cache_size'] == 0
+
+
+def test_rate_limit_refusal_differs_from_wrong_password(session):
+    db.create_librarian(session, "Администратор", "admin@lib.ru", "secret")
+    for _ in range(db.login_limiter.email_capacity):
+        assert db.authenticate_librarian(session, "admin@lib.ru", "wrong") is None
+    refused = db.authenticate_librarian(session, "admin@lib.ru", "secret")
+    assert isinstance(refused, db.LoginRefused) and not refused
+    assert refused.reason == 'email'
@@ -0,0 +1,51 @@
+import pytest
+
+from db.password_hasher import PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(rounds=4, max_workers=2)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_and_verify(hasher):
+    hashed = hasher.hash("secret")
+    assert hashed.startswith("$2b$04$")
+    assert hasher.verify("secret", hashed)
+    assert not hasher.verify("wrong", hashed)
+    assert not hasher.verify("secret", "не хэш")
+
+
+def test_needs_rehash_after_cost_change(hasher):
+    hashed = hasher.hash("secret")
+    assert not hasher.needs_rehash(hashed)
+    hasher.configure(rounds=5)
+    assert hasher.needs_rehash(hashed)
+    assert not hasher.needs_rehash(hasher.hash("secret"))
+
+
+@pytest.mark.parametrize('hashed', [None, "", "plain", "$2b$xx$salt", "$2b$"])
+def test_needs_rehash_ignores_malformed_hashes(hasher, hashed):
+    assert hasher.needs_rehash(hashed) is False
+
+
+@pytest.mark.parametrize('rounds', [3, 32])
+def test_rounds_out_of_range_are_rejected(hasher, rounds):
+    with pytest.raises(ValueError):
+        hasher.configure(rounds=rounds)
+    assert hasher.rounds == 4
+
+
+def test_rounds_bounds_are_accepted(hasher):
+    hasher.configure(rounds=31)
+    assert hasher.rounds == 31
+    hasher.configure(rounds=4)
+    assert hasher.rounds == 4
+
+
+def test_resized_pool_keeps_working(hasher):
+    hasher.configure(max_workers=1, max_pending=1)
+    futures = [hasher.hash_async("secret") for _ in range(3)]
+    assert all(hasher.verify("secret", future.result()) for future in futures)
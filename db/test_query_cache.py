@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db.models import Base, Reader
+from db.query_cache import cached_query, notify_invalidations, query_cache
+
+
+@pytest.fixture
+def Session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    query_cache.invalidate_all()
+    query_cache.reset_stats()
+    yield sessionmaker(bind=engine)
+    query_cache.invalidate_all()
+
+
+calls = []
+
+
+@cached_query('readers')
+def _count_readers(session):
+    calls.append('count')
+    return session.scalar(select(func.count(Reader.id)))
+
+
+@cached_query('readers')
+def _reader(session, reader_id):
+    calls.append('reader')
+    return session.get(Reader, reader_id)
+
+
+@cached_query('readers')
+def _empty(session, value):
+    calls.append('empty')
+    return value
+
+
+def test_commit_invalidates_dependent_results(Session):
+    calls.clear()
+    with Session() as session:
+        assert _count_readers(session) == 0
+        assert _count_readers(session) == 0
+        assert calls == ['count']
+
+        session.add(Reader(name="Читатель", email="reader@lib.ru"))
+        session.flush()
+        # До коммита кэш не сбрасывается
+        assert _count_readers(session) == 0
+        session.commit()
+        assert _count_readers(session) == 1
+        assert calls == ['count', 'count']
+
+
+def test_rollback_keeps_cached_results(Session):
+    calls.clear()
+    with Session() as session:
+        _count_readers(session)
+        session.add(Reader(name="Читатель", email="reader@lib.ru"))
+        session.flush()
+        session.rollback()
+        assert _count_readers(session) == 0
+        assert calls == ['count']
+
+
+def test_cached_object_is_attached_to_the_calling_session(Session):
+    with Session() as session:
+        reader = Reader(name="Читатель", email="reader@lib.ru")
+        session.add(reader)
+        session.commit()
+        reader_id = reader.id
+
+    calls.clear()
+    with Session() as first:
+        cached = _reader(first, reader_id)
+    with Session() as second:
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(second.get_bind(), 'before_cursor_execute', listener)
+        try:
+            found = _reader(second, reader_id)
+            # merge(load=False) присоединяет снимок без запроса к базе
+            assert found.name == "Читатель" and statements == []
+        finally:
+            event.remove(second.get_bind(), 'before_cursor_execute', listener)
+        assert calls == ['reader']
+        assert found is not cached and found in second
+
+        # Изменение объекта в сессии не меняет снимок в кэше
+        found.name = "Другое имя"
+    with Session() as third:
+        assert _reader(third, reader_id).name == "Читатель"
+
+
+@pytest.mark.parametrize('value, cached', [(None, False), ([], False), ({}, False), (0, True), ("Читатель", True)])
+def test_falsy_results_are_not_cached(Session, value, cached):
+    calls.clear()
+    with Session() as session:
+        assert _empty(session, value) == value
+        assert _empty(session, value) == value
+    assert calls == (['empty'] if cached else ['empty', 'empty'])
+
+
+def test_notify_only_on_postgresql():
+    executed = []
+
+    def connection(dialect):
+        return SimpleNamespace(dialect=SimpleNamespace(name=dialect),
+                               execute=lambda statement, params: executed.append(params))
+
+    notify_invalidations(connection('sqlite'), {'loans'})
+    notify_invalidations(connection('postgresql'), set())
+    notify_invalidations(connection('postgresql'), {'loans', 'book_copies'})
+    assert executed == [{'channel': 'library_cache', 'tables': 'book_copies,loans'}]
+
+
+def test_db_funcs_results_are_invalidated_after_commit(Session):
+    with Session() as session:
+        assert db.get_all_readers(session) == []
+        db.create_reader(session, "Читатель", "reader@lib.ru")
+        assert [reader.email for reader in db.get_all_readers(session)] == ["reader@lib.ru"]
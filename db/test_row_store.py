@@ -0,0 +1,40 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db import views
+from db.models import Base
+from db.row_store import RowStore
+from db.search_index import SearchIndex
+
+
+def test_empty_store_keeps_column_names():
+    rows = RowStore(names=('id', 'title')).compact()
+    assert len(rows) == 0
+    assert rows.columns == ['id', 'title']
+    assert rows.column('id') == []
+    assert list(rows.take([])) == []
+
+
+def test_empty_store_without_names():
+    rows = RowStore.from_rows([])
+    assert len(rows) == 0
+    assert rows.column('id') == []
+
+
+def test_search_index_on_empty_store():
+    index = SearchIndex(('title',)).refresh(RowStore(names=('id', 'title')).compact())
+    assert len(index.filter("мир")) == 0
+    assert len(index.filter("")) == 0
+
+
+def test_views_on_empty_database():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        fines, totals = views.fine_rows(session)
+        loans, counters = views.loan_rows(session)
+        for rows in (fines, loans, views.book_rows(session), views.copy_rows(session), views.reader_rows(session)):
+            assert len(rows) == 0
+            assert rows.column('id') == []
+            assert len(SearchIndex(('id',)).refresh(rows).filter("1")) == 0
+    assert totals['count'] == 0 and counters['active'] == 0
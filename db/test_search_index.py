@@ -0,0 +1,73 @@
+import pytest
+
+from db.row_store import RowStore
+from db.search_index import SearchIndex
+
+
+ROWS = [
+    {'id': 1, 'title': "Война и мир", 'author': "Толстой"},
+    {'id': 2, 'title': "Мир за стеной", 'author': None},
+    {'id': 3, 'title': "Анна Каренина", 'author': "Толстой"},
+]
+
+
+def _ids(rows):
+    return [row['id'] for row in rows]
+
+
+@pytest.fixture
+def index():
+    return SearchIndex(('title', 'author')).refresh(list(ROWS))
+
+
+@pytest.mark.parametrize('term, expected', [
+    ("мир", [1, 2]), ("МИР", [1, 2]), ("толст", [1, 3]), ("ка", [3]), ("", [1, 2, 3]), ("нет такого", []),
+])
+def test_filter(index, term, expected):
+    assert _ids(index.filter(term)) == expected
+
+
+def test_added_row_is_found(index):
+    index.refresh(ROWS + [{'id': 4, 'title': "Мир Полудня", 'author': "Стругацкие"}])
+    assert _ids(index.filter("мир")) == [1, 2, 4]
+    assert _ids(index.filter("стругац")) == [4]
+
+
+def test_removed_row_is_not_found(index):
+    index.refresh(ROWS[1:])
+    assert _ids(index.filter("мир")) == [2]
+    assert _ids(index.filter("война")) == []
+    assert _ids(index.filter("толст")) == [3]
+
+
+def test_changed_value_is_reindexed(index):
+    rows = list(ROWS)
+    rows[1] = {'id': 2, 'title': "Стена", 'author': None}
+    index.refresh(rows)
+    assert _ids(index.filter("мир")) == [1]
+    assert _ids(index.filter("стен")) == [2]
+
+
+def test_unchanged_fields_are_not_rebuilt(index):
+    postings = dict(index._postings)
+    rows = [dict(row) for row in ROWS]
+    rows[0]['title'] = "Война"
+    index.refresh(rows)
+    assert index._postings['author'] is postings['author']
+    assert index._postings['title'] is not postings['title']
+
+
+def test_index_is_rebuilt_when_most_values_are_dead(index):
+    for number in range(10):
+        index.refresh([{'id': number, 'title': f"Книга {number}", 'author': None}])
+    # Старые значения освобождены, индекс не растет без ограничений
+    assert len(index._values) <= 4
+    assert _ids(index.filter("книга")) == [9]
+
+
+def test_row_store_rows():
+    rows = RowStore.from_rows(ROWS)
+    index = SearchIndex(('title', 'author')).refresh(rows)
+    assert _ids(index.filter("толст")) == [1, 3]
+    index.refresh(rows.take([0, 2]))
+    assert _ids(index.filter("мир")) == [1]
@@ -0,0 +1,30 @@
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import create_engine, text
+
+from db.slow_queries import SlowQueryLog, _jsonable, read_records
+
+
+def test_string_parameters_are_redacted():
+    parameters = {'email': "reader@lib.ru", 'password_hash': "$2b$12$abc", 'id': 7,
+                  'due': date(2026, 1, 24), 'amount': Decimal('10.50'), 'paid': False}
+    assert _jsonable(parameters) == {'email': "<str:13>", 'password_hash': "<str:10>", 'id': 7,
+                                     'due': "2026-01-24", 'amount': "10.50", 'paid': False}
+    assert _jsonable([("+7 900 000-00-00", 1)]) == [["<str:16>", 1]]
+
+
+def test_log_file_has_no_personal_data(tmp_path):
+    path = tmp_path / 'logs' / 'slow.log'
+    log = SlowQueryLog(str(path), threshold_ms=0)
+    log.start()
+    try:
+        engine = create_engine('sqlite://')
+        with engine.connect() as connection:
+            connection.execute(text("SELECT :email, :id"), {'email': "reader@lib.ru", 'id': 3})
+    finally:
+        log.stop()
+
+    records = list(read_records(str(path)))
+    assert records and "reader@lib.ru" not in path.read_text(encoding='utf-8')
+    assert records[-1]['parameters'] == ["<str:13>", 3]
@@ -0,0 +1,99 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine, delete, update
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db import snapshot, views
+from db.models import Base, Book, BookCopy, Genre, Loan, Reader
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    assert db.install_change_tracking(engine)
+    with sessionmaker(bind=engine)() as session:
+        books = [Book(title=title, author="Автор") for title in ("Анна Каренина", "Война и мир", "Идиот")]
+        session.add_all(books)
+        session.flush()
+        session.add_all([
+            BookCopy(book_id=book.id, inventory_number=f"INV-{book.id}-{number}")
+            for book in books[:2] for number in range(2)
+        ])
+        session.add(Reader(name="Читатель", email="reader@lib.ru"))
+        session.commit()
+        yield session
+
+
+def _records(rows):
+    return [row.to_dict() for row in rows]
+
+
+def _snapshot(session, dataset, today=None):
+    stamp = snapshot.snapshot_stamp(session, dataset, today)
+    if dataset == 'books':
+        return views.book_rows(session), stamp
+    return views.copy_rows(session, today), stamp
+
+
+def test_books_catch_up_with_changes(session):
+    rows, stamp = _snapshot(session, 'books')
+    war, idiot = session.query(Book).filter(Book.title.in_(["Война и мир", "Идиот"])).order_by(Book.title)
+    session.execute(update(Book).where(Book.id == war.id).values(title="Бесы"))
+    session.execute(delete(Book).where(Book.id == idiot.id))
+    # SQLite отдает новой книге id удаленной
+    onegin = Book(title="Евгений Онегин", author="Пушкин")
+    session.add(onegin)
+    session.add(BookCopy(book_id=war.id, inventory_number="INV-new"))
+    session.commit()
+
+    assert onegin.id == idiot.id
+
+    synced, current = snapshot.sync_rows(session, 'books', rows, stamp)
+    assert _records(synced) == _records(views.book_rows(session))
+    assert [row['title'] for row in synced] == ["Анна Каренина", "Бесы", "Евгений Онегин"]
+    assert current['token']
+
+
+def test_copies_catch_up_with_loans_and_new_day(session):
+    today = date.today()
+    rows, stamp = _snapshot(session, 'copies', today - timedelta(days=1))
+    copy = session.query(BookCopy).order_by(BookCopy.inventory_number).first()
+    reader = session.query(Reader).one()
+    session.add(Loan(reader_id=reader.id, copy_id=copy.id, loan_date=today - timedelta(days=20),
+                     return_date=today - timedelta(days=1)))
+    session.execute(update(BookCopy).where(BookCopy.id == copy.id).values(available=False))
+    session.commit()
+
+    synced, _ = snapshot.sync_rows(session, 'copies', rows, stamp, today)
+    expected = views.copy_rows(session, today)
+    assert _records(synced) == _records(expected)
+
+
+def test_untracked_or_unattributable_changes_need_full_reload(session):
+    rows, stamp = _snapshot(session, 'books')
+    session.add(Genre(name="Роман"))
+    session.commit()
+    assert snapshot.sync_rows(session, 'books', rows, stamp) is None
+
+    rows, stamp = _snapshot(session, 'books')
+    session.execute(delete(BookCopy).where(BookCopy.inventory_number == "INV-1-0"))
+    session.commit()
+    # Удаленный экземпляр не отнести к книге
+    assert snapshot.sync_rows(session, 'books', rows, stamp) is None
+    assert snapshot.sync_rows(session, 'books', rows, {'token': None}) is None
+
+
+def test_saved_snapshot_round_trip(session, tmp_path):
+    store = snapshot.CatalogSnapshot(str(tmp_path / 'snapshot.sqlite3'))
+    rows, stamp = _snapshot(session, 'books')
+    assert store.save('books', rows, stamp) == len(rows)
+    # Повторная запись без изменений ничего не пишет
+    assert store.save('books', rows, stamp) == 0
+
+    loaded, loaded_stamp = store.load('books')
+    assert loaded_stamp == stamp
+    synced, _ = snapshot.sync_rows(session, 'books', loaded, loaded_stamp)
+    assert _records(synced) == _records(views.book_rows(session))
@@ -0,0 +1,147 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, event, select, text
+from sqlalchemy.orm import sessionmaker
+
+from db import db_funcs as db
+from db.models import Base, Book, BookCopy, Librarian, Loan, Reader
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+
+
+@pytest.fixture
+def loan(session):
+    reader = Reader(name="Читатель", email="reader@lib.ru")
+    book = Book(title="Книга")
+    session.add_all([reader, book])
+    session.flush()
+    copy = BookCopy(book_id=book.id, inventory_number="INV-1", available=False)
+    session.add(copy)
+    session.flush()
+    loan = Loan(reader_id=reader.id, copy_id=copy.id, loan_date=date(2026, 1, 10), return_date=date(2026, 1, 24))
+    session.add(loan)
+    session.commit()
+    return loan.id, copy.id
+
+
+def test_return_releases_copy(session, loan):
+    loan_id, copy_id = loan
+    returned = db.return_loan(session, loan_id, actual_return_date=date(2026, 1, 20))
+    assert returned.returned and returned.actual_return_date == date(2026, 1, 20)
+    assert session.scalar(select(BookCopy.available).where(BookCopy.id == copy_id)) is True
+
+
+def test_second_return_keeps_copy_and_pending_changes(session, loan):
+    loan_id, copy_id = loan
+    assert db.return_loan(session, loan_id)
+    # Экземпляр снова выдан - повторный возврат старой выдачи не должен его освобождать
+    db.update_copy(session, copy_id, available=False)
+
+    pending = Reader(name="Ожидает", email="pending@lib.ru")
+    session.add(pending)
+    assert db.return_loan(session, loan_id)
+    assert pending in session
+    assert session.scalar(select(BookCopy.available).where(BookCopy.id == copy_id)) is False
+
+
+def test_missing_row_does_not_discard_pending_changes(session, loan):
+    pending = Reader(name="Ожидает", email="pending@lib.ru")
+    session.add(pending)
+    assert db.update_copy(session, 999, condition='poor') is None
+    assert pending in session
+
+
+def test_return_with_missing_copy_is_not_saved(session, loan):
+    loan_id, copy_id = loan
+    session.execute(BookCopy.__table__.delete().where(BookCopy.id == copy_id))
+    session.commit()
+
+    assert db.return_loan(session, loan_id) is None
+    assert session.scalar(select(Loan.returned).where(Loan.id == loan_id)) is False
+
+
+def test_update_bumps_version_and_detects_conflict(session, loan):
+    _, copy_id = loan
+    version = db.get_copy_by_id(session, copy_id).version
+    updated = db.update_copy(session, copy_id, expected_version=version, condition='fair')
+    assert updated.version == version + 1
+
+    conflict = db.update_copy(session, copy_id, expected_version=version, condition='poor')
+    assert isinstance(conflict, db.UpdateConflict) and not conflict
+    assert (conflict.expected_version, conflict.current_version) == (version, version + 1)
+    assert session.scalar(select(BookCopy.condition).where(BookCopy.id == copy_id)) == 'fair'
+
+
+def test_return_conflict_leaves_loan_open(session, loan):
+    loan_id, copy_id = loan
+    version = db.get_loan_by_id(session, loan_id).version
+    db.update_loan(session, loan_id, return_date=date(2026, 2, 1))
+
+    result = db.return_loan(session, loan_id, expected_version=version)
+    assert isinstance(result, db.UpdateConflict)
+    assert session.scalar(select(Loan.returned).where(Loan.id == loan_id)) is False
+    assert session.scalar(select(BookCopy.available).where(BookCopy.id == copy_id)) is False
+
+
+def test_return_with_fine_is_atomic(session, loan):
+    loan_id, copy_id = loan
+    # Библиотекаря нет - штраф не вставится, возврат и состояние экземпляра тоже откатываются
+    session.execute(text("PRAGMA foreign_keys = ON"))
+    result, fine = db.return_loan_with_fine(session, loan_id, 999, condition='poor', fine_amount=50)
+    assert result is None and fine is None
+    assert session.scalar(select(Loan.returned).where(Loan.id == loan_id)) is False
+    assert session.scalar(select(BookCopy.condition).where(BookCopy.id == copy_id)) == 'good'
+
+
+def test_return_with_fine(session, loan):
+    loan_id, copy_id = loan
+    librarian = Librarian(name="Библиотекарь", email="lib@lib.ru", password_hash="-")
+    session.add(librarian)
+    session.commit()
+
+    result, fine = db.return_loan_with_fine(session, loan_id, librarian.id, condition='poor', fine_amount=50)
+    assert result.returned and fine.amount == 50
+    assert session.scalar(select(BookCopy.condition).where(BookCopy.id == copy_id)) == 'poor'
+
+
+@pytest.fixture
+def scope(session):
+    saved = db._engine, db._session_factory
+    db.configure_engine(session.get_bind())
+    yield
+    db._engine, db._session_factory = saved
+
+
+def test_session_scope_returns_committed_values(session, loan, scope):
+    loan_id, copy_id = loan
+    with db.session_scope() as scoped:
+        copy = db.get_copy_by_id(scoped, copy_id)
+        librarian = Librarian(name="Библиотекарь", email="lib@lib.ru", password_hash="-")
+        scoped.add(librarian)
+        scoped.commit()
+        # Значение из базы, а не из памяти: строку изменили в обход объекта
+        scoped.execute(BookCopy.__table__.update().where(BookCopy.id == copy_id).values(location="Зал 2"))
+        scoped.commit()
+
+    # После закрытия сессии столбцы доступны без запросов к базе
+    assert copy.location == "Зал 2" and copy.version == 1
+    assert librarian.id and librarian.hire_date == date.today()
+
+
+def test_read_only_scope_does_not_reload(session, loan, scope):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(session.get_bind(), 'before_cursor_execute', listener)
+    try:
+        with db.session_scope() as scoped:
+            db.get_copy_by_id(scoped, loan[1])
+    finally:
+        event.remove(session.get_bind(), 'before_cursor_execute', listener)
+    assert len(statements) == 1
@@ -0,0 +1,556 @@
+from datetime import date
+
+from sqlalchemy import select, func, case, cast, or_, String
+
+from .models import Reader, Book, BookCopy, Genre, Librarian, Loan, Fine, genres_books
+from .query_cache import cached_query
+from .row_store import RowStore
+
+
+# Готовые строки для таблиц интерфейса. Каждая функция выполняет фиксированное
+# число запросов (без обращения к БД на каждую строку) и не зависит от Tk,
+# поэтому ее можно профилировать, кэшировать и использовать вне приложения.
+# Большие списки вкладок возвращаются в колоночном RowStore, а не списком словарей.
+# Ошибки БД не перехватываются - их показывает вызывающий код.
+
+UNKNOWN = "Неизвестно"
+
+
+def format_date(value):
+    return value.strftime("%d.%m.%Y") if value else "-"
+
+
+def _active_loan_counts(session, today, reader_ids=None):
+    """Активные и просроченные выдачи по читателям: {reader_id: (активные, просроченные)}"""
+    statement = (
+        select(
+            Loan.reader_id,
+            func.count(Loan.id),
+            func.sum(case((Loan.return_date < today, 1), else_=0))
+        )
+        .where(Loan.returned == False)
+        .group_by(Loan.reader_id)
+    )
+    if reader_ids is not None:
+        if not reader_ids:
+            return {}
+        statement = statement.where(Loan.reader_id.in_(reader_ids))
+    return {reader_id: (active, overdue or 0) for reader_id, active, overdue in session.execute(statement)}
+
+
+def _copy_counts(session, book_ids=None):
+    """Всего и доступных экземпляров по книгам: {book_id: (всего, доступно)}"""
+    statement = (
+        select(
+            BookCopy.book_id,
+            func.count(BookCopy.id),
+            func.sum(case((BookCopy.available == True, 1), else_=0))
+        )
+        .group_by(BookCopy.book_id)
+    )
+    if book_ids is not None:
+        if not book_ids:
+            return {}
+        statement = statement.where(BookCopy.book_id.in_(book_ids))
+    return {book_id: (total, available or 0) for book_id, total, available in session.execute(statement)}
+
+
+def book_rows(session, book_ids=None):
+    """
+    Книги с количеством экземпляров и жанрами (вкладка «Книги»).
+    book_ids - только эти книги (обновление строк снимка); по умолчанию все
+    """
+    counts = _copy_counts(session, book_ids)
+
+    genres = {}
+    statement = (
+        select(genres_books.c.book_id, Genre.name)
+        .join(Genre, Genre.id == genres_books.c.genre_id)
+        .order_by(genres_books.c.book_id, Genre.name)
+    )
+    if book_ids is not None:
+        statement = statement.where(genres_books.c.book_id.in_(book_ids))
+    for book_id, name in session.execute(statement):
+        genres.setdefault(book_id, []).append(name)
+
+    rows = RowStore(names=('id', 'title', 'author', 'isbn', 'year', 'genre', 'total_copies', 'available_copies'))
+    statement = select(Book.id, Book.title, Book.author, Book.isbn, Book.publish_year).order_by(Book.title)
+    if book_ids is not None:
+        statement = statement.where(Book.id.in_(book_ids))
+    for book_id, title, author, isbn, year in session.execute(statement):
+        total, available = counts.get(book_id, (0, 0))
+        rows.append({
+            'id': book_id,
+            'title': title,
+            'author': author,
+            'isbn': isbn,
+            'year': year,
+            'genre': ", ".join(genres[book_id]) if book_id in genres else "Не указан",
+            'total_copies': total,
+            'available_copies': available
+        })
+    return rows.compact()
+
+
+def _active_loans_subquery(copy_ids=None):
+    # Последняя активная выдача каждого экземпляра
+    statement = select(Loan.copy_id, func.max(Loan.id).label('loan_id')).where(Loan.returned == False)
+    if copy_ids is not None:
+        statement = statement.where(Loan.copy_id.in_(copy_ids))
+    return statement.group_by(Loan.copy_id).subquery()
+
+
+def copy_readers(session):
+    """Читатели экземпляров на руках (по последней активной выдаче): {copy_id: имя}"""
+    active_loan = _active_loans_subquery()
+    statement = (
+        select(active_loan.c.copy_id, Reader.name)
+        .join(Loan, Loan.id == active_loan.c.loan_id)
+        .join(Reader, Reader.id == Loan.reader_id)
+    )
+    return dict(session.execute(statement).all())
+
+
+def copy_rows(session, today=None, copy_ids=None):
+    """
+    Экземпляры со статусом, сроком возврата и читателем (вкладка «Экземпляры»).
+    copy_ids - только эти экземпляры (обновление строк снимка); по умолчанию все
+    """
+    today = today or date.today()
+
+    active_loan = _active_loans_subquery(copy_ids)
+    statement = (
+        select(
+            BookCopy.id, BookCopy.inventory_number, BookCopy.condition, BookCopy.available, BookCopy.status,
+            Book.title, Book.author, Loan.return_date, Reader.name
+        )
+        .outerjoin(Book, Book.id == BookCopy.book_id)
+        .outerjoin(active_loan, active_loan.c.copy_id == BookCopy.id)
+        .outerjoin(Loan, Loan.id == active_loan.c.loan_id)
+        .outerjoin(Reader, Reader.id == Loan.reader_id)
+        .order_by(BookCopy.inventory_number)
+    )
+    if copy_ids is not None:
+        statement = statement.where(BookCopy.id.in_(copy_ids))
+
+    rows = RowStore(names=(
+        'id', 'inventory_number', 'book_title', 'author', 'status', 'due_date', 'reader', 'condition', 'copy_status'
+    ))
+    for (copy_id, inventory_number, condition, available, status,
+         title, author, return_date, reader_name) in session.execute(statement):
+        if available:
+            status_text = "В наличии"
+            reader_name = None
+            return_date = None
+        elif return_date and return_date < today:
+            status_text = "Просрочена"
+        else:
+            status_text = "На руках"
+
+        rows.append({
+            'id': copy_id,
+            'inventory_number': inventory_number,
+            'book_title': title or UNKNOWN,
+            'author': author or UNKNOWN,
+            'status': status_text,
+            'due_date': format_date(return_date),
+            'reader': reader_name or "-",
+            'condition': condition,
+            'copy_status': status
+        })
+    return rows.compact()
+
+
+def reader_rows(session, readers=None, today=None):
+    """
+    Читатели с количеством активных и просроченных выдач.
+    readers - уже выбранные читатели (поиск, страница); по умолчанию все
+    """
+    today = today or date.today()
+    if readers is None:
+        readers = session.execute(
+            select(Reader.id, Reader.name, Reader.email, Reader.phone_number, Reader.registration_date)
+            .order_by(Reader.id)
+        ).all()
+        counts = _active_loan_counts(session, today)
+    else:
+        counts = _active_loan_counts(session, today, [reader.id for reader in readers])
+
+    rows = RowStore(names=('id', 'name', 'email', 'phone', 'reg_date', 'active_loans', 'overdue'))
+    for reader in readers:
+        active, overdue = counts.get(reader.id, (0, 0))
+        rows.append({
+            'id': reader.id,
+            'name': reader.name,
+            'email': reader.email,
+            'phone': reader.phone_number,
+            'reg_date': reader.registration_date,
+            'active_loans': active,
+            'overdue': overdue
+        })
+    return rows.compact()
+
+
+def issue_reader_rows(session, search_term='', limit=50):
+    """
+    Читатели для диалога выдачи: поиск по имени и email,
+    а если ничего не найдено - по телефону
+    """
+    statement = select(Reader).order_by(Reader.id)
+    if search_term:
+        readers = session.scalars(statement.where(or_(
+            Reader.name.ilike(f"%{search_term}%"),
+            Reader.email.ilike(f"%{search_term}%")
+        ))).all()
+        if not readers:
+            readers = session.scalars(statement.where(Reader.phone_number.contains(search_term))).all()
+    else:
+        readers = session.scalars(statement.limit(limit)).all()
+    return reader_rows(session, readers)
+
+
+def _loan_status(returned, return_date, today):
+    if returned:
+        return "🟦 Возвращена", ""
+    if return_date and return_date < today:
+        return "🔴 Просрочена", "red"
+    if return_date and (return_date - today).days <= 3:
+        return "🟡 Скоро срок", "orange"
+    return "🟢 Активна", "green"
+
+
+def _loan_statement():
+    return (
+        select(
+            Loan.id, Loan.reader_id, Loan.copy_id, Loan.loan_date, Loan.return_date,
+            Loan.actual_return_date, Loan.returned, Reader.name, BookCopy.inventory_number, Book.title
+        )
+        .outerjoin(Reader, Reader.id == Loan.reader_id)
+        .outerjoin(BookCopy, BookCopy.id == Loan.copy_id)
+        .outerjoin(Book, Book.id == BookCopy.book_id)
+    )
+
+
+def loan_rows(session, today=None):
+    """
+    Выдачи с читателем, книгой и статусом (вкладка «Выдачи»).
+    Возвращает (строки, счетчики активных / просроченных / к возврату сегодня)
+    """
+    today = today or date.today()
+    rows = RowStore(names=(
+        'id', 'reader_name', 'reader_id', 'book_title', 'inventory_number', 'issue_date', 'due_date',
+        'actual_return_date', 'returned', 'status_text', 'status_color', 'copy_id'
+    ))
+    counters = {'active': 0, 'overdue': 0, 'today_return': 0}
+
+    for (loan_id, reader_id, copy_id, loan_date, return_date, actual_return_date, returned,
+         reader_name, inventory_number, title) in session.execute(_loan_statement().order_by(Loan.loan_date.desc())):
+        status_text, status_color = _loan_status(returned, return_date, today)
+        if not returned:
+            counters['active'] += 1
+            if return_date and return_date < today:
+                counters['overdue'] += 1
+            if return_date == today:
+                counters['today_return'] += 1
+
+        rows.append({
+            'id': loan_id,
+            'reader_name': reader_name or UNKNOWN,
+            'reader_id': reader_id,
+            'book_title': title or UNKNOWN,
+            'inventory_number': inventory_number or "N/A",
+            'issue_date': loan_date,
+            'due_date': return_date,
+            'actual_return_date': actual_return_date,
+            'returned': returned,
+            'status_text': status_text,
+            'status_color': status_color,
+            'copy_id': copy_id
+        })
+    return rows.compact(), counters
+
+
+def fine_loan_rows(session, search_term='', active_only=False, today=None):
+    """
+    Выдачи для диалога создания штрафа: сначала просроченные, затем активные.
+    search_term ищется в номере выдачи, имени читателя и названии книги
+    """
+    today = today or date.today()
+    statement = _loan_statement().where(Reader.id != None)
+    if active_only:
+        statement = statement.where(Loan.returned == False)
+    if search_term:
+        statement = statement.where(or_(
+            cast(Loan.id, String).contains(search_term),
+            Reader.name.ilike(f"%{search_term}%"),
+            Book.title.ilike(f"%{search_term}%")
+        ))
+
+    order = Loan.loan_date if active_only else Loan.loan_date.desc()
+
+    rows = []
+    for (loan_id, _, _, loan_date, return_date, _, returned,
+         reader_name, _, title) in session.execute(statement.order_by(order)):
+        if returned:
+            status_text = "Возвращена"
+        elif return_date and return_date < today:
+            status_text = "Просрочена"
+        else:
+            status_text = "Активна"
+
+        rows.append({
+            'id': loan_id,
+            'reader_name': reader_name,
+            'book_title': title or UNKNOWN,
+            'issue_date': format_date(loan_date),
+            'due_date': format_date(return_date),
+            'status': status_text,
+            'sort_date': return_date or date.max
+        })
+
+    if active_only:
+        # Просроченные по сроку возврата, активные в порядке выдачи
+        rows.sort(key=lambda row: (row['status'] != "Просрочена",
+                                   row['sort_date'] if row['status'] == "Просрочена" else date.min))
+    else:
+        rows.sort(key=lambda row: (row['status'] != "Просрочена", row['status'] != "Активна"))
+    return rows
+
+
+def fine_rows(session):
+    """
+    Штрафы с читателем, книгой и библиотекарем (вкладка «Штрафы»).
+    Возвращает (строки, итоги по количеству и суммам)
+    """
+    statement = (
+        select(
+            Fine.id, Fine.loan_id, Fine.amount, Fine.issued_date, Fine.paid,
+            Reader.name, Book.title, Librarian.name
+        )
+        .join(Loan, Loan.id == Fine.loan_id)
+        .outerjoin(Reader, Reader.id == Loan.reader_id)
+        .outerjoin(BookCopy, BookCopy.id == Loan.copy_id)
+        .outerjoin(Book, Book.id == BookCopy.book_id)
+        .outerjoin(Librarian, Librarian.id == Fine.librarian_id)
+        .order_by(Fine.issued_date.desc())
+    )
+
+    rows = RowStore(names=(
+        'id', 'reader_name', 'book_title', 'amount', 'issued_date', 'status_text', 'status_color', 'loan_id',
+        'librarian_name', 'paid'
+    ))
+    totals = {'count': 0, 'unpaid_count': 0, 'amount': 0, 'unpaid_amount': 0}
+    for (fine_id, loan_id, amount, issued_date, paid,
+         reader_name, title, librarian_name) in session.execute(statement):
+        totals['count'] += 1
+        totals['amount'] += amount
+        if paid:
+            status_text, status_color = "✅ Оплачен", "green"
+        else:
+            status_text, status_color = "❌ Не оплачен", "red"
+            totals['unpaid_count'] += 1
+            totals['unpaid_amount'] += amount
+
+        rows.append({
+            'id': fine_id,
+            'reader_name': reader_name or UNKNOWN,
+            'book_title': title or UNKNOWN,
+            'amount': amount,
+            'issued_date': issued_date,
+            'status_text': status_text,
+            'status_color': status_color,
+            'loan_id': loan_id,
+            'librarian_name': librarian_name or UNKNOWN,
+            'paid': paid
+        })
+    return rows.compact(), totals
+
+
+def librarian_rows(session):
+    """
+    Библиотекари (вкладка «Библиотекари»).
+    Возвращает (строки, счетчики всего / администраторов)
+    """
+    statement = select(Librarian.id, Librarian.name, Librarian.email, Librarian.position, Librarian.hire_date)
+    rows = []
+    counters = {'total': 0, 'admins': 0}
+    for librarian_id, name, email, position, hire_date in session.execute(statement.order_by(Librarian.id)):
+        counters['total'] += 1
+        if position and "администратор" in position.lower():
+            counters['admins'] += 1
+        rows.append({
+            'id': librarian_id,
+            'name': name,
+            'email': email,
+            'position': position or "Не указана",
+            'hire_date': format_date(hire_date)
+        })
+    return rows, counters
+
+
+def issue_book_rows(session, search_term=''):
+    """
+    Книги с доступными экземплярами для диалога выдачи.
+    При поиске - совпадение любого слова в названии или авторе,
+    сортировка по числу совпадений, затем по доступным экземплярам
+    """
+    counts = _copy_counts(session)
+    statement = select(Book.id, Book.title, Book.author).order_by(Book.title)
+    search_words = search_term.lower().split()
+    if search_words:
+        statement = statement.where(or_(*[
+            or_(Book.title.ilike(f"%{word}%"), Book.author.ilike(f"%{word}%"))
+            for word in search_words
+        ]))
+
+    rows = []
+    for book_id, title, author in session.execute(statement):
+        total, available = counts.get(book_id, (0, 0))
+        if available == 0:
+            continue
+        rows.append({
+            'id': book_id,
+            'title': title,
+            'author': author,
+            'available_copies': available,
+            'total_copies': total
+        })
+
+    if search_words:
+        def relevance(row):
+            title_lower = (row['title'] or "").lower()
+            author_lower = (row['author'] or "").lower()
+            matches = sum(word in title_lower for word in search_words) + \
+                sum(word in author_lower for word in search_words)
+            return matches, row['available_copies']
+
+        rows.sort(key=relevance, reverse=True)
+    return rows
+
+
+@cached_query('readers', 'books', 'loans', 'fines')
+def statistics_counts(session):
+    """Счетчики для главной вкладки: читатели, книги, активные выдачи, неоплаченные штрафы"""
+    readers = session.scalar(select(func.count(Reader.id)))
+    books = session.scalar(select(func.count(Book.id)))
+    active_loans = session.scalar(select(func.count(Loan.id)).where(Loan.returned == False))
+    unpaid_fines = session.scalar(select(func.count(Fine.id)).where(Fine.paid == False))
+    return readers, books, active_loans, unpaid_fines
+
+
+def catalog_rows(session, search_term='', limit=50, offset=0):
+    """
+    Каталог для терминалов: книги с количеством экземпляров.
+    Поиск по названию, автору и ISBN
+    """
+    statement = select(Book.id, Book.title, Book.author, Book.isbn, Book.publish_year).order_by(Book.title, Book.id)
+    if search_term:
+        statement = statement.where(or_(
+            Book.title.ilike(f"%{search_term}%"),
+            Book.author.ilike(f"%{search_term}%"),
+            Book.isbn.ilike(f"%{search_term}%")
+        ))
+
+    page = session.execute(statement.offset(offset).limit(limit)).all()
+    # Экземпляры считаются только для книг страницы
+    counts = _copy_counts(session, [book_id for book_id, *_ in page])
+
+    rows = []
+    for book_id, title, author, isbn, year in page:
+        total, available = counts.get(book_id, (0, 0))
+        rows.append({
+            'id': book_id,
+            'title': title,
+            'author': author,
+            'isbn': isbn,
+            'year': year,
+            'total_copies': total,
+            'available_copies': available
+        })
+    return rows
+
+
+def book_availability(session, book_id):
+    """Книга и ее экземпляры с местоположением и сроком возврата (None, если книги нет)"""
+    book = session.execute(
+        select(Book.id, Book.title, Book.author, Book.isbn, Book.publish_year).where(Book.id == book_id)
+    ).first()
+    if book is None:
+        return None
+
+    active_loan = (
+        select(Loan.copy_id, func.max(Loan.return_date).label('return_date'))
+        .where(Loan.returned == False)
+        .group_by(Loan.copy_id)
+        .subquery()
+    )
+    statement = (
+        select(BookCopy.inventory_number, BookCopy.location, BookCopy.available, active_loan.c.return_date)
+        .outerjoin(active_loan, active_loan.c.copy_id == BookCopy.id)
+        .where(BookCopy.book_id == book_id)
+        .order_by(BookCopy.inventory_number)
+    )
+    copies = [
+        {
+            'inventory_number': inventory_number,
+            'location': location,
+            'available': available,
+            'due_date': None if available else return_date
+        }
+        for inventory_number, location, available, return_date in session.execute(statement)
+    ]
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'isbn': book.isbn,
+        'year': book.publish_year,
+        'total_copies': len(copies),
+        'available_copies': sum(1 for copy in copies if copy['available']),
+        'copies': copies
+    }
+
+
+def reader_status(session, reader_id, email, today=None):
+    """
+    Активные выдачи и неоплаченные штрафы читателя. email подтверждает, что запрос
+    делает сам читатель: None, если читателя нет или email не совпадает.
+    Имя читателя не возвращается
+    """
+    today = today or date.today()
+    found = session.scalar(
+        select(Reader.id).where(Reader.id == reader_id, func.lower(Reader.email) == email.strip().lower())
+    )
+    if found is None:
+        return None
+
+    statement = (
+        select(Loan.id, Loan.loan_date, Loan.return_date, Book.title, BookCopy.inventory_number)
+        .join(BookCopy, BookCopy.id == Loan.copy_id)
+        .join(Book, Book.id == BookCopy.book_id)
+        .where(Loan.reader_id == reader_id, Loan.returned == False)
+        .order_by(Loan.return_date)
+    )
+    loans = [
+        {
+            'id': loan_id,
+            'book_title': title,
+            'inventory_number': inventory_number,
+            'loan_date': loan_date,
+            'due_date': return_date,
+            'overdue': bool(return_date and return_date < today)
+        }
+        for loan_id, loan_date, return_date, title, inventory_number in session.execute(statement)
+    ]
+    unpaid_count, unpaid_amount = session.execute(
+        select(func.count(Fine.id), func.coalesce(func.sum(Fine.amount), 0))
+        .join(Loan, Loan.id == Fine.loan_id)
+        .where(Loan.reader_id == reader_id, Fine.paid == False)
+    ).one()
+    return {
+        'id': reader_id,
+        'active_loans': loans,
+        'overdue_loans': sum(1 for loan in loans if loan['overdue']),
+        'unpaid_fines': unpaid_count,
+        'unpaid_amount': unpaid_amount
+    }